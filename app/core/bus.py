@@ -0,0 +1,216 @@
+"""Локальная шина между воркерами uvicorn (режим WORKERS > 1).
+
+Воркеры выбирают ведущего: кто первым занял порт шины на 127.0.0.1 (BUS_PORT),
+тот и ведёт таймеры — отсчёт, журнал, слушатели DonationAlerts. Остальные
+подключаются к нему ведомыми: получают события и раздают их своим клиентам
+/ws, /timer_cfg и /control, а команды панели пересылают ведущему. Если ведущий
+пропал, ведомые снова разыгрывают порт, и победитель поднимает таймеры из БД.
+
+TCP на loopback, а не Unix-сокет: приложение в первую очередь собирается под Windows.
+Сообщение — заголовок ``<I длина тела> <B тип> <H длина timer_id>``, затем timer_id
+и полезная нагрузка (байты, смысл зависит от типа).
+"""
+
+import asyncio
+import random
+import struct
+import traceback
+
+# Роли процесса
+SINGLE = "single"  # один воркер, шина не используется
+LEADER = "leader"
+FOLLOWER = "follower"
+
+# Ведущий → ведомые
+TIME = 1  # текст кадра времени DD:HH:MM:SS
+DELTA = 2  # кадр бинарного протокола (app.core.protocol)
+CONTROL = 3  # запись лога панели (JSON)
+CFG = 4  # цвет текста таймера
+HISTORY = 5  # запись лога из истории: только в буфер, без рассылки
+READY = 6  # ведущий готов, дальше идёт снимок состояния
+REPLY = 7  # ответ на команду: <I id> + текст
+DONE = 8  # команда выполнена: <I id>
+# Ведомый → ведущий
+COMMAND = 9  # команда панели: <I id> + текст
+
+_HEADER = struct.Struct("<IBH")
+_ID = struct.Struct("<I")
+
+# Сколько байт может скопиться в буфере отправки ведомому, прежде чем он будет отключён
+MAX_PEER_BUFFER = 16 * 1024 * 1024
+# Пауза между попытками выбрать ведущего, секунд (со случайной добавкой)
+RETRY_DELAY = 0.2
+
+
+def encode(kind: int, timer_id: str, payload: bytes = b"") -> bytes:
+    """Собрать сообщение шины."""
+    tid = timer_id.encode()
+    return _HEADER.pack(len(tid) + len(payload), kind, len(tid)) + tid + payload
+
+
+def pack_id(message_id: int, text: str = "") -> bytes:
+    """Полезная нагрузка команды и ответа: id команды и текст."""
+    return _ID.pack(message_id) + text.encode()
+
+
+def unpack_id(payload: bytes) -> tuple:
+    """Разобрать нагрузку команды и ответа: (id, текст)."""
+    return _ID.unpack_from(payload)[0], payload[_ID.size:].decode()
+
+
+async def _read(reader: asyncio.StreamReader) -> tuple:
+    """Прочитать одно сообщение: (тип, timer_id, нагрузка)."""
+    size, kind, tid_len = _HEADER.unpack(await reader.readexactly(_HEADER.size))
+    body = await reader.readexactly(size)
+    return kind, body[:tid_len].decode(), body[tid_len:]
+
+
+class Bus:
+    """Шина процесса: роль, соединения с ведомыми (у ведущего) или с ведущим (у ведомого).
+
+    Обработчики назначает приложение:
+    - on_event(kind, timer_id, payload) — у ведомого, для событий ведущего;
+    - on_command(timer_id, message_id, text, writer) — у ведущего, корутина;
+    - on_peer(writer) — у ведущего, отправить новому ведомому снимок состояния;
+    - on_promote() — корутина, ведомый стал ведущим.
+    """
+
+    def __init__(self) -> None:
+        self.role = SINGLE
+        self.peers: set = set()
+        self.on_event = None
+        self.on_command = None
+        self.on_peer = None
+        self.on_promote = None
+        self._port = 0
+        self._server: asyncio.AbstractServer | None = None
+        self._leader: asyncio.StreamWriter | None = None
+        self._reader: asyncio.StreamReader | None = None
+        self._ready = asyncio.Event()
+        self._task: asyncio.Task | None = None
+
+    async def start(self, port: int) -> str:
+        """Выбрать роль. Ведомый возвращается, когда ведущий готов; события начнёт читать follow()."""
+        self._port = port
+        await self._elect()
+        return self.role
+
+    async def _elect(self) -> None:
+        """Занять порт шины (стать ведущим) или подключиться к тому, кто его занял."""
+        while True:
+            try:
+                self._server = await asyncio.start_server(self._serve_peer, "127.0.0.1", self._port)
+                self.role = LEADER
+                return
+            except OSError:
+                pass
+            try:
+                reader, writer = await asyncio.open_connection("127.0.0.1", self._port)
+                kind, _, _ = await _read(reader)
+                if kind == READY:
+                    self._reader, self._leader = reader, writer
+                    self.role = FOLLOWER
+                    return
+                writer.close()
+            except (OSError, asyncio.IncompleteReadError):
+                pass
+            # Ведущий только что упал или ещё не отпустил порт — пробуем снова
+            await asyncio.sleep(RETRY_DELAY * (1 + random.random()))
+
+    def set_ready(self) -> None:
+        """Ведущий поднял таймеры: можно принимать ведомых."""
+        self._ready.set()
+
+    def follow(self) -> None:
+        """Начать читать события ведущего (у ведомого)."""
+        self._task = asyncio.create_task(self._follow())
+
+    async def _follow(self) -> None:
+        while True:
+            # Связь с ведущим есть, дальше от него идёт снимок состояния
+            self.on_event(READY, "", b"")
+            try:
+                while True:
+                    kind, timer_id, payload = await _read(self._reader)
+                    try:
+                        self.on_event(kind, timer_id, payload)
+                    except Exception:
+                        traceback.print_exc()
+            except (OSError, asyncio.IncompleteReadError):
+                pass
+            self._leader.close()
+            self._leader = self._reader = None
+            # Ведущий пропал: переизбрание
+            await self._elect()
+            if self.role == LEADER:
+                try:
+                    await self.on_promote()
+                finally:
+                    self.set_ready()
+                return
+
+    async def _serve_peer(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Соединение ведущего с одним ведомым: снимок, затем события; входящие — команды."""
+        await self._ready.wait()
+        writer.write(encode(READY, ""))
+        self.on_peer(writer)
+        self.peers.add(writer)
+        try:
+            while True:
+                kind, timer_id, payload = await _read(reader)
+                if kind == COMMAND:
+                    # По одной: команды ведомого выполняются в том порядке, в каком пришли
+                    message_id, text = unpack_id(payload)
+                    try:
+                        await self.on_command(timer_id, message_id, text, writer)
+                    except Exception:
+                        traceback.print_exc()
+        except (OSError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.peers.discard(writer)
+            writer.close()
+
+    def _write(self, writer: asyncio.StreamWriter, data: bytes) -> None:
+        """Записать готовое сообщение в соединение; безнадёжно отставшего ведомого отключить."""
+        if writer.is_closing():
+            return
+        if writer.transport.get_write_buffer_size() > MAX_PEER_BUFFER:
+            # Переподключится и получит свежий снимок
+            writer.close()
+            self.peers.discard(writer)
+            return
+        writer.write(data)
+
+    def send(self, writer: asyncio.StreamWriter, kind: int, timer_id: str, payload: bytes = b"") -> None:
+        """Отправить сообщение одному ведомому."""
+        self._write(writer, encode(kind, timer_id, payload))
+
+    def publish(self, kind: int, timer_id: str, payload: bytes = b"") -> None:
+        """Разослать событие всем ведомым (у ведущего; без ведомых ничего не делает)."""
+        if not self.peers:
+            return
+        data = encode(kind, timer_id, payload)
+        for writer in list(self.peers):
+            self._write(writer, data)
+
+    def to_leader(self, kind: int, timer_id: str, payload: bytes = b"") -> bool:
+        """Отправить сообщение ведущему (у ведомого). False — связи с ведущим сейчас нет."""
+        if self._leader is None or self._leader.is_closing():
+            return False
+        self._leader.write(encode(kind, timer_id, payload))
+        return True
+
+    async def close(self) -> None:
+        """Закрыть сервер и соединения шины (при остановке воркера)."""
+        if self._task is not None:
+            self._task.cancel()
+        if self._server is not None:
+            self._server.close()
+        for writer in list(self.peers) + ([self._leader] if self._leader else []):
+            writer.close()
+        self.peers.clear()
+
+
+# Шина процесса
+bus = Bus()
@@ -0,0 +1,245 @@
+"""Наборы подписчиков WebSocket: конкурентная рассылка с ограниченной очередью на клиента.
+
+Каждый подписчик получает свою очередь исходящих сообщений и отдельную задачу-отправитель,
+поэтому медленный клиент не задерживает остальных. Для «тиковых» каналов очередь схлопывается
+до последнего значения, а клиенты, которые не успевают разбирать очередь, отключаются.
+
+Сообщение рассылки собирается один раз (Frame — готовое ASGI-сообщение websocket.send
+или кусок HTTP-ответа для потока SSE) и один и тот же объект уходит во все сокеты без
+повторной упаковки на каждого клиента. Подписчиком может быть любой объект с корутинами
+send(message) и close(code=...), как у WebSocket.
+"""
+
+import asyncio
+import time
+import weakref
+from collections import deque
+
+from app.core import metrics
+
+# Сколько секунд ждать отправки одного сообщения, прежде чем считать клиента зависшим
+SEND_TIMEOUT = 5.0
+# Максимальная длина очереди исходящих сообщений на одного клиента
+MAX_QUEUE = 64
+
+
+class Frame:
+    """Готовое к отправке сообщение: один объект на событие для всех получателей."""
+
+    __slots__ = ("message", "topic")
+
+    def __init__(self, data: str | bytes, topic: str | None = None) -> None:
+        key = "bytes" if isinstance(data, bytes) else "text"
+        self.message = {"type": "websocket.send", key: data}
+        # Тема для схлопывания очереди: в канале с несколькими видами кадров
+        # новый кадр вытесняет только устаревший кадр той же темы
+        self.topic = topic
+
+    @classmethod
+    def chunk(cls, body: bytes) -> "Frame":
+        """Кусок потокового HTTP-ответа (Server-Sent Events) вместо сообщения WebSocket."""
+        frame = cls.__new__(cls)
+        frame.message = {"type": "http.response.body", "body": body, "more_body": True}
+        frame.topic = None
+        return frame
+
+
+def as_frame(msg) -> Frame:
+    """Привести строку, байты или готовый Frame к Frame."""
+    return msg if isinstance(msg, Frame) else Frame(msg)
+
+
+class Subscriber:
+    """Подписчик набора: сокет, очередь исходящих сообщений и задача-отправитель."""
+
+    __slots__ = ("owner", "ws", "queue", "wakeup", "task", "last_seen")
+
+    def __init__(self, owner: "ClientSet", ws) -> None:
+        self.owner = owner
+        self.ws = ws
+        self.queue: deque = deque()
+        self.wakeup = asyncio.Event()
+        self.task = asyncio.create_task(self._run())
+        # Когда от клиента последний раз что-то приходило (time.monotonic())
+        self.last_seen = time.monotonic()
+
+    def touch(self) -> None:
+        """Отметить, что клиент жив: от него пришло сообщение."""
+        self.last_seen = time.monotonic()
+
+    def push(self, msg) -> bool:
+        """Поставить сообщение (str, bytes или Frame) в очередь клиента.
+
+        Вернуть False, если очередь переполнена.
+        """
+        frame = as_frame(msg)
+        if self.owner.conflate:
+            # «Последнее значение побеждает»: устаревшие тики не отправляем
+            if frame.topic is None:
+                self.queue.clear()
+            else:
+                # В очереди не больше одного кадра каждой темы
+                for i, queued in enumerate(self.queue):
+                    if queued.topic == frame.topic:
+                        del self.queue[i]
+                        break
+        elif len(self.queue) >= self.owner.max_queue:
+            return False
+        self.queue.append(frame)
+        self.wakeup.set()
+        return True
+
+    async def _run(self) -> None:
+        """Отправлять сообщения из очереди по мере поступления."""
+        try:
+            while True:
+                await self.wakeup.wait()
+                self.wakeup.clear()
+                while self.queue:
+                    frame = self.queue.popleft()
+                    t0 = time.perf_counter()
+                    await asyncio.wait_for(self.ws.send(frame.message), self.owner.send_timeout)
+                    self.owner.send_seconds.observe(time.perf_counter() - t0)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            # Ошибка или таймаут отправки — клиент мёртв или безнадёжно отстал
+            self.owner.evict(self.ws)
+
+    def close(self) -> None:
+        """Остановить отправителя и закрыть сокет, не дожидаясь результата."""
+        if self.task is not asyncio.current_task():
+            self.task.cancel()
+        asyncio.create_task(_close_quietly(self.ws))
+
+
+async def _close_quietly(ws) -> None:
+    """Закрыть сокет, игнорируя ошибки уже разорванного соединения."""
+    try:
+        await asyncio.wait_for(ws.close(code=1008), SEND_TIMEOUT)
+    except Exception:
+        pass
+
+
+class _ChannelMetrics:
+    """Метрики канала, общие для всех наборов с этим именем (по одному набору на таймер)."""
+
+    def __init__(self, name: str) -> None:
+        self.sets: weakref.WeakSet = weakref.WeakSet()
+        self.send_seconds = metrics.histogram(
+            "wsp_client_send_seconds", "Длительность отправки сообщения одному клиенту.", channel=name
+        )
+        self.broadcast_seconds = metrics.histogram(
+            "wsp_broadcast_seconds", "Длительность рассылки события всем клиентам канала.", channel=name
+        )
+        self.evictions = metrics.counter(
+            "wsp_evicted_clients_total", "Клиенты, отключённые за отставание или ошибку отправки.", channel=name
+        )
+        metrics.gauge("wsp_connected_clients", "Подключённые клиенты.", func=self.connected, channel=name)
+
+    def connected(self) -> int:
+        return sum(len(s) for s in self.sets)
+
+
+_channels: dict = {}
+
+
+class ClientSet:
+    """Набор подписчиков одного канала с удалением за O(1) и неблокирующей рассылкой."""
+
+    def __init__(
+        self,
+        name: str,
+        conflate: bool = False,
+        max_queue: int = MAX_QUEUE,
+        send_timeout: float = SEND_TIMEOUT,
+    ) -> None:
+        self.name = name
+        self.conflate = conflate
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self._subs: dict = {}
+
+        channel = _channels.get(name)
+        if channel is None:
+            channel = _channels[name] = _ChannelMetrics(name)
+        channel.sets.add(self)
+        self.send_seconds = channel.send_seconds
+        self.broadcast_seconds = channel.broadcast_seconds
+        self.evictions = channel.evictions
+
+    def add(self, ws) -> Subscriber:
+        """Зарегистрировать сокет и запустить для него отправителя."""
+        sub = self._subs.get(ws)
+        if sub is None:
+            sub = Subscriber(self, ws)
+            self._subs[ws] = sub
+        return sub
+
+    def discard(self, ws) -> None:
+        """Убрать сокет из набора (штатное отключение клиента)."""
+        sub = self._subs.pop(ws, None)
+        if sub is not None and sub.task is not asyncio.current_task():
+            sub.task.cancel()
+
+    def evict(self, ws) -> None:
+        """Принудительно отключить клиента: убрать из набора и закрыть сокет."""
+        sub = self._subs.pop(ws, None)
+        if sub is not None:
+            self.evictions.inc()
+            sub.close()
+
+    def broadcast(self, msg) -> None:
+        """Поставить сообщение в очереди всех клиентов; отставших — отключить."""
+        t0 = time.perf_counter()
+        frame = as_frame(msg)
+        backlogged = [sub.ws for sub in self._subs.values() if not sub.push(frame)]
+        for ws in backlogged:
+            self.evict(ws)
+        self.broadcast_seconds.observe(time.perf_counter() - t0)
+
+    def reap(self, cutoff: float, ping: Frame) -> int:
+        """Отключить клиентов, молчащих с момента cutoff; остальным поставить пинг.
+
+        Вернуть число отключённых.
+        """
+        dead = [sub.ws for sub in self._subs.values() if sub.last_seen < cutoff or not sub.push(ping)]
+        for ws in dead:
+            self.evict(ws)
+        return len(dead)
+
+    def __len__(self) -> int:
+        return len(self._subs)
+
+    def __contains__(self, ws) -> bool:
+        return ws in self._subs
+
+    def __iter__(self):
+        return iter(list(self._subs))
+
+
+class ConnectionLimit:
+    """Лимит одновременных соединений эндпоинта на процесс (по всем таймерам; 0 — без лимита)."""
+
+    def __init__(self, endpoint: str, limit: int) -> None:
+        self.endpoint = endpoint
+        self.limit = limit
+        self.count = 0
+        self.rejected = metrics.counter(
+            "wsp_rejected_connections_total", "Соединения, отклонённые сверх лимита эндпоинта.", endpoint=endpoint
+        )
+        metrics.gauge(
+            "wsp_endpoint_connections", "Открытые соединения эндпоинта.", func=lambda: self.count, endpoint=endpoint
+        )
+
+    def acquire(self) -> bool:
+        """Занять место под соединение; False — лимит исчерпан."""
+        if self.limit and self.count >= self.limit:
+            self.rejected.inc()
+            return False
+        self.count += 1
+        return True
+
+    def release(self) -> None:
+        """Освободить место закрытого соединения."""
+        self.count -= 1
@@ -19,8 +19,45 @@ class Config:
     # URL возврата после OAuth (должен совпадать с настройками в DonationAlerts)
     oauth_redirect_uri: str = os.getenv("OAUTH_REDIRECT_URI", "http://localhost:8000/callback").strip()
 
-    # Базовый коэффициент конвертации: 1₽ -> секунды (значение по умолчанию можно менять в /config)
-    default_rub_to_sec: float = float(os.getenv("RUB_TO_SEC", "10"))
+    # Адреса DonationAlerts (переопределяются для нагрузочного стенда с локальной заглушкой)
+    da_base_url: str = os.getenv("DA_BASE_URL", "https://www.donationalerts.com").strip().rstrip("/")
+    da_ws_url: str = os.getenv(
+        "DA_WS_URL", "wss://centrifugo.donationalerts.com/connection/websocket"
+    ).strip()
+
+    # Базовый коэффициент конвертации: 1₽ -> секунды (значение по умолчанию можно менять в /config).
+    # Строкой: разбирается в целые миллисекунды за рубль без потерь (см. app.core.money)
+    default_rub_to_sec: str = os.getenv("RUB_TO_SEC", "10").strip()
+
+    # Окно склейки донатов, секунд: донаты, пришедшие в течение окна после предыдущего
+    # начисления, применяются одной пачкой (0 — без склейки)
+    donation_batch_window: float = float(os.getenv("DONATION_BATCH_MS", "50")) / 1000
+
+    # Лог событий: ротация по размеру (МБ) и возрасту (часы), число хранимых архивов
+    # и сколько последних записей таймера показывать панели при подключении
+    log_max_bytes: int = int(float(os.getenv("LOG_MAX_MB", "10")) * 1024 * 1024)
+    log_max_age: float = float(os.getenv("LOG_ROTATE_HOURS", "24")) * 3600
+    log_backups: int = int(os.getenv("LOG_BACKUPS", "14"))
+    log_history: int = int(os.getenv("LOG_HISTORY", "200"))
+
+    # Сколько именованных таймеров (стримеров) может обслуживать один процесс
+    max_timers: int = int(os.getenv("MAX_TIMERS", "500"))
+
+    # Проверка живости клиентов: пинг раз в PING_INTERVAL секунд, клиент, не отвечавший
+    # PING_TIMEOUT секунд, отключается (0 — не проверять)
+    ping_interval: float = float(os.getenv("PING_INTERVAL", "20"))
+    ping_timeout: float = float(os.getenv("PING_TIMEOUT", "60"))
+
+    # Лимиты одновременных соединений на процесс по эндпоинтам (0 — без лимита)
+    max_ws_clients: int = int(os.getenv("MAX_WS_CLIENTS", "10000"))
+    max_cfg_clients: int = int(os.getenv("MAX_CFG_CLIENTS", "10000"))
+    max_control_clients: int = int(os.getenv("MAX_CONTROL_CLIENTS", "200"))
+    max_sse_clients: int = int(os.getenv("MAX_SSE_CLIENTS", "10000"))
+
+    # Число воркеров uvicorn; при WORKERS > 1 они связываются локальной шиной на BUS_PORT
+    # (127.0.0.1), и таймеры ведёт один из них (см. app.core.bus)
+    workers: int = int(os.getenv("WORKERS", "1"))
+    bus_port: int = int(os.getenv("BUS_PORT", "8765"))
 
 
 # Глобальный экземпляр конфигурации
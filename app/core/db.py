@@ -1,14 +1,23 @@
-"""Работа с SQLite: хранение настроек и состояния таймера + OAuth-токены."""
+"""Работа с SQLite: хранение настроек и состояния таймеров + OAuth-токены.
+
+Все таблицы ключуются идентификатором таймера (timer_id), у каждого таймера свои
+настройки, токены, состояние и журнал донатов.
+"""
 
 import os
 import sys
+import json
 import time
 import sqlite3
+import threading
 from pathlib import Path
 from typing import Optional
 
+from app.core import metrics
 from app.core.config import cfg
-from app.core.state import state
+from app.core.money import parse_coef, parse_rate
+from app.core.state import DEFAULT_TIMER_ID, AppState, timers, get_timer, valid_timer_id
+from app.core.writer import writer
 
 # Папка данных рядом с exe или исходниками
 BASE_DIR = Path.cwd()
@@ -18,149 +27,452 @@ DATA_DIR.mkdir(exist_ok=True)
 DB_PATH = str(DATA_DIR / "app_data.db")
 
 
+# Одно долгоживущее подключение на процесс; доступ к нему сериализуется блокировкой
+_connection: sqlite3.Connection | None = None
+_lock = threading.RLock()
+
+# Кэш таблицы settings {timer_id: {key: value}}: чтения идут из памяти,
+# записи — сквозь кэш в фоновый писатель
+_settings: dict = {}
+# PRAGMA data_version на момент загрузки кэша: меняется, если БД правил другой процесс
+_data_version: int | None = None
+
+
 def _conn() -> sqlite3.Connection:
-    """Создать подключение к SQLite с отключённой проверкой потока."""
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
+    """Вернуть общее подключение к SQLite, открыв его при первом обращении.
+
+    WAL-журнал с synchronous=FULL: коммит пачки фонового писателя — один fsync,
+    после которого все события журнала таймеров пачки переживают сбой питания.
+    """
+    global _connection
+    if _connection is None:
+        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=FULL")
+        _connection = conn
+    return _connection
+
+
+def close_db() -> None:
+    """Закрыть общее подключение (при остановке приложения)."""
+    global _connection
+    with _lock:
+        if _connection is not None:
+            _connection.close()
+            _connection = None
+
+
+def _has_timer_id(conn: sqlite3.Connection, table: str) -> bool:
+    """Проверить, что таблица уже в формате с колонкой timer_id."""
+    return any(row[1] == "timer_id" for row in conn.execute(f"PRAGMA table_info({table})"))
+
+
+def _tables(conn: sqlite3.Connection) -> set:
+    return {row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type='table'")}
+
+
+def _migrate_single_timer(conn: sqlite3.Connection) -> None:
+    """Отложить таблицы без timer_id (один таймер на процесс) под именем *_legacy."""
+    existing = _tables(conn)
+    for table in ("settings", "runtime_state", "donations"):
+        if table in existing and not _has_timer_id(conn, table):
+            conn.execute(f"ALTER TABLE {table} RENAME TO {table}_legacy")
+            if table == "donations":
+                # Индекс переезжает вместе с переименованной таблицей — освобождаем имя
+                conn.execute("DROP INDEX IF EXISTS donations_by_time")
+
+
+def _add_ledger_columns(conn: sqlite3.Connection) -> None:
+    """Добавить в журнал донатов колонки целочисленного учёта (для БД старых версий).
+
+    У старых строк они остаются NULL: точные данные для них не сохранялись.
+    """
+    existing = {row[1] for row in conn.execute("PRAGMA table_info(donations)")}
+    for column in ("amount_minor", "coef_ms"):
+        if column not in existing:
+            conn.execute(f"ALTER TABLE donations ADD COLUMN {column} INTEGER")
+    # Прежний индекс не покрывал amount_minor
+    conn.execute("DROP INDEX IF EXISTS donations_by_time")
+
+
+def _copy_legacy(conn: sqlite3.Connection) -> None:
+    """Скопировать строки старых таблиц в новые под таймером по умолчанию и удалить старые."""
+    legacy = _tables(conn)
+    if "settings_legacy" in legacy:
+        conn.execute(
+            "INSERT OR IGNORE INTO settings(timer_id, key, value) "
+            "SELECT ?, key, value FROM settings_legacy",
+            (DEFAULT_TIMER_ID,),
+        )
+        conn.execute("DROP TABLE settings_legacy")
+    if "runtime_state_legacy" in legacy:
+        conn.execute(
+            "INSERT OR IGNORE INTO runtime_state(timer_id, key, value) "
+            "SELECT ?, key, value FROM runtime_state_legacy",
+            (DEFAULT_TIMER_ID,),
+        )
+        conn.execute("DROP TABLE runtime_state_legacy")
+    if "donations_legacy" in legacy:
+        conn.execute(
+            "INSERT OR IGNORE INTO donations"
+            "(timer_id, donation_id, amount, currency, username, added_seconds, received_at) "
+            "SELECT ?, donation_id, amount, currency, username, added_seconds, received_at "
+            "FROM donations_legacy",
+            (DEFAULT_TIMER_ID,),
+        )
+        conn.execute("DROP TABLE donations_legacy")
 
 
 def init_db() -> None:
-    """Инициализировать БД и подтянуть настройки в состояние приложения."""
-    conn = _conn()
-    try:
-        cur = conn.cursor()
+    """Инициализировать БД, создать сохранённые таймеры и подтянуть их настройки."""
+    with _lock, _conn() as conn:
+        _migrate_single_timer(conn)
 
         # Таблица настроек
-        cur.execute(
+        conn.execute(
             """
             CREATE TABLE IF NOT EXISTS settings (
-                key TEXT PRIMARY KEY,
-                value TEXT
+                timer_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT,
+                PRIMARY KEY (timer_id, key)
             )
             """
         )
 
-        # Таблица состояния таймера
-        cur.execute(
+        # Таблица состояния таймеров
+        conn.execute(
             """
             CREATE TABLE IF NOT EXISTS runtime_state (
-                key TEXT PRIMARY KEY,
-                value TEXT
+                timer_id TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT,
+                PRIMARY KEY (timer_id, key)
+            )
+            """
+        )
+
+        # Журнал донатов: id доната DonationAlerts — ключ идемпотентной вставки в пределах таймера.
+        # amount_minor — начисленная сумма в копейках рубля, coef_ms — коэффициент на момент
+        # начисления: по ним added_seconds всех донатов пересчитываются точно
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS donations (
+                timer_id TEXT NOT NULL,
+                donation_id TEXT NOT NULL,
+                amount REAL NOT NULL,
+                currency TEXT,
+                username TEXT,
+                added_seconds INTEGER NOT NULL,
+                received_at INTEGER NOT NULL,
+                amount_minor INTEGER,
+                coef_ms INTEGER,
+                PRIMARY KEY (timer_id, donation_id)
             )
             """
         )
-        conn.commit()
-
-        # Значения по умолчанию
-        if get_setting("rub_to_sec") is None:
-            set_setting("rub_to_sec", str(cfg.default_rub_to_sec))
-        if get_setting("timer_color") is None:
-            set_setting("timer_color", "black")
-
-        # Синхронизация конфигурации
-        rub = get_setting("rub_to_sec")
-        if rub is not None:
-            state.rub_to_sec = float(rub)
-
-        color = get_setting("timer_color")
-        if color in ("black", "white"):
-            state.timer_text_color = color
-
-        # OAuth данные
-        at = get_setting("access_token")
-        if at:
-            state.oauth_access_token = at
-        rt = get_setting("refresh_token")
-        if rt:
-            # просто сохраняем, actual refresh делает donationalerts
+        _add_ledger_columns(conn)
+        # Покрывающий индекс: итоги таймера за период считаются без чтения самой таблицы
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS donations_ledger "
+            "ON donations(timer_id, received_at, amount, amount_minor, added_seconds)"
+        )
+
+        # Журнал событий таймеров (app.services.journal): хвост после последнего снимка
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS journal (
+                timer_id TEXT NOT NULL,
+                seq INTEGER NOT NULL,
+                ts REAL NOT NULL,
+                kind TEXT NOT NULL,
+                data TEXT NOT NULL,
+                PRIMARY KEY (timer_id, seq)
+            ) WITHOUT ROWID
+            """
+        )
+
+        _copy_legacy(conn)
+
+        # Значения по умолчанию (не перезаписывают уже сохранённые)
+        conn.executemany(
+            "INSERT OR IGNORE INTO settings(timer_id, key, value) VALUES(?, ?, ?)",
+            [
+                (DEFAULT_TIMER_ID, "rub_to_sec", cfg.default_rub_to_sec),
+                (DEFAULT_TIMER_ID, "timer_color", "black"),
+            ],
+        )
+
+        saved = [
+            row[0]
+            for row in conn.execute(
+                "SELECT timer_id FROM settings UNION SELECT timer_id FROM runtime_state "
+                "UNION SELECT timer_id FROM journal"
+            )
+        ]
+
+    for timer_id in saved:
+        try:
+            get_timer(timer_id)
+        except ValueError:
+            pass  # битый идентификатор или превышен лимит таймеров
+
+    reload_settings()
+
+
+def _apply_settings(state: AppState, settings: dict) -> None:
+    """Перенести сохранённые настройки в состояние таймера."""
+    rub = settings.get("rub_to_sec")
+    if rub is not None:
+        try:
+            state.coef_ms = parse_coef(rub)
+        except ValueError:
+            pass  # битое значение — остаётся прежний коэффициент
+
+    rates = settings.get("currency_rates")
+    if rates:
+        try:
+            state.currency_rates = {code: parse_rate(rate) for code, rate in json.loads(rates).items()}
+        except (ValueError, AttributeError):
             pass
-        cid = get_setting("client_id")
-        if cid:
-            state.oauth_client_id = cid
-        csec = get_setting("client_secret")
-        if csec:
-            state.oauth_client_secret = csec
 
-    finally:
-        conn.close()
+    color = settings.get("timer_color")
+    if color in ("black", "white"):
+        state.timer_text_color = color
 
+    # OAuth данные (refresh_token читает и обновляет donationalerts)
+    at = settings.get("access_token")
+    if at:
+        state.oauth_access_token = at
+    cid = settings.get("client_id")
+    if cid:
+        state.oauth_client_id = cid
+    csec = settings.get("client_secret")
+    if csec:
+        state.oauth_client_secret = csec
 
-def get_setting(key: str) -> Optional[str]:
-    """Вернуть значение настройки по ключу, либо None если не найдено."""
-    conn = _conn()
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT value FROM settings WHERE key = ?", (key,))
-        row = cur.fetchone()
-        return row[0] if row else None
-    finally:
-        conn.close()
+
+def reload_settings() -> None:
+    """Перечитать таблицу settings в кэш и синхронизировать состояние таймеров."""
+    global _settings, _data_version
+    settings: dict = {}
+    with _lock:
+        conn = _conn()
+        for timer_id, key, value in conn.execute("SELECT timer_id, key, value FROM settings"):
+            settings.setdefault(timer_id, {})[key] = value
+        _data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+    _settings = settings
+    for timer_id, items in _settings.items():
+        state = timers.get(timer_id)
+        if state is not None:
+            _apply_settings(state, items)
+
+
+def refresh_settings_if_changed() -> bool:
+    """Сбросить кэш, если файл БД изменили извне (другой процесс, ручная правка).
+
+    PRAGMA data_version не меняется от собственных коммитов подключения и не читает
+    таблицы, поэтому проверка дешёвая и её можно делать периодически.
+    """
+    with _lock:
+        version = _conn().execute("PRAGMA data_version").fetchone()[0]
+    if version == _data_version:
+        return False
+    reload_settings()
+    return True
+
+
+def get_setting(key: str, timer_id: str = DEFAULT_TIMER_ID) -> Optional[str]:
+    """Вернуть значение настройки таймера по ключу из кэша, либо None если не найдено."""
+    return _settings.get(timer_id, {}).get(key)
 
 
-def set_setting(key: str, value: str) -> None:
-    """Сохранить (вставить/обновить) настройку по ключу."""
-    conn = _conn()
+def load_timer(timer_id: str) -> Optional[AppState]:
+    """Существующий таймер, без создания нового: из памяти процесса или из БД.
+
+    Для маршрутов только на чтение (страница таймера, оверлей, /api): запросы
+    к случайным адресам не должны заводить таймеры. Таймер, который есть только
+    в БД (например, его настроили через другой воркер), поднимается с его
+    настройками. None — такого таймера нет или достигнут лимит таймеров.
+    """
+    state = timers.get(timer_id)
+    if state is not None or not valid_timer_id(timer_id):
+        return state
+    with _lock:
+        row = _conn().execute(
+            "SELECT 1 FROM settings WHERE timer_id = ? "
+            "UNION ALL SELECT 1 FROM runtime_state WHERE timer_id = ? "
+            "UNION ALL SELECT 1 FROM journal WHERE timer_id = ? LIMIT 1",
+            (timer_id, timer_id, timer_id),
+        ).fetchone()
+    if row is None:
+        return None
     try:
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO settings(key, value) VALUES(?, ?) "
-            "ON CONFLICT(key) DO UPDATE SET value=excluded.value",
-            (key, value),
-        )
-        conn.commit()
-    finally:
-        conn.close()
+        state = get_timer(timer_id)
+    except ValueError:
+        return None
+    refresh_settings_if_changed()
+    _apply_settings(state, _settings.get(timer_id, {}))
+    return state
+
+
+def find_timer_by_setting(key: str, value: str) -> Optional[str]:
+    """Идентификатор таймера, у которого настройка key равна value (по кэшу), либо None."""
+    for timer_id, items in _settings.items():
+        if items.get(key) == value:
+            return timer_id
+    return None
+
 
+def set_settings(items: dict, timer_id: str = DEFAULT_TIMER_ID) -> None:
+    """Сохранить несколько настроек: сразу в кэш, на диск — одной транзакцией в фоне."""
+    _settings.setdefault(timer_id, {}).update(items)
+    writer.submit_settings(timer_id, dict(items))
 
-def save_tokens(access_token: str, refresh_token: Optional[str], expires_in: Optional[int]) -> None:
-    """Сохранить OAuth-токены и client_id/secret."""
-    set_setting("access_token", access_token or "")
+
+def set_setting(key: str, value: str, timer_id: str = DEFAULT_TIMER_ID) -> None:
+    """Сохранить (вставить/обновить) настройку таймера по ключу."""
+    set_settings({key: value}, timer_id)
+
+
+def save_tokens(
+    state: AppState, access_token: str, refresh_token: Optional[str], expires_in: Optional[int]
+) -> None:
+    """Сохранить OAuth-токены и client_id/secret (запись уходит в фоновый поток)."""
+    items = {"access_token": access_token or ""}
     if refresh_token is not None:
-        set_setting("refresh_token", refresh_token or "")
+        items["refresh_token"] = refresh_token or ""
     if state.oauth_client_id:
-        set_setting("client_id", state.oauth_client_id)
+        items["client_id"] = state.oauth_client_id
     if state.oauth_client_secret:
-        set_setting("client_secret", state.oauth_client_secret)
+        items["client_secret"] = state.oauth_client_secret
     if expires_in is not None:
         expires_at = int(time.time()) + int(expires_in) - 30
-        set_setting("token_expires_at", str(expires_at))
+        items["token_expires_at"] = str(expires_at)
+    set_settings(items, state.timer_id)
 
 
-def load_tokens() -> dict:
-    """Загрузить сохранённые токены и время истечения."""
+def load_tokens(timer_id: str = DEFAULT_TIMER_ID) -> dict:
+    """Загрузить сохранённые токены таймера и время истечения (из кэша настроек)."""
     return {
-        "access_token": get_setting("access_token"),
-        "refresh_token": get_setting("refresh_token"),
-        "token_expires_at": int(get_setting("token_expires_at") or "0"),
+        "access_token": get_setting("access_token", timer_id),
+        "refresh_token": get_setting("refresh_token", timer_id),
+        "token_expires_at": int(get_setting("token_expires_at", timer_id) or "0"),
     }
 
 
 # ----------------- Runtime State -----------------
 
-def save_runtime_state(remaining: int, is_running: bool, fraction: float) -> None:
-    """Сохранить состояние таймера в БД."""
-    conn = _conn()
-    try:
-        cur = conn.cursor()
-        cur.execute("INSERT OR REPLACE INTO runtime_state(key, value) VALUES (?, ?)",
-                    ("remaining_seconds", str(remaining)))
-        cur.execute("INSERT OR REPLACE INTO runtime_state(key, value) VALUES (?, ?)",
-                    ("is_running", "1" if is_running else "0"))
-        cur.execute("INSERT OR REPLACE INTO runtime_state(key, value) VALUES (?, ?)",
-                    ("fraction_carry", str(fraction)))
-        cur.execute("INSERT OR REPLACE INTO runtime_state(key, value) VALUES (?, ?)",
-                    ("last_update_at", str(int(time.time()))))
-        conn.commit()
-    finally:
-        conn.close()
-
-
-def load_runtime_state() -> dict:
+def runtime_rows(
+    remaining: int,
+    is_running: bool,
+    carry_units: int,
+    deadline_at: float | None = None,
+    journal_seq: int = 0,
+) -> list:
+    """Подготовить строки key/value состояния таймера для таблицы runtime_state.
+
+    deadline_at — момент окончания запущенного таймера по системным часам (time.time()),
+    по нему отсчёт точно восстанавливается после перезапуска. carry_units — остаток
+    начислений меньше секунды в единицах money.UNITS_PER_SEC, journal_seq — номер
+    последнего события журнала, учтённого в этом снимке.
+    """
+    return [
+        ("remaining_seconds", str(remaining)),
+        ("is_running", "1" if is_running else "0"),
+        ("carry_units", str(carry_units)),
+        ("deadline_at", repr(deadline_at) if deadline_at is not None else ""),
+        ("last_update_at", str(int(time.time()))),
+        ("journal_seq", str(journal_seq)),
+    ]
+
+
+def write_batch(
+    settings: dict, runtime: dict | None, donations: list | None = None, journal: list | None = None
+) -> None:
+    """Записать пачку настроек, событий, состояний таймеров и донатов одной транзакцией (вызывает writer).
+
+    settings — {timer_id: {key: value}}, runtime — {timer_id: [(key, value), ...]},
+    journal — строки (timer_id, seq, ts, kind, data). Снимок состояния удаляет
+    учтённые в нём события журнала.
+    """
+    t0 = time.perf_counter()
+    with _lock, _conn() as conn:
+        if journal:
+            conn.executemany(
+                "INSERT OR REPLACE INTO journal(timer_id, seq, ts, kind, data) VALUES (?, ?, ?, ?, ?)",
+                journal,
+            )
+        if settings:
+            conn.executemany(
+                "INSERT INTO settings(timer_id, key, value) VALUES(?, ?, ?) "
+                "ON CONFLICT(timer_id, key) DO UPDATE SET value=excluded.value",
+                [(tid, k, v) for tid, items in settings.items() for k, v in items.items()],
+            )
+        if runtime:
+            conn.executemany(
+                "INSERT OR REPLACE INTO runtime_state(timer_id, key, value) VALUES (?, ?, ?)",
+                [(tid, k, v) for tid, rows in runtime.items() for k, v in rows],
+            )
+            conn.executemany(
+                "DELETE FROM journal WHERE timer_id = ? AND seq <= ?",
+                [(tid, int(v)) for tid, rows in runtime.items() for k, v in rows if k == "journal_seq"],
+            )
+        if donations:
+            # Повторно присланный донат (тот же таймер и id) молча игнорируется
+            conn.executemany(
+                "INSERT OR IGNORE INTO donations"
+                "(timer_id, donation_id, amount, currency, username, added_seconds, received_at, "
+                "amount_minor, coef_ms) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                donations,
+            )
+    metrics.SQLITE_WRITE.observe(time.perf_counter() - t0)
+
+
+def load_runtime_state(timer_id: str = DEFAULT_TIMER_ID) -> dict:
     """Загрузить сохранённое состояние таймера."""
-    conn = _conn()
-    try:
-        cur = conn.cursor()
-        cur.execute("SELECT key, value FROM runtime_state")
-        rows = cur.fetchall()
-        return {k: v for k, v in rows}
-    finally:
-        conn.close()
+    with _lock:
+        rows = _conn().execute(
+            "SELECT key, value FROM runtime_state WHERE timer_id = ?", (timer_id,)
+        ).fetchall()
+    return {k: v for k, v in rows}
+
+
+def load_journal(timer_id: str, after: int = 0) -> list:
+    """Вернуть события журнала таймера с номером больше after: [(seq, kind, data), ...] по порядку."""
+    with _lock:
+        return _conn().execute(
+            "SELECT seq, kind, data FROM journal WHERE timer_id = ? AND seq > ? ORDER BY seq",
+            (timer_id, after),
+        ).fetchall()
+
+
+# ----------------- Donations -----------------
+
+def recent_donation_ids(limit: int) -> list:
+    """Вернуть (timer_id, id) последних limit донатов всех таймеров (от старых к новым)."""
+    with _lock:
+        rows = _conn().execute(
+            "SELECT timer_id, donation_id FROM donations ORDER BY received_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+    return [tuple(r) for r in reversed(rows)]
+
+
+def donation_totals(since: int, until: int | None = None, timer_id: str = DEFAULT_TIMER_ID) -> dict:
+    """Итоги донатов таймера за период [since, until) по времени получения (unix-время).
+
+    amount_minor — начисленная сумма в копейках рубля; у записей старых версий
+    без точной суммы берётся округлённая amount.
+    """
+    if until is None:
+        until = int(time.time()) + 1
+    with _lock:
+        count, amount, amount_minor, added = _conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(amount), 0), "
+            "COALESCE(SUM(COALESCE(amount_minor, CAST(ROUND(amount * 100) AS INTEGER))), 0), "
+            "COALESCE(SUM(added_seconds), 0) "
+            "FROM donations WHERE timer_id = ? AND received_at >= ? AND received_at < ?",
+            (timer_id, since, until),
+        ).fetchone()
+    return {"count": count, "amount": amount, "amount_minor": amount_minor, "added_seconds": added}
@@ -0,0 +1,103 @@
+"""Структурированный лог событий таймеров (JSON lines) с ротацией и сжатием.
+
+Каждая строка файла — JSON-объект ``{"ts": ..., "level": ..., "timer": ..., "msg": ...}``.
+Записи сериализует и пишет фоновый писатель (app.core.writer) пачками в один раз
+открытый файл. Файл ротируется по размеру и по возрасту, старые части сжимаются
+gzip, хранится не больше cfg.log_backups архивов.
+"""
+
+import gzip
+import json
+import os
+import shutil
+import time
+from pathlib import Path
+
+from app.core.config import cfg
+
+# Папка логов
+LOG_DIR = Path("wsp-timer-data") / "logs"
+LOG_DIR.mkdir(parents=True, exist_ok=True)
+LOG_FILE = LOG_DIR / "wsp-timer.jsonl"
+
+
+def make_record(timer_id: str, message: str, level: str = "info") -> dict:
+    """Собрать запись лога."""
+    return {"ts": round(time.time(), 3), "level": level, "timer": timer_id, "msg": message}
+
+
+def format_record(record: dict) -> str:
+    """Запись лога → строка для панели управления: «[ЧЧ:ММ:СС] сообщение»."""
+    return f"[{time.strftime('%H:%M:%S', time.localtime(record['ts']))}] {record['msg']}"
+
+
+class RotatingLog:
+    """Файл JSON-лога, который держится открытым и ротируется по размеру и возрасту.
+
+    Используется только из потока писателя, поэтому без блокировок.
+    """
+
+    def __init__(self, path: Path, max_bytes: int, max_age: float, backups: int) -> None:
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backups = backups
+        self._file = None
+        self._size = 0
+        self._started = 0.0
+
+    def _open(self) -> None:
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._size = self._file.tell()
+        self._started = self._first_ts() if self._size else time.time()
+
+    def _first_ts(self) -> float:
+        """Время первой записи уже существующего файла (с него отсчитывается возраст)."""
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return float(json.loads(f.readline())["ts"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return time.time()
+
+    def write(self, records: list) -> None:
+        """Дописать пачку записей одним вызовом write и сбросить буфер на диск."""
+        if self._file is None:
+            self._open()
+        elif self._size >= self.max_bytes or time.time() - self._started >= self.max_age:
+            self.rotate()
+            self._open()
+        data = "".join(json.dumps(r, ensure_ascii=False) + "\n" for r in records)
+        self._file.write(data)
+        self._file.flush()
+        self._size += len(data.encode("utf-8"))
+
+    def rotate(self) -> None:
+        """Закрыть текущий файл, сжать его в архив с меткой времени и удалить лишние архивы."""
+        self.close()
+        if not self.path.exists():
+            return
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self._started or time.time()))
+        archive = self.path.with_name(f"{self.path.stem}.{stamp}{self.path.suffix}.gz")
+        n = 1
+        while archive.exists():
+            archive = self.path.with_name(f"{self.path.stem}.{stamp}-{n}{self.path.suffix}.gz")
+            n += 1
+        with open(self.path, "rb") as src, gzip.open(archive, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(self.path)
+
+        archives = sorted(
+            self.path.parent.glob(f"{self.path.stem}.*{self.path.suffix}.gz"), key=lambda p: p.stat().st_mtime
+        )
+        for old in archives[: max(len(archives) - self.backups, 0)]:
+            old.unlink(missing_ok=True)
+
+    def close(self) -> None:
+        """Закрыть файл (при остановке писателя и перед ротацией)."""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# Единый файл лога процесса
+log_file = RotatingLog(LOG_FILE, cfg.log_max_bytes, cfg.log_max_age, cfg.log_backups)
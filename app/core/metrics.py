@@ -0,0 +1,156 @@
+"""Метрики приложения в текстовом формате Prometheus (эндпоинт /metrics).
+
+Счётчики и гистограммы рассчитаны на горячий путь: корзины гистограмм выделяются
+один раз при создании, а наблюдение — это бинарный поиск корзины и пара сложений.
+Метрики с одинаковым именем и разными метками выводятся одной группой.
+"""
+
+from bisect import bisect_left
+from typing import Callable
+
+# Корзины по умолчанию (секунды): от сотни микросекунд до десятка секунд
+DEFAULT_BUCKETS = (0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Все зарегистрированные метрики в порядке создания
+_registry: list = []
+
+
+def _format_labels(labels: dict, extra: str = "") -> str:
+    """Собрать блок меток {k="v",...}."""
+    parts = [f'{k}="{v}"' for k, v in labels.items()]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонно растущий счётчик."""
+
+    kind = "counter"
+    __slots__ = ("name", "help", "labels", "value")
+
+    def __init__(self, name: str, help: str, labels: dict) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0
+
+    def inc(self, n: int = 1) -> None:
+        self.value += n
+
+    def samples(self):
+        yield self.name, self.labels, "", self.value
+
+
+class Gauge:
+    """Текущее значение; может вычисляться функцией в момент сбора метрик."""
+
+    kind = "gauge"
+    __slots__ = ("name", "help", "labels", "value", "func")
+
+    def __init__(self, name: str, help: str, labels: dict, func: Callable | None = None) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.value = 0
+        self.func = func
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def samples(self):
+        yield self.name, self.labels, "", self.func() if self.func else self.value
+
+
+class Histogram:
+    """Гистограмма с фиксированными корзинами."""
+
+    kind = "histogram"
+    __slots__ = ("name", "help", "labels", "buckets", "counts", "sum", "count")
+
+    def __init__(self, name: str, help: str, labels: dict, buckets: tuple = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # Последний элемент — корзина +Inf
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        acc = 0
+        for bound, n in zip(self.buckets, self.counts):
+            acc += n
+            yield self.name + "_bucket", self.labels, f'le="{bound}"', acc
+        yield self.name + "_bucket", self.labels, 'le="+Inf"', self.count
+        yield self.name + "_sum", self.labels, "", self.sum
+        yield self.name + "_count", self.labels, "", self.count
+
+
+def counter(name: str, help: str, **labels) -> Counter:
+    """Создать и зарегистрировать счётчик (имя по соглашению оканчивается на _total)."""
+    m = Counter(name, help, labels)
+    _registry.append(m)
+    return m
+
+
+def gauge(name: str, help: str, func: Callable | None = None, **labels) -> Gauge:
+    """Создать и зарегистрировать gauge (func — вычислять значение при сборе)."""
+    m = Gauge(name, help, labels, func)
+    _registry.append(m)
+    return m
+
+
+def histogram(name: str, help: str, buckets: tuple = DEFAULT_BUCKETS, **labels) -> Histogram:
+    """Создать и зарегистрировать гистограмму."""
+    m = Histogram(name, help, labels, buckets)
+    _registry.append(m)
+    return m
+
+
+def render() -> str:
+    """Отрендерить все метрики в текстовом формате Prometheus 0.0.4."""
+    groups: dict = {}
+    for m in _registry:
+        groups.setdefault(m.name, []).append(m)
+
+    lines = []
+    for name, items in groups.items():
+        lines.append(f"# HELP {name} {items[0].help}")
+        lines.append(f"# TYPE {name} {items[0].kind}")
+        for m in items:
+            for sample, labels, extra, value in m.samples():
+                lines.append(f"{sample}{_format_labels(labels, extra)} {_format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+
+# ----------------- Метрики приложения -----------------
+
+TICK_LATENESS = histogram(
+    "wsp_tick_lateness_seconds",
+    "Опоздание тика таймера относительно границы секунды.",
+)
+DONATION_LATENCY = histogram(
+    "wsp_donation_latency_seconds",
+    "Время от получения публикации Centrifugo до рассылки нового времени оверлеям.",
+)
+DONATIONS = counter("wsp_donations_total", "Начисленные донаты.")
+DONATION_DUPLICATES = counter("wsp_donation_duplicates_total", "Отброшенные повторы донатов.")
+SQLITE_WRITE = histogram(
+    "wsp_sqlite_write_seconds",
+    "Длительность транзакции записи пачки в SQLite.",
+)
+DA_RECONNECTS = counter(
+    "wsp_da_reconnects_total",
+    "Переподключения к Centrifugo DonationAlerts после обрыва.",
+)
@@ -0,0 +1,104 @@
+"""Целочисленная арифметика начисления времени за донаты.
+
+Суммы хранятся в копейках (сотых долях валюты), коэффициент — в миллисекундах за
+рубль, поэтому начисление доната — одно целочисленное умножение:
+
+    копейки × мс/₽ = единицы по 1/100 000 секунды (UNITS_PER_SEC в секунде)
+
+Остаток меньше секунды копится в целых единицах и не теряет точности, а итог
+любой серии донатов пересчитывается из журнала по (amount_minor, coef_ms).
+Курсы валют хранятся в миллионных долях рубля за единицу валюты.
+"""
+
+from decimal import ROUND_HALF_EVEN, Decimal, InvalidOperation
+
+# Валюта, в которой задан коэффициент
+BASE_CURRENCY = "RUB"
+
+MINOR_PER_MAJOR = 100
+MS_PER_SEC = 1000
+# Единиц остатка в одной секунде: копейка × (мс/₽)
+UNITS_PER_SEC = MINOR_PER_MAJOR * MS_PER_SEC
+# Масштаб курса: рублей за единицу валюты × RATE_SCALE
+RATE_SCALE = 1_000_000
+
+
+def _decimal(value) -> Decimal:
+    """Разобрать число (в т.ч. строку с запятой) без двоичных погрешностей float."""
+    text = value.strip().replace(",", ".") if isinstance(value, str) else str(value)
+    try:
+        result = Decimal(text)
+    except InvalidOperation:
+        raise ValueError(f"не число: {value!r}") from None
+    if not result.is_finite():
+        raise ValueError(f"не число: {value!r}")
+    return result
+
+
+def _scaled(value, scale: int) -> int:
+    """Неотрицательное число → целое в единицах 1/scale (банковское округление)."""
+    result = (_decimal(value) * scale).to_integral_value(ROUND_HALF_EVEN)
+    if result < 0:
+        raise ValueError("значение не может быть отрицательным")
+    return int(result)
+
+
+def _unscaled(value: int, scale: int) -> str:
+    """Целое в единицах 1/scale → короткая десятичная строка (4500 мс → "4.5")."""
+    text = format(Decimal(value) / scale, "f")
+    return text.rstrip("0").rstrip(".") if "." in text else text
+
+
+def to_minor(amount) -> int:
+    """Сумма доната → копейки."""
+    # Быстрый путь для чисел из JSON: целые рубли и суммы с точностью до копейки
+    if type(amount) is int and amount >= 0:
+        return amount * MINOR_PER_MAJOR
+    if type(amount) is float and 0 <= amount < 1e12:
+        minor = round(amount * MINOR_PER_MAJOR)
+        if abs(amount * MINOR_PER_MAJOR - minor) < 1e-6:
+            return minor
+    return _scaled(amount, MINOR_PER_MAJOR)
+
+
+def format_minor(minor: int) -> str:
+    """Копейки → сумма для лога."""
+    return _unscaled(minor, MINOR_PER_MAJOR)
+
+
+def parse_coef(value) -> int:
+    """Коэффициент «секунд за рубль» → миллисекунды за рубль."""
+    return _scaled(value, MS_PER_SEC)
+
+
+def format_coef(coef_ms: int) -> str:
+    """Миллисекунды за рубль → коэффициент для отображения."""
+    return _unscaled(coef_ms, MS_PER_SEC)
+
+
+def parse_rate(value) -> int:
+    """Курс «рублей за единицу валюты» → целое в единицах 1/RATE_SCALE."""
+    rate = _scaled(value, RATE_SCALE)
+    if rate == 0:
+        raise ValueError("курс должен быть больше нуля")
+    return rate
+
+
+def format_rate(rate: int) -> str:
+    """Курс в единицах 1/RATE_SCALE → строка для отображения."""
+    return _unscaled(rate, RATE_SCALE)
+
+
+def convert(amount_minor: int, rate: int) -> int:
+    """Перевести копейки валюты в копейки рубля по курсу (округление половины вверх)."""
+    return (2 * amount_minor * rate + RATE_SCALE) // (2 * RATE_SCALE)
+
+
+def accrue(carry: int, amount_minor: int, coef_ms: int) -> tuple:
+    """Начислить донат: вернуть (целые секунды, новый остаток в единицах)."""
+    return divmod(carry + amount_minor * coef_ms, UNITS_PER_SEC)
+
+
+def carry_from_legacy(fraction: str) -> int:
+    """Остаток, сохранённый старыми версиями как дробь секунды ("0.37"), → единицы."""
+    return _scaled(fraction, UNITS_PER_SEC) % UNITS_PER_SEC
@@ -0,0 +1,75 @@
+"""Компактный бинарный протокол оверлея (подпротокол WebSocket ``wsp-delta.1``).
+
+Вместо строки времени на каждый тик сервер шлёт только события, а клиент сам
+отсчитывает время по своим часам. Каждый кадр самодостаточен — несёт полное
+состояние, поэтому клиенту достаточно последнего кадра:
+
+    <B version> <B type> <B running> <q remaining_ms> <q delta_ms>   (little-endian, 19 байт)
+
+- ``remaining_ms`` — остаток на момент отправки; у идущего таймера клиент считает
+  дедлайн как «сейчас + remaining_ms»;
+- ``delta_ms`` — для ADD: сколько времени добавлено (для анимации), иначе 0.
+
+Подпротокол ``wsp-overlay.1`` — единый канал оверлея: те же кадры времени плюс
+кадры стиля, которые раньше шли отдельным сокетом /timer_cfg:
+
+    <B version> <B type=STYLE> <UTF-8 JSON-объект {"color": ...}>
+
+Кадр стиля тоже несёт полное состояние отображения; неизвестные ключи клиент
+пропускает, так что новые настройки стиля не требуют новой версии.
+
+Проверка живости: сервер периодически шлёт кадр ``<B version> <B type=PING>``
+(в канале оверлея и панели управления с подпротоколом wsp-control.1), клиент отвечает любым сообщением — принято
+``<B version> <B type=PONG>``. Клиент, долго не отвечавший, отключается.
+"""
+
+import json
+import struct
+
+# Имена подпротоколов, которые клиент передаёт при подключении к /ws
+DELTA_SUBPROTOCOL = "wsp-delta.1"
+OVERLAY_SUBPROTOCOL = "wsp-overlay.1"
+# Подпротокол /control: лог и ответы на команды — JSON-объекты (app.services.control)
+CONTROL_SUBPROTOCOL = "wsp-control.1"
+
+VERSION = 1
+
+# Типы кадров
+SNAPSHOT = 1  # полное состояние: подключение, установка/сброс времени, ресинхронизация
+START = 2
+STOP = 3
+ADD = 4
+STYLE = 5  # настройки отображения (только wsp-overlay.1)
+PING = 6
+PONG = 7
+
+# Темы кадров канала оверлея: очередь клиента схлопывается до последнего кадра каждой темы
+TIME_TOPIC = "time"
+STYLE_TOPIC = "style"
+PING_TOPIC = "ping"
+
+_FRAME = struct.Struct("<BBBqq")
+_STYLE = struct.Struct("<BB")
+
+# Кадры проверки живости (без полезной нагрузки)
+PING_FRAME = _STYLE.pack(VERSION, PING)
+PONG_FRAME = _STYLE.pack(VERSION, PONG)
+
+
+def encode_frame(kind: int, running: bool, remaining_ms: int, delta_ms: int = 0) -> bytes:
+    """Собрать кадр протокола."""
+    return _FRAME.pack(VERSION, kind, 1 if running else 0, remaining_ms, delta_ms)
+
+
+def decode_frame(data: bytes) -> tuple:
+    """Разобрать кадр: (type, running, remaining_ms, delta_ms)."""
+    version, kind, running, remaining_ms, delta_ms = _FRAME.unpack(data)
+    if version != VERSION:
+        raise ValueError(f"Неизвестная версия протокола: {version}")
+    return kind, bool(running), remaining_ms, delta_ms
+
+
+def encode_style(style: dict) -> bytes:
+    """Собрать кадр стиля wsp-overlay.1."""
+    return _STYLE.pack(VERSION, STYLE) + json.dumps(style, separators=(",", ":")).encode()
+
@@ -1,82 +1,186 @@
-"""Глобальное состояние приложения и утилиты широковещательной отправки по WebSocket."""
+"""Состояние таймеров и утилиты широковещательной отправки по WebSocket.
 
-import asyncio
-import time
-from pathlib import Path
-
-from app.core.config import cfg
-
-# Папка логов
-LOG_DIR = Path("wsp-timer-data") / "logs"
-LOG_DIR.mkdir(parents=True, exist_ok=True)
-LOG_FILE = LOG_DIR / "wsp-timer.log"
-
-
-class AppState:
-    """Хранилище текущего состояния приложения (простая модель без потоковой безопасности)."""
-
-    timer_total_seconds: int = 60
-    remaining_seconds: int = 60
-    is_running: bool = False
+Один процесс обслуживает несколько именованных таймеров: у каждого своё время,
+коэффициент, цвет, OAuth-токены, клиенты и слушатель DonationAlerts. Таймер
+``default`` соответствует прежним адресам без идентификатора (/ws, /control, ...).
 
-    timer_clients: list = []
-    control_clients: list = []
-    timer_cfg_clients: list = []
-
-    oauth_client_id: str | None = cfg.da_client_id or None
-    oauth_client_secret: str | None = cfg.da_client_secret or None
-    oauth_redirect_uri: str = cfg.oauth_redirect_uri
-    oauth_access_token: str | None = None
-
-    rub_to_sec: float = float(cfg.default_rub_to_sec)
-    fraction_carry: float = 0.0
-    timer_text_color: str = "black"
-
-    donation_task: asyncio.Task | None = None
-    lock = asyncio.Lock()
-
-
-# Единый экземпляр
-state = AppState()
+Рассылки собирают сообщение в Frame один раз на событие: все клиенты получают
+один и тот же объект, а кадры времени ещё и кэшируются по значению секунды
+(app.services.timer.time_frame). В режиме нескольких воркеров ведущий публикует
+те же события в шину, и ведомые раздают их своим клиентам (app.services.cluster).
+"""
 
+import asyncio
+import json
+import re
+from collections import deque
 
-def _write_log(message: str) -> None:
-    """Записать строку в лог-файл с таймстампом."""
-    ts = time.strftime("%Y-%m-%d %H:%M:%S")
-    with open(LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(f"[{ts}] {message}\n")
+from app.core import protocol
+from app.core.bus import bus, CFG, CONTROL, TIME
+from app.core.config import cfg
+from app.core.clients import MAX_QUEUE, ClientSet, ConnectionLimit, Frame
+from app.core.logs import make_record
+from app.core.money import parse_coef
+from app.core.writer import writer
 
+# Идентификатор таймера для адресов без /{timer_id}
+DEFAULT_TIMER_ID = "default"
 
-async def broadcast_timer(msg: str) -> None:
-    dead = []
-    for ws in state.timer_clients:
-        try:
-            await ws.send_text(msg)
-        except Exception:
-            dead.append(ws)
-    for ws in dead:
-        state.timer_clients.remove(ws)
+# Допустимый идентификатор таймера: латиница, цифры, '-' и '_'
+TIMER_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
 
 
-async def broadcast_control(msg: str) -> None:
+class AppState:
+    """Состояние одного таймера (простая модель без потоковой безопасности)."""
+
+    def __init__(self, timer_id: str = DEFAULT_TIMER_ID) -> None:
+        self.timer_id = timer_id
+
+        self.timer_total_seconds: int = 60
+        self.remaining_seconds: int = 60
+        self.is_running: bool = False
+        # Дедлайн по time.monotonic(), пока таймер запущен (см. app.services.timer)
+        self.deadline: float | None = None
+        # Задачи планировщика: ближайший тик и плановое обновление OAuth-токена
+        self.tick_job = None
+        self.token_job = None
+        # Состояние изменилось и ещё не отдано на сохранение
+        self.dirty: bool = False
+        # Номер последнего события журнала таймера (app.services.journal)
+        self.journal_seq: int = 0
+
+        # Тики таймера и цвет — «последнее значение побеждает», лог панели — по порядку
+        self.timer_clients = ClientSet("ws", conflate=True)
+        # Оверлеи с бинарным протоколом событий (app.core.protocol): каждый кадр несёт полное состояние
+        self.delta_clients = ClientSet("ws_delta", conflate=True)
+        # Оверлеи с единым каналом wsp-overlay.1: время и стиль одним сокетом,
+        # очередь схлопывается до последнего кадра каждой темы
+        self.overlay_clients = ClientSet("overlay", conflate=True)
+        # Очередь панели вмещает ещё и историю лога, которую она получает при подключении
+        self.control_clients = ClientSet("control", max_queue=MAX_QUEUE + cfg.log_history)
+        # Панели с подпротоколом wsp-control.1: те же записи лога, но JSON-объектами
+        self.control_json_clients = ClientSet("control_json", max_queue=MAX_QUEUE + cfg.log_history)
+        # Последние записи лога таймера
+        self.log_history: deque = deque(maxlen=cfg.log_history)
+        self.timer_cfg_clients = ClientSet("timer_cfg", conflate=True)
+        # Потоки Server-Sent Events (/api/events): каждое событие — полный снимок таймера
+        self.sse_clients = ClientSet("sse", conflate=True)
+        # Кэш снимка для /api/timer и SSE (app.services.timer.timer_snapshot)
+        self.snapshot = None
+
+        # Ключи из .env действуют только для таймера по умолчанию
+        default = timer_id == DEFAULT_TIMER_ID
+        self.oauth_client_id: str | None = (cfg.da_client_id or None) if default else None
+        self.oauth_client_secret: str | None = (cfg.da_client_secret or None) if default else None
+        self.oauth_redirect_uri: str = cfg.oauth_redirect_uri
+        self.oauth_access_token: str | None = None
+
+        # Коэффициент в миллисекундах за рубль и накопленный остаток меньше секунды
+        # в единицах money.UNITS_PER_SEC — вся арифметика начисления целочисленная
+        self.coef_ms: int = parse_coef(cfg.default_rub_to_sec)
+        self.carry_units: int = 0
+        # Курсы валют к рублю {код: курс в единицах money.RATE_SCALE}
+        self.currency_rates: dict = {}
+        self.timer_text_color: str = "black"
+
+        # Позиции каналов Centrifugo для восстановления истории (см. donationalerts)
+        self.da_positions: dict | None = None
+        # Донаты, ждущие применения пачкой: (Donation, момент получения), и число пропущенных повторов
+        self.pending_donations: list = []
+        self.pending_duplicates: int = 0
+        # Задача закрытия окна склейки донатов (None — окно закрыто)
+        self.donation_job = None
+        self.donation_task: asyncio.Task | None = None
+        self.lock = asyncio.Lock()
+
+
+# Все таймеры процесса по идентификатору
+timers: dict = {}
+
+# Лимиты соединений по эндпоинтам (общие для всех таймеров)
+ws_limit = ConnectionLimit("ws", cfg.max_ws_clients)
+timer_cfg_limit = ConnectionLimit("timer_cfg", cfg.max_cfg_clients)
+control_limit = ConnectionLimit("control", cfg.max_control_clients)
+sse_limit = ConnectionLimit("sse", cfg.max_sse_clients)
+
+
+def valid_timer_id(timer_id: str) -> bool:
+    """Проверить, что строка годится в идентификатор таймера."""
+    return bool(TIMER_ID_RE.match(timer_id))
+
+
+def get_timer(timer_id: str = DEFAULT_TIMER_ID) -> AppState:
+    """Вернуть таймер по идентификатору, создав его при первом обращении."""
+    st = timers.get(timer_id)
+    if st is None:
+        if not valid_timer_id(timer_id):
+            raise ValueError(f"Недопустимый идентификатор таймера: {timer_id!r}")
+        if len(timers) >= cfg.max_timers:
+            raise ValueError("Достигнут лимит количества таймеров")
+        st = AppState(timer_id)
+        timers[timer_id] = st
+    return st
+
+
+# Таймер по умолчанию
+state = get_timer(DEFAULT_TIMER_ID)
+
+
+def log_event(message: str, st: AppState | None = None, level: str | None = None) -> dict:
+    """Записать событие таймера: в кольцевой буфер для новых панелей и в JSON-лог (в фоне).
+
+    Уровень по умолчанию определяется по тексту, как и подсветка в панели. Возвращает запись.
+    """
+    st = st or state
+    if level is None:
+        level = "error" if "ошибка" in message.lower() else "info"
+    record = make_record(st.timer_id, message, level)
+    st.log_history.append(record)
+    writer.submit_log(record)
+    return record
+
+
+async def broadcast_timer(msg: str | Frame, st: AppState | None = None) -> None:
+    """Разослать оставшееся время всем оверлеям таймера."""
+    st = st or state
+    st.timer_clients.broadcast(msg)
+    if bus.peers:
+        text = msg.message["text"] if isinstance(msg, Frame) else msg
+        bus.publish(TIME, st.timer_id, text.encode())
+
+
+def log_frame(record: dict) -> Frame:
+    """Запись лога для панели с подпротоколом wsp-control.1: {"type": "log", "ts", "level", "msg"}."""
+    return Frame(json.dumps({"type": "log", **record}, ensure_ascii=False))
+
+
+def broadcast_record(record: dict, st: AppState) -> None:
+    """Разослать запись лога панелям обоих форматов: текстом и JSON-объектом."""
+    st.control_clients.broadcast(Frame(record["msg"]))
+    if len(st.control_json_clients):
+        st.control_json_clients.broadcast(log_frame(record))
+
+
+async def broadcast_control(msg: str, st: AppState | None = None) -> None:
     """Отправить сообщение всем клиентам панели управления и записать его в лог."""
-    _write_log(msg)
-    dead = []
-    for ws in state.control_clients:
-        try:
-            await ws.send_text(msg)
-        except Exception:
-            dead.append(ws)
-    for ws in dead:
-        state.control_clients.remove(ws)
-
-
-async def broadcast_timer_cfg(msg: str) -> None:
-    dead = []
-    for ws in state.timer_cfg_clients:
-        try:
-            await ws.send_text(msg)
-        except Exception:
-            dead.append(ws)
-    for ws in dead:
-        state.timer_cfg_clients.remove(ws)
+    st = st or state
+    record = log_event(msg, st)
+    broadcast_record(record, st)
+    if bus.peers:
+        bus.publish(CONTROL, st.timer_id, json.dumps(record, ensure_ascii=False).encode())
+
+
+def style_frame(st: AppState) -> Frame:
+    """Кадр стиля для канала wsp-overlay.1 с текущими настройками отображения таймера."""
+    return Frame(protocol.encode_style({"color": st.timer_text_color}), protocol.STYLE_TOPIC)
+
+
+async def broadcast_timer_cfg(msg: str | Frame, st: AppState | None = None) -> None:
+    """Разослать настройки отображения (цвет текста) всем оверлеям."""
+    st = st or state
+    st.timer_cfg_clients.broadcast(msg)
+    if len(st.overlay_clients):
+        st.overlay_clients.broadcast(style_frame(st))
+    if bus.peers:
+        text = msg.message["text"] if isinstance(msg, Frame) else msg
+        bus.publish(CFG, st.timer_id, text.encode())
@@ -0,0 +1,136 @@
+"""Фоновая запись на диск: настройки, состояние таймера и записи лога.
+
+Event loop только кладёт записи в очередь, а отдельный поток забирает их пачками
+и сбрасывает на диск: все SQL-изменения пачки — одной транзакцией, все записи лога —
+одним write в открытый файл (app.core.logs). Так всплеск донатов не блокирует рассылку тиков.
+"""
+
+import queue
+import threading
+import time
+import traceback
+
+from app.core.logs import log_file
+
+# Сколько секунд копить записи после первой, прежде чем сбросить пачку
+BATCH_WINDOW = 0.05
+
+_STOP = object()
+
+
+class BackgroundWriter:
+    """Один поток-писатель, получающий записи через очередь и сбрасывающий их пачками."""
+
+    def __init__(self) -> None:
+        self._queue: queue.SimpleQueue = queue.SimpleQueue()
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+
+    def start(self) -> None:
+        """Запустить поток-писатель (повторный вызов ничего не делает)."""
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="wsp-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self) -> None:
+        """Сбросить всё накопленное и дождаться завершения потока."""
+        with self._start_lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+
+    def submit_settings(self, timer_id: str, items: dict) -> None:
+        """Поставить в очередь сохранение настроек таймера."""
+        self._put(("settings", (timer_id, items)))
+
+    def submit_runtime(self, timer_id: str, rows: list) -> None:
+        """Поставить в очередь сохранение состояния таймера (строки key/value)."""
+        self._put(("runtime", (timer_id, rows)))
+
+    def submit_donation(self, row: tuple) -> None:
+        """Поставить в очередь запись доната в журнал (строка таблицы donations, первым — timer_id)."""
+        self._put(("donation", row))
+
+    def submit_journal(self, row: tuple) -> None:
+        """Поставить в очередь событие журнала таймера (timer_id, seq, ts, kind, data)."""
+        self._put(("journal", row))
+
+    def submit_log(self, record: dict) -> None:
+        """Поставить в очередь запись лога (сериализуется в JSON уже в потоке писателя)."""
+        self._put(("log", record))
+
+    def _put(self, item) -> None:
+        if self._thread is None:
+            self.start()
+        self._queue.put(item)
+
+    def _run(self) -> None:
+        """Цикл потока: дождаться записи, добрать пачку за BATCH_WINDOW и сбросить её."""
+        while True:
+            batch = [self._queue.get()]
+            stop = batch[0] is _STOP
+            deadline = time.monotonic() + BATCH_WINDOW
+            while not stop:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=timeout)
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stop = True
+                else:
+                    batch.append(item)
+
+            # После сигнала остановки добираем всё, что успели положить
+            while stop:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not _STOP:
+                    batch.append(item)
+
+            try:
+                self._flush([item for item in batch if item is not _STOP])
+            except Exception:
+                traceback.print_exc()
+            if stop:
+                log_file.close()
+                return
+
+    @staticmethod
+    def _flush(batch: list) -> None:
+        """Записать пачку: последние значения настроек и состояния, все события и донаты — в БД, записи — в лог."""
+        from app.core.db import write_batch
+
+        settings: dict = {}
+        runtime: dict = {}
+        donations = []
+        journal = []
+        records = []
+        for kind, payload in batch:
+            if kind == "settings":
+                timer_id, items = payload
+                settings.setdefault(timer_id, {}).update(items)
+            elif kind == "runtime":
+                timer_id, rows = payload
+                runtime[timer_id] = rows  # важно только последнее состояние таймера
+            elif kind == "donation":
+                donations.append(payload)
+            elif kind == "journal":
+                journal.append(payload)
+            elif kind == "log":
+                records.append(payload)
+
+        if settings or runtime or donations or journal:
+            write_batch(settings, runtime, donations, journal)
+        if records:
+            log_file.write(records)
+
+
+# Единый экземпляр
+writer = BackgroundWriter()
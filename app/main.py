@@ -1,17 +1,30 @@
 """Основной модуль FastAPI-приложения: роуты, статика, запуск фоновых задач."""
 
+import math
 import time
 import asyncio
+import importlib
 from pathlib import Path
 from fastapi import FastAPI
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 
+from app.routes.api import router as api_router
 from app.routes.pages import router as pages_router
 from app.routes.ws import router as ws_router
-from app.services.timer import start_timer_task
-from app.services.donationalerts import donation_manager
-from app.core.db import init_db, load_runtime_state
-from app.core.state import state
+from app.services.timer import start_timer_task, start_timer, save_state
+from app.services import cluster, http_client, journal, ledger, reaper
+from app.core.db import init_db, close_db, reload_settings
+from app.core import metrics
+from app.core.bus import bus, FOLLOWER, SINGLE
+from app.core.config import cfg
+from app.core.state import AppState, timers
+from app.core.writer import writer
+
+# Тяжёлые модули, нужные только слушателю DonationAlerts: импортируются в фоне после старта
+INTEGRATION_MODULES = ("httpx", "websockets", "app.services.donationalerts")
+
+_integrations_task: asyncio.Task | None = None
 
 BASE_DIR = Path(__file__).resolve().parent
 STATIC_DIR = BASE_DIR / "static"
@@ -24,6 +37,7 @@ app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
 # Роуты
 app.include_router(pages_router)
 app.include_router(ws_router)
+app.include_router(api_router)
 
 
 @app.get("/health")
@@ -32,28 +46,108 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/metrics")
+async def metrics_endpoint():
+    """Метрики в текстовом формате Prometheus."""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+def _restore_timer(state: AppState) -> None:
+    """Восстановить таймер из снимка и журнала событий (с учётом времени простоя приложения)."""
+    saved = journal.replay(state.timer_id)
+    if saved is None:
+        return
+    state.journal_seq = saved["seq"]
+    state.carry_units = saved["carry"]
+    if saved["coef_ms"] is not None:
+        state.coef_ms = saved["coef_ms"]
+
+    left = float(saved["remaining"])
+    if saved["is_running"] and saved["deadline_at"]:
+        # Точное восстановление по сохранённому дедлайну
+        left = max(saved["deadline_at"] - time.time(), 0.0)
+
+    state.remaining_seconds = math.ceil(left)
+    if saved["is_running"] and left > 0:
+        start_timer(state, left)
+    if saved["replayed"]:
+        # Новый снимок: повторённые события больше не нужны
+        save_state(state)
+
+
+def _load_integrations() -> None:
+    """Импортировать модули интеграции с DonationAlerts и подготовить всё для слушателей (в потоке)."""
+    for name in INTEGRATION_MODULES:
+        importlib.import_module(name)
+    ledger.load_recent()
+    # Общий HTTP-клиент с пулом соединений для всех запросов к DonationAlerts
+    http_client.get_client()
+
+
+async def _start_integrations() -> None:
+    """Фоновая часть старта: загрузка DonationAlerts и автозапуск слушателей донатов."""
+    await asyncio.to_thread(_load_integrations)
+    from app.services.donationalerts import donation_manager
+
+    # Автозапуск donation listener для каждого таймера, у которого всё есть
+    for state in timers.values():
+        if state.oauth_client_id and state.oauth_client_secret and state.oauth_access_token:
+            state.donation_task = asyncio.create_task(donation_manager(state))
+
+
+async def _promote() -> None:
+    """Ведомый воркер стал ведущим: поднять таймеры из БД вместо зеркала и запустить слушатели."""
+    global _integrations_task
+    reload_settings()
+    for state in timers.values():
+        state.is_running = False
+        state.deadline = None
+        _restore_timer(state)
+    _integrations_task = asyncio.create_task(_start_integrations())
+
+
 @app.on_event("startup")
 async def _startup():
-    """Инициализация при старте: подготовка БД, восстановление таймера и автозапуск донатов."""
-    init_db()
+    """Инициализация при старте.
 
-    st = load_runtime_state()
-    if st:
-        rem = int(st.get("remaining_seconds", "60"))
-        is_running = st.get("is_running", "0") == "1"
-        fraction = float(st.get("fraction_carry", "0.0"))
-        last_upd = int(st.get("last_update_at", "0"))
+    Сервер начинает принимать соединения только после этой функции, поэтому здесь
+    лишь то, без чего не работает оверлей: БД, восстановление таймеров и планировщик.
+    Интеграция с DonationAlerts поднимается следом в фоне.
 
-        if is_running and last_upd:
-            diff = int(time.time()) - last_upd
-            rem = max(rem - diff, 0)
+    При WORKERS > 1 сначала выбирается ведущий воркер (app.core.bus); ведомые таймеры
+    не восстанавливают, а зеркалят события ведущего.
+    """
+    global _integrations_task
+    role = SINGLE
+    if cfg.workers > 1:
+        cluster.attach(_promote)
+        role = await bus.start(cfg.bus_port)
+    init_db()
+    writer.start()
 
-        state.remaining_seconds = rem
-        state.is_running = is_running and rem > 0
-        state.fraction_carry = fraction
+    if role != FOLLOWER:
+        for state in timers.values():
+            _restore_timer(state)
 
+    # Один планировщик на все таймеры
     start_timer_task()
+    reaper.start()
+
+    if role == FOLLOWER:
+        bus.follow()
+        return
+    _integrations_task = asyncio.create_task(_start_integrations())
+    bus.set_ready()
+
 
-    # Автозапуск donation listener, если всё есть
-    if state.oauth_client_id and state.oauth_client_secret and state.oauth_access_token:
-        state.donation_task = asyncio.create_task(donation_manager())
+@app.on_event("shutdown")
+async def _shutdown():
+    """Сохранить состояния таймеров, дописать очередь записи и закрыть подключение к БД."""
+    # Зеркало ведомого не сохраняем: состояние на диске принадлежит ведущему
+    if bus.role != FOLLOWER:
+        for state in timers.values():
+            save_state(state)
+    await bus.close()
+    await http_client.close_client()
+    writer.stop()
+    close_db()
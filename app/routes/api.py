@@ -0,0 +1,108 @@
+"""HTTP API для лёгких клиентов: снимок таймера и поток Server-Sent Events.
+
+Чат-боты, виджеты статуса и дашборды, которым не нужен постоянный WebSocket,
+опрашивают GET /api/timer: ответ собирается раз на изменение состояния
+(app.services.timer.timer_snapshot), а с заголовком If-None-Match неизменившийся
+снимок отдаётся как 304 без тела. GET /api/events — тот же снимок потоком SSE при
+каждом изменении; событие кодируется один раз и общее для всех подписчиков.
+"""
+
+import asyncio
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import Response
+
+from app.core.db import load_timer
+from app.core.state import DEFAULT_TIMER_ID, AppState, sse_limit
+from app.services.timer import timer_snapshot
+
+router = APIRouter()
+
+
+def _timer_or_404(timer_id: str) -> AppState:
+    """Найти существующий таймер (новый не создаётся); нет такого — 404."""
+    state = load_timer(timer_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Таймер не найден")
+    return state
+
+
+def _not_modified(request: Request, etag: str) -> bool:
+    """Проверить If-None-Match: у клиента уже есть снимок с этим ETag."""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in header.split(",")]
+    return etag in tags or "*" in tags
+
+
+@router.get("/api/timer")
+@router.get("/api/timer/{timer_id}")
+async def timer_snapshot_endpoint(request: Request, timer_id: str = DEFAULT_TIMER_ID):
+    """Снимок таймера: running, remaining, deadline (системное время окончания), color."""
+    snap = timer_snapshot(_timer_or_404(timer_id))
+    headers = {"ETag": snap.etag, "Cache-Control": "no-cache"}
+    if _not_modified(request, snap.etag):
+        return Response(status_code=304, headers=headers)
+    return Response(snap.body, media_type="application/json", headers=headers)
+
+
+class EventStream(Response):
+    """Ответ text/event-stream: подписчик набора st.sse_clients.
+
+    Для набора выглядит как сокет: send() отдаёт готовые куски ответа в ASGI,
+    close() (отключение отставшего клиента) завершает ответ. Сверх лимита
+    MAX_SSE_CLIENTS — 503 с Retry-After.
+    """
+
+    media_type = "text/event-stream"
+
+    def __init__(self, st: AppState) -> None:
+        # Как у StreamingResponse: без body, чтобы не появился Content-Length
+        self.status_code = 200
+        self.background = None
+        self.init_headers({"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        self.st = st
+        self._send = None
+        self._done = asyncio.Event()
+
+    async def send(self, message: dict) -> None:
+        await self._send(message)
+
+    async def close(self, code: int | None = None) -> None:
+        self._done.set()
+
+    async def _wait_disconnect(self, receive) -> None:
+        while (await receive())["type"] != "http.disconnect":
+            pass
+        self._done.set()
+
+    async def __call__(self, scope, receive, send) -> None:
+        if not sse_limit.acquire():
+            await Response(status_code=503, headers={"Retry-After": "5"})(scope, receive, send)
+            return
+        self._send = send
+        watcher = None
+        try:
+            await send({"type": "http.response.start", "status": 200, "headers": self.raw_headers})
+            sub = self.st.sse_clients.add(self)
+            # Сначала — текущее состояние, дальше — каждое изменение
+            sub.push(timer_snapshot(self.st).event)
+            watcher = asyncio.create_task(self._wait_disconnect(receive))
+            await self._done.wait()
+        finally:
+            if watcher is not None:
+                watcher.cancel()
+            self.st.sse_clients.discard(self)
+            sse_limit.release()
+        try:
+            await send({"type": "http.response.body", "body": b"", "more_body": False})
+        except Exception:
+            pass  # клиент уже отключился
+
+
+@router.get("/api/events")
+@router.get("/api/events/{timer_id}")
+async def timer_events(timer_id: str = DEFAULT_TIMER_ID):
+    """Поток Server-Sent Events: снимок таймера при подключении и при каждом изменении."""
+    return EventStream(_timer_or_404(timer_id))
@@ -1,65 +1,136 @@
-"""Маршруты FastAPI для HTML-страниц и OAuth-авторизации DonationAlerts."""
+"""Маршруты FastAPI для HTML-страниц и OAuth-авторизации DonationAlerts.
 
+Страницы таймера по умолчанию живут по прежним адресам (/, /config, /auth),
+именованного — по /timer/{timer_id}, /config/{timer_id}, /auth/{timer_id}.
+"""
+
+import functools
 import secrets
 from urllib.parse import urlencode, quote_plus
 from pathlib import Path
 
-from fastapi import APIRouter, Request, Form
+from fastapi import APIRouter, HTTPException, Query, Request, Form
 from fastapi.responses import RedirectResponse
-from fastapi.templating import Jinja2Templates
 
-from app.core.state import state
-from app.core.db import get_setting, save_tokens
+from app.core.config import cfg
+from app.core.state import DEFAULT_TIMER_ID, AppState, get_timer
+from app.core.db import find_timer_by_setting, load_timer, get_setting, refresh_settings_if_changed, save_tokens, set_settings
+from app.core.money import format_coef, parse_coef
+from app.services import http_client
 
 router = APIRouter()
 
 # Директория с Jinja2-шаблонами
 TEMPLATES_DIR = Path(__file__).resolve().parent.parent / "templates"
-templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
+
+# Незавершённые OAuth-авторизации: значение параметра state → идентификатор таймера
+_pending_auth: dict = {}
+
+
+@functools.cache
+def _templates():
+    """Шаблоны Jinja2; jinja2 импортируется при первой отрисовке страницы, а не при старте."""
+    from fastapi.templating import Jinja2Templates
+
+    return Jinja2Templates(directory=str(TEMPLATES_DIR))
+
+
+def _timer_or_404(timer_id: str) -> AppState:
+    """Найти существующий таймер (новый не создаётся); нет такого — 404."""
+    state = load_timer(timer_id)
+    if state is None:
+        raise HTTPException(status_code=404, detail="Таймер не найден")
+    return state
+
+
+def _get_or_create(timer_id: str) -> AppState:
+    """Найти или создать таймер — для панели и авторизации; недопустимый id или лимит — 404."""
+    try:
+        return get_timer(timer_id)
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+
+def _suffix(state: AppState) -> str:
+    """Суффикс адресов таймера: пусто для таймера по умолчанию, иначе /{timer_id}."""
+    return "" if state.timer_id == DEFAULT_TIMER_ID else f"/{state.timer_id}"
 
 
 @router.get("/")
-async def index(request: Request):
+@router.get("/timer/{timer_id}")
+async def index(request: Request, timer_id: str = DEFAULT_TIMER_ID):
     """Главная страница (таймер)."""
-    return templates.TemplateResponse("index.html", {"request": request})
+    state = _timer_or_404(timer_id)
+    return _templates().TemplateResponse(
+        "index.html", {"request": request, "suffix": _suffix(state)}
+    )
 
 
 @router.get("/config")
-async def config_page(request: Request):
+@router.get("/config/{timer_id}")
+async def config_page(request: Request, timer_id: str = DEFAULT_TIMER_ID):
     """Страница настроек таймера и токенов."""
-    token = get_setting("access_token") or ""
+    state = _get_or_create(timer_id)
+    # Токены могли получить через другой воркер
+    refresh_settings_if_changed()
+    token = get_setting("access_token", state.timer_id) or ""
     state.oauth_access_token = token
 
-    rub = get_setting("rub_to_sec")
+    rub = get_setting("rub_to_sec", state.timer_id)
     if rub is not None:
         try:
-            state.rub_to_sec = float(rub)
+            state.coef_ms = parse_coef(rub)
         except ValueError:
-            state.rub_to_sec = 10.0
+            pass  # битое значение — показываем текущий коэффициент
 
-    return templates.TemplateResponse(
+    return _templates().TemplateResponse(
         "config.html",
-        {"request": request, "token": token, "coef": state.rub_to_sec},
+        {
+            "request": request,
+            "token": token,
+            "coef": format_coef(state.coef_ms),
+            "suffix": _suffix(state),
+            "timer_id": state.timer_id,
+        },
     )
 
 
 @router.get("/auth")
-async def auth_page(request: Request):
+@router.get("/auth/{timer_id}")
+async def auth_page(request: Request, timer_id: str = DEFAULT_TIMER_ID):
     """Страница ввода client_id/secret и старта OAuth-авторизации."""
-    return templates.TemplateResponse(
-        "auth.html", {"request": request, "redirect_uri": state.oauth_redirect_uri}
+    state = _get_or_create(timer_id)
+    return _templates().TemplateResponse(
+        "auth.html",
+        {
+            "request": request,
+            "redirect_uri": state.oauth_redirect_uri,
+            "timer_id": state.timer_id,
+            "suffix": _suffix(state),
+        },
     )
 
 
 @router.post("/start_auth")
 async def start_auth(
-    request: Request, client_id: str = Form(...), client_secret: str = Form(...)
+    request: Request,
+    client_id: str = Form(...),
+    client_secret: str = Form(...),
+    timer_id: str = Form(DEFAULT_TIMER_ID),
 ):
     """Формирует URL авторизации и перенаправляет пользователя в DonationAlerts."""
+    state = _get_or_create(timer_id)
     state.oauth_client_id = client_id
     state.oauth_client_secret = client_secret
 
+    # Redirect URI у приложения DonationAlerts один на все таймеры —
+    # таймер, для которого идёт авторизация, узнаём по параметру state
     oauth_state = secrets.token_urlsafe(16)
+    _pending_auth[oauth_state] = state.timer_id
+    # Возврат из DonationAlerts может прийти на другой воркер — он найдёт всё это в БД
+    set_settings(
+        {"client_id": client_id, "client_secret": client_secret, "oauth_state": oauth_state}, state.timer_id
+    )
     params = {
         "client_id": state.oauth_client_id,
         "redirect_uri": state.oauth_redirect_uri,
@@ -67,18 +138,22 @@ async def start_auth(
         "scope": "oauth-user-show oauth-donation-subscribe",
         "state": oauth_state,
     }
-    auth_url = "https://www.donationalerts.com/oauth/authorize?" + urlencode(
+    auth_url = f"{cfg.da_base_url}/oauth/authorize?" + urlencode(
         params, quote_via=quote_plus
     )
     return RedirectResponse(url=auth_url)
 
 
 @router.get("/callback")
-async def callback(code: str):
+async def callback(code: str, oauth_state: str | None = Query(None, alias="state")):
     """Обработчик редиректа от DonationAlerts: получает и сохраняет токены."""
-    import httpx
-
-    token_url = "https://www.donationalerts.com/oauth/token"
+    timer_id = _pending_auth.pop(oauth_state, None)
+    if timer_id is None and oauth_state:
+        # Авторизацию начинали через другой воркер
+        refresh_settings_if_changed()
+        timer_id = find_timer_by_setting("oauth_state", oauth_state)
+    state = _get_or_create(timer_id or DEFAULT_TIMER_ID)
+    token_url = f"{cfg.da_base_url}/oauth/token"
     data = {
         "client_id": state.oauth_client_id,
         "client_secret": state.oauth_client_secret,
@@ -87,14 +162,13 @@ async def callback(code: str):
         "redirect_uri": state.oauth_redirect_uri,
     }
 
-    async with httpx.AsyncClient() as client:
-        r = await client.post(token_url, data=data)
-        if r.status_code == 200:
-            js = r.json()
-            access_token = js.get("access_token")
-            refresh_token = js.get("refresh_token")
-            expires_in = js.get("expires_in", 3600)
-            save_tokens(access_token, refresh_token, expires_in)
-            state.oauth_access_token = access_token
-
-    return RedirectResponse(url="/config")
+    r = await http_client.request("POST", token_url, data=data)
+    if r.status_code == 200:
+        js = r.json()
+        access_token = js.get("access_token")
+        refresh_token = js.get("refresh_token")
+        expires_in = js.get("expires_in", 3600)
+        save_tokens(state, access_token, refresh_token, expires_in)
+        state.oauth_access_token = access_token
+
+    return RedirectResponse(url=f"/config{_suffix(state)}")
@@ -1,151 +1,168 @@
-"""WebSocket-маршруты: обновление таймера, настроек и управление приложением."""
+"""WebSocket-маршруты: обновление таймера, настроек и управление приложением.
+
+Каждый маршрут есть в двух вариантах: /ws/{timer_id} для именованного таймера
+и /ws без идентификатора — для таймера по умолчанию.
+"""
+
+import json
 
-import asyncio
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 
-from app.core.state import state, broadcast_control, broadcast_timer_cfg
-from app.core.db import set_setting, get_setting
-from app.services.timer import format_time
-from app.services.donationalerts import donation_manager
+from app.core.clients import ConnectionLimit, Frame
+from app.core.db import load_timer
+from app.core.logs import format_record
+from app.core.protocol import CONTROL_SUBPROTOCOL, DELTA_SUBPROTOCOL, OVERLAY_SUBPROTOCOL, TIME_TOPIC
+from app.core.state import (
+    DEFAULT_TIMER_ID,
+    AppState,
+    control_limit,
+    get_timer,
+    log_frame,
+    style_frame,
+    timer_cfg_limit,
+    ws_limit,
+)
+from app.services.cluster import run_command
+from app.services.timer import time_frame, current_remaining, delta_frame
 
 router = APIRouter()
 
 
-@router.websocket("/ws")
-async def timer_ws(websocket: WebSocket):
-    """Соединение для страницы с таймером: рассылает оставшееся время."""
+async def _open_timer(websocket: WebSocket, timer_id: str, create: bool = False) -> AppState | None:
+    """Найти таймер для соединения; нет такого (или недопустимый id) — отклонить сокет.
+
+    Создаёт таймер только панель управления (create=True); оверлеи подключаются
+    к существующим, чтобы обращения к случайным адресам не заводили таймеры.
+    """
+    if create:
+        try:
+            return get_timer(timer_id)
+        except ValueError:
+            state = None
+    else:
+        state = load_timer(timer_id)
+    if state is None:
+        await websocket.close(code=1008)
+    return state
+
+
+async def _over_limit(websocket: WebSocket, limit: ConnectionLimit) -> bool:
+    """Занять место под соединение; сверх лимита эндпоинта — закрыть с кодом 1013 («повторите позже»)."""
+    if limit.acquire():
+        return False
     await websocket.accept()
-    state.timer_clients.append(websocket)
+    await websocket.close(code=1013)
+    return True
+
 
-    # Отправить стартовое значение при подключении
-    await websocket.send_text(format_time(state.remaining_seconds))
+async def _receive_until_closed(websocket: WebSocket, sub) -> None:
+    """Читать сообщения клиента до отключения; любое сообщение (в т. ч. ответ на пинг) — признак жизни."""
+    while (await websocket.receive())["type"] != "websocket.disconnect":
+        sub.touch()
 
+
+@router.websocket("/ws")
+@router.websocket("/ws/{timer_id}")
+async def timer_ws(websocket: WebSocket, timer_id: str = DEFAULT_TIMER_ID):
+    """Соединение для страницы с таймером: рассылает оставшееся время.
+
+    Подпротокол выбирается из предложенных клиентом: wsp-overlay.1 — единый канал
+    с кадрами времени и стиля (отдельный /timer_cfg не нужен), wsp-delta.1 — только
+    кадры времени (app.core.protocol), без подпротокола — строка DD:HH:MM:SS каждую секунду.
+    """
+    state = await _open_timer(websocket, timer_id)
+    if state is None or await _over_limit(websocket, ws_limit):
+        return
+    offered = websocket.scope.get("subprotocols", ())
+    if OVERLAY_SUBPROTOCOL in offered:
+        subprotocol, clients = OVERLAY_SUBPROTOCOL, state.overlay_clients
+    elif DELTA_SUBPROTOCOL in offered:
+        subprotocol, clients = DELTA_SUBPROTOCOL, state.delta_clients
+    else:
+        subprotocol, clients = None, state.timer_clients
     try:
-        while True:
-            await websocket.receive_text()  # сообщения от клиента не используем
+        await websocket.accept(subprotocol=subprotocol)
+        sub = clients.add(websocket)
+
+        # Отправить стартовое состояние при подключении
+        if subprotocol is None:
+            sub.push(time_frame(current_remaining(state)))
+        else:
+            sub.push(Frame(delta_frame(state), TIME_TOPIC))
+        if subprotocol == OVERLAY_SUBPROTOCOL:
+            sub.push(style_frame(state))
+
+        await _receive_until_closed(websocket, sub)
     except WebSocketDisconnect:
-        if websocket in state.timer_clients:
-            state.timer_clients.remove(websocket)
+        pass
+    finally:
+        clients.discard(websocket)
+        ws_limit.release()
 
 
 @router.websocket("/timer_cfg")
-async def timer_cfg_ws(websocket: WebSocket):
-    """Соединение для страницы настроек таймера: рассылает текущий цвет текста."""
-    await websocket.accept()
-    state.timer_cfg_clients.append(websocket)
+@router.websocket("/timer_cfg/{timer_id}")
+async def timer_cfg_ws(websocket: WebSocket, timer_id: str = DEFAULT_TIMER_ID):
+    """Соединение для страницы настроек таймера: рассылает текущий цвет текста.
+
+    Оверлеи с каналом wsp-overlay.1 получают цвет по /ws; этот адрес — для старых страниц.
+    """
+    state = await _open_timer(websocket, timer_id)
+    if state is None or await _over_limit(websocket, timer_cfg_limit):
+        return
+    try:
+        await websocket.accept()
+        sub = state.timer_cfg_clients.add(websocket)
 
-    # Отправить цвет при подключении
-    await websocket.send_text(state.timer_text_color)
+        # Отправить цвет при подключении
+        sub.push(state.timer_text_color)
 
-    try:
-        while True:
-            await websocket.receive_text()  # клиент ничего не присылает
+        await _receive_until_closed(websocket, sub)
     except WebSocketDisconnect:
-        if websocket in state.timer_cfg_clients:
-            state.timer_cfg_clients.remove(websocket)
+        pass
+    finally:
+        state.timer_cfg_clients.discard(websocket)
+        timer_cfg_limit.release()
 
 
 @router.websocket("/control")
-async def control_ws(websocket: WebSocket):
-    """Соединение панели управления: принимает команды для управления таймером и токенами."""
-    await websocket.accept()
-    state.control_clients.append(websocket)
-    await websocket.send_text("Connected to control panel")
-
+@router.websocket("/control/{timer_id}")
+async def control_ws(websocket: WebSocket, timer_id: str = DEFAULT_TIMER_ID):
+    """Соединение панели управления: принимает команды для управления таймером и токенами.
+
+    Текстовые сообщения — команды (JSON-запросы или строки прежнего формата,
+    app.services.control), бинарные — ответы на пинг (app.services.reaper).
+    С подпротоколом wsp-control.1 лог приходит JSON-объектами {"type": "log", ...},
+    и панель получает пинги; без него — строки лога и никаких пингов.
+    """
+    state = await _open_timer(websocket, timer_id, create=True)
+    if state is None or await _over_limit(websocket, control_limit):
+        return
+    if CONTROL_SUBPROTOCOL in websocket.scope.get("subprotocols", ()):
+        subprotocol, clients = CONTROL_SUBPROTOCOL, state.control_json_clients
+    else:
+        subprotocol, clients = None, state.control_clients
     try:
-        while True:
-            cmd = await websocket.receive_text()
-
-            if cmd.startswith("set "):
-                # Установить новое значение таймера
-                try:
-                    h, m, s = cmd[4:].split(":")
-                    state.timer_total_seconds = int(h) * 3600 + int(m) * 60 + int(s)
-                    state.remaining_seconds = state.timer_total_seconds
-                    await websocket.send_text(
-                        f"Установлено время: {format_time(state.remaining_seconds)}"
-                    )
-                    from app.core.state import broadcast_timer
-
-                    await broadcast_timer(format_time(state.remaining_seconds))
-                except Exception:
-                    await websocket.send_text("Ошибка формата (нужно HH:MM:SS)")
-
-            elif cmd == "start":
-                state.is_running = True
-                await websocket.send_text("Таймер запущен")
-
-            elif cmd == "stop":
-                state.is_running = False
-                await websocket.send_text("Таймер остановлен")
-
-            elif cmd == "reset":
-                state.remaining_seconds = state.timer_total_seconds
-                from app.core.state import broadcast_timer
-
-                await broadcast_timer(format_time(state.remaining_seconds))
-                await websocket.send_text("Таймер сброшен")
-
-            elif cmd.startswith("token "):
-                # Установка access_token вручную и запуск donation listener
-                maybe = cmd[6:].strip()
-                if maybe:
-                    set_setting("access_token", maybe)
-                    state.oauth_access_token = maybe
-
-                if not (
-                    state.oauth_client_id
-                    and state.oauth_client_secret
-                    and (get_setting("access_token") or state.oauth_access_token)
-                ):
-                    await websocket.send_text(
-                        "Не заданы client_id/secret или пустой Access Token"
-                    )
-                    continue
-
-                if state.donation_task:
-                    state.donation_task.cancel()
-                    await websocket.send_text("Перезапуск DA-листенера...")
-
-                state.donation_task = asyncio.create_task(donation_manager())
-                await websocket.send_text(
-                    "Access Token сохранён, пробуем подключиться к DonationAlerts..."
-                )
-
-            elif cmd.startswith("coef "):
-                # Изменить коэффициент рубль → секунды
-                try:
-                    val = float(cmd[5:].strip().replace(",", "."))
-                    if val < 0:
-                        await websocket.send_text(
-                            "Ошибка: коэффициент не может быть отрицательным"
-                        )
-                    else:
-                        state.rub_to_sec = val
-                        set_setting("rub_to_sec", str(val))
-                        await websocket.send_text(
-                            f"Соотношение изменено: 1₽ = {val:g} секунд"
-                        )
-                except Exception:
-                    await websocket.send_text("Ошибка: укажи число, например 4.5")
-
-            elif cmd.startswith("color "):
-                # Изменить цвет текста таймера
-                col = cmd[6:].strip().lower()
-                if col not in ("black", "white"):
-                    await websocket.send_text(
-                        "Ошибка: допустимы только 'black' или 'white'"
-                    )
-                else:
-                    state.timer_text_color = col
-                    set_setting("timer_color", col)
-                    await broadcast_timer_cfg(col)
-                    await websocket.send_text(f"Цвет таймера установлен: {col}")
-
-            else:
-                await websocket.send_text(f"Неизвестная команда: {cmd}")
+        await websocket.accept(subprotocol=subprotocol)
+        # Ответы идут через ту же очередь, что и рассылка, — порядок сообщений сохраняется
+        sub = clients.add(websocket)
+        # Сначала — недавний лог таймера, чтобы панель не открывалась пустой
+        for record in list(state.log_history):
+            sub.push(format_record(record) if subprotocol is None else log_frame(record))
+        if subprotocol is None:
+            sub.push("Connected to control panel")
+        else:
+            sub.push(json.dumps({"type": "hello", "timer": state.timer_id}))
 
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            sub.touch()
+            if message.get("text") is not None:
+                await run_command(state, message["text"], sub.push)
     except WebSocketDisconnect:
-        if websocket in state.control_clients:
-            state.control_clients.remove(websocket)
-            
\ No newline at end of file
+        pass
+    finally:
+        clients.discard(websocket)
+        control_limit.release()
@@ -0,0 +1,127 @@
+"""Несколько воркеров: связь таймеров с локальной шиной (app.core.bus).
+
+Ведущий воркер публикует все рассылки таймеров в шину (см. app.core.state и
+app.services.timer), отдаёт новому ведомому снимок состояния и выполняет команды
+панелей, подключённых к ведомым. Ведомый держит зеркало таймеров: по кадрам
+бинарного протокола знает дедлайн и состояние, по кадрам времени — показываемое
+значение, — и раздаёт события своим клиентам готовыми кадрами, как ведущий.
+"""
+
+import itertools
+import json
+import math
+import time
+
+from app.core.bus import (
+    bus,
+    CFG,
+    COMMAND,
+    CONTROL,
+    DELTA,
+    DONE,
+    FOLLOWER,
+    HISTORY,
+    READY,
+    REPLY,
+    SINGLE,
+    TIME,
+    pack_id,
+    unpack_id,
+)
+from app.core.db import refresh_settings_if_changed
+from app.core.protocol import decode_frame
+from app.core.state import AppState, broadcast_record, get_timer, style_frame, timers
+from app.services import control
+from app.services.timer import broadcast_delta, delta_frame, parse_time, publish_snapshot, time_frame
+
+# Ответы на команды, пересланные ведущему: id команды → reply панели
+_replies: dict = {}
+_command_ids = itertools.count(1)
+
+
+async def run_command(st: AppState, cmd: str, reply) -> None:
+    """Выполнить команду панели: на месте или, у ведомого воркера, через ведущего."""
+    if bus.role == FOLLOWER:
+        message_id = next(_command_ids)
+        _replies[message_id] = reply
+        if not bus.to_leader(COMMAND, st.timer_id, pack_id(message_id, cmd)):
+            _replies.pop(message_id, None)
+            reply("Ошибка: нет связи с ведущим воркером, повторите команду")
+        return
+    if bus.role != SINGLE:
+        # Страницы ведомых (OAuth) пишут настройки в БД — подхватываем их перед командой
+        refresh_settings_if_changed()
+    await control.execute(st, cmd, reply)
+
+
+async def _on_command(timer_id: str, message_id: int, text: str, writer) -> None:
+    """Ведущий: выполнить команду, пришедшую с ведомого, и отправить ответы туда же."""
+    try:
+        st = get_timer(timer_id)
+    except ValueError as e:
+        bus.send(writer, REPLY, timer_id, pack_id(message_id, f"Ошибка: {e}"))
+    else:
+        await run_command(st, text, lambda msg: bus.send(writer, REPLY, timer_id, pack_id(message_id, msg)))
+    bus.send(writer, DONE, timer_id, pack_id(message_id))
+
+
+def _on_peer(writer) -> None:
+    """Ведущий: отправить новому ведомому состояние всех таймеров и историю их логов."""
+    for st in list(timers.values()):
+        bus.send(writer, DELTA, st.timer_id, delta_frame(st))
+        bus.send(writer, CFG, st.timer_id, st.timer_text_color.encode())
+        for record in list(st.log_history):
+            bus.send(writer, HISTORY, st.timer_id, json.dumps(record, ensure_ascii=False).encode())
+
+
+def _on_event(kind: int, timer_id: str, payload: bytes) -> None:
+    """Ведомый: применить событие ведущего к зеркалу таймера и разослать своим клиентам."""
+    if kind == READY:
+        # (Пере)подключились к ведущему: история логов придёт заново в снимке,
+        # а ответов на команды прежнему ведущему уже не будет
+        for st in timers.values():
+            st.log_history.clear()
+        _replies.clear()
+        return
+    if kind in (REPLY, DONE):
+        message_id, text = unpack_id(payload)
+        if kind == DONE:
+            _replies.pop(message_id, None)
+        elif message_id in _replies:
+            _replies[message_id](text)
+        return
+
+    try:
+        st = get_timer(timer_id)
+    except ValueError:
+        return
+    if kind == TIME:
+        sec = parse_time(payload.decode())
+        st.remaining_seconds = sec
+        st.timer_clients.broadcast(time_frame(sec))
+    elif kind == DELTA:
+        _, running, remaining_ms, _ = decode_frame(payload)
+        st.is_running = running
+        st.deadline = time.monotonic() + remaining_ms / 1000 if running else None
+        st.remaining_seconds = math.ceil(remaining_ms / 1000)
+        broadcast_delta(st, payload)
+        publish_snapshot(st)
+    elif kind in (CONTROL, HISTORY):
+        record = json.loads(payload)
+        st.log_history.append(record)
+        if kind == CONTROL:
+            broadcast_record(record, st)
+    elif kind == CFG:
+        st.timer_text_color = payload.decode()
+        st.timer_cfg_clients.broadcast(st.timer_text_color)
+        if len(st.overlay_clients):
+            st.overlay_clients.broadcast(style_frame(st))
+        publish_snapshot(st)
+
+
+def attach(on_promote) -> None:
+    """Подключить обработчики шины; on_promote — корутина, ведомый стал ведущим."""
+    bus.on_event = _on_event
+    bus.on_command = _on_command
+    bus.on_peer = _on_peer
+    bus.on_promote = on_promote
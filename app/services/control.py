@@ -0,0 +1,416 @@
+"""Команды панели управления таймером.
+
+Команда — имя и словарь аргументов; таблица COMMANDS сопоставляет имени проверку
+аргументов и выполнение. В /control команды приходят в двух видах:
+
+- JSON: ``{"id": 1, "cmd": "set", "args": {"time": "01:00:00"}}`` или пачкой
+  ``{"id": 2, "batch": [{"cmd": "set", ...}, {"cmd": "coef", ...}, {"cmd": "start"}]}``.
+  Ответ — ``{"type": "reply", "id": ..., "ok": true, "result": {...}}`` (у пачки —
+  ``"results": [...]``), при ошибке — ``"ok": false, "error": {"code": ..., "message": ...}``;
+- текстом, как раньше (``set 01:00:00``, ``start``, ``coef 4.5``, ...): строка разбирается
+  в те же имя и аргументы (parse_text), ответ — строка для лога панели.
+
+Пачка атомарна: сначала проверяются все команды, и при ошибке не выполняется ни одна;
+затем они выполняются подряд, не отдавая управление циклу событий, — между ними не
+вклинится ни тик, ни донат, а оверлеи получают одно итоговое состояние.
+В режиме нескольких воркеров команды с ведомых выполняет ведущий (app.services.cluster).
+"""
+
+import json
+import asyncio
+import time
+import traceback
+from typing import NamedTuple
+
+from app.core import protocol
+from app.core.state import AppState, broadcast_timer, broadcast_timer_cfg
+from app.core.db import set_setting, get_setting, donation_totals
+from app.core.money import format_coef, format_minor, format_rate, parse_coef, parse_rate
+from app.services.timer import (
+    format_time,
+    publish_event,
+    publish_snapshot,
+    time_frame,
+    set_remaining,
+    start_timer,
+    stop_timer,
+)
+from app.services import journal
+
+
+# Пределы значений панели — с большим запасом внутри int64 миллисекунд кадров
+# протокола оверлея (app.core.protocol): время для set и totals — 10 лет,
+# коэффициент — сутки за рубль, курс — 10 млн рублей за единицу валюты
+MAX_SECONDS = 3650 * 86400
+MAX_COEF_MS = parse_coef(86400)
+MAX_RATE = parse_rate(10_000_000)
+
+
+class CommandError(Exception):
+    """Команду нельзя выполнить: текст — для панели, code — для JSON-ответа."""
+
+    def __init__(self, message: str, code: str = "bad_args") -> None:
+        super().__init__(message)
+        self.code = code
+
+
+class Effects:
+    """Рассылки, отложенные до конца команды или пачки: не больше одной на канал.
+
+    delta — вид кадра бинарного протокола (protocol.START и т. п.); если состояние
+    меняли несколько команд, оверлеи получают один SNAPSHOT с итогом.
+    """
+
+    __slots__ = ("delta", "time", "style")
+
+    def __init__(self) -> None:
+        self.delta: int | None = None
+        self.time = False
+        self.style = False
+
+    def event(self, kind: int) -> None:
+        self.delta = kind if self.delta is None else protocol.SNAPSHOT
+
+    async def flush(self, state: AppState) -> None:
+        if self.delta is not None:
+            publish_event(state, self.delta)
+        if self.time:
+            await broadcast_timer(time_frame(state.remaining_seconds), state)
+        if self.style:
+            await broadcast_timer_cfg(state.timer_text_color, state)
+            if self.delta is None:
+                # Иначе цвет уже ушёл в SSE вместе со снимком времени
+                publish_snapshot(state)
+
+
+# ----------------- Команды: проверка аргументов и выполнение -----------------
+# Проверка не меняет состояние и при ошибке бросает CommandError; выполнение
+# не ошибается и не уступает цикл событий (кроме команд с batch=False).
+
+def _no_args(state: AppState, args: dict) -> dict:
+    return {}
+
+
+def _check_set(state: AppState, args: dict) -> dict:
+    try:
+        if "seconds" in args:
+            sec = int(args["seconds"])
+        else:
+            h, m, s = str(args.get("time", "")).split(":")
+            sec = int(h) * 3600 + int(m) * 60 + int(s)
+    except (TypeError, ValueError, OverflowError):
+        raise CommandError("Ошибка формата (нужно HH:MM:SS)")
+    if not 0 <= sec <= MAX_SECONDS:
+        raise CommandError(f"Ошибка: время должно быть от 0 до {format_time(MAX_SECONDS)}")
+    return {"seconds": sec}
+
+
+async def _set(state: AppState, args: dict, fx: Effects) -> dict:
+    state.timer_total_seconds = args["seconds"]
+    set_remaining(state, state.timer_total_seconds, publish=False)
+    fx.event(protocol.SNAPSHOT)
+    fx.time = True
+    return {
+        "message": f"Установлено время: {format_time(state.remaining_seconds)}",
+        "remaining": state.remaining_seconds,
+    }
+
+
+async def _start(state: AppState, args: dict, fx: Effects) -> dict:
+    start_timer(state, publish=False)
+    if state.is_running:
+        fx.event(protocol.START)
+    return {"message": "Таймер запущен", "running": state.is_running}
+
+
+async def _stop(state: AppState, args: dict, fx: Effects) -> dict:
+    stop_timer(state, publish=False)
+    fx.event(protocol.STOP)
+    # Остановка могла прийтись на границу секунды, которую оверлеи ещё не видели
+    fx.time = True
+    return {"message": "Таймер остановлен", "remaining": state.remaining_seconds}
+
+
+async def _reset(state: AppState, args: dict, fx: Effects) -> dict:
+    set_remaining(state, state.timer_total_seconds, "reset", publish=False)
+    fx.event(protocol.SNAPSHOT)
+    fx.time = True
+    return {"message": "Таймер сброшен", "remaining": state.remaining_seconds}
+
+
+def _check_token(state: AppState, args: dict) -> dict:
+    token = str(args.get("token") or "").strip()
+    if not (
+        state.oauth_client_id
+        and state.oauth_client_secret
+        and (token or get_setting("access_token", state.timer_id) or state.oauth_access_token)
+    ):
+        raise CommandError("Не заданы client_id/secret или пустой Access Token", "not_configured")
+    return {"token": token}
+
+
+async def _token(state: AppState, args: dict, fx: Effects) -> dict:
+    # Установка access_token вручную и запуск donation listener
+    if args["token"]:
+        set_setting("access_token", args["token"], state.timer_id)
+        state.oauth_access_token = args["token"]
+
+    restarted = bool(state.donation_task)
+    if restarted:
+        state.donation_task.cancel()
+
+    # Модуль DonationAlerts (websockets, httpx) грузится при первом подключении
+    from app.services.donationalerts import donation_manager
+
+    state.donation_task = asyncio.create_task(donation_manager(state))
+    message = "Access Token сохранён, пробуем подключиться к DonationAlerts..."
+    if restarted:
+        message = "Перезапуск DA-листенера. " + message
+    return {"message": message, "restarted": restarted}
+
+
+def _check_coef(state: AppState, args: dict) -> dict:
+    # Коэффициент рубль → секунды (точность — миллисекунда)
+    try:
+        coef_ms = parse_coef(str(args.get("value", "")))
+    except ValueError as e:
+        raise CommandError(f"Ошибка: {e}; укажи число, например 4.5")
+    if coef_ms > MAX_COEF_MS:
+        raise CommandError(f"Ошибка: коэффициент не больше {format_coef(MAX_COEF_MS)}")
+    return {"coef_ms": coef_ms}
+
+
+async def _coef(state: AppState, args: dict, fx: Effects) -> dict:
+    state.coef_ms = args["coef_ms"]
+    journal.append(state, "coef", coef_ms=state.coef_ms)
+    coef = format_coef(state.coef_ms)
+    set_setting("rub_to_sec", coef, state.timer_id)
+    return {"message": f"Соотношение изменено: 1₽ = {coef} секунд", "coef": coef}
+
+
+def _check_rate(state: AppState, args: dict) -> dict:
+    # Без валюты — список курсов; курс "off" или null — убрать
+    if args.get("currency") is None:
+        return {}
+    code = str(args["currency"])
+    if not code.isalpha() or "rate" not in args:
+        raise CommandError("Ошибка: нужно rate <валюта> <курс>, например rate USD 92.5")
+    if args["rate"] in (None, "off"):
+        return {"currency": code.upper(), "rate": None}
+    try:
+        rate = parse_rate(str(args["rate"]))
+    except ValueError as e:
+        raise CommandError(f"Ошибка: {e}")
+    if rate > MAX_RATE:
+        raise CommandError(f"Ошибка: курс не больше {format_rate(MAX_RATE)}")
+    return {"currency": code.upper(), "rate": rate}
+
+
+async def _rate(state: AppState, args: dict, fx: Effects) -> dict:
+    if not args:
+        rates = ", ".join(
+            f"{code} = {format_rate(rate)}₽" for code, rate in sorted(state.currency_rates.items())
+        )
+        return {
+            "message": f"Курсы: {rates or 'не заданы, используется пересчёт DonationAlerts'}",
+            "rates": {code: format_rate(rate) for code, rate in sorted(state.currency_rates.items())},
+        }
+    code, rate = args["currency"], args["rate"]
+    if rate is None:
+        state.currency_rates.pop(code, None)
+        message = f"Курс {code} убран"
+    else:
+        state.currency_rates[code] = rate
+        message = f"Курс установлен: 1 {code} = {format_rate(rate)}₽"
+    set_setting(
+        "currency_rates",
+        json.dumps({c: format_rate(r) for c, r in state.currency_rates.items()}),
+        state.timer_id,
+    )
+    return {"message": message, "currency": code, "rate": None if rate is None else format_rate(rate)}
+
+
+def _check_color(state: AppState, args: dict) -> dict:
+    col = str(args.get("color", "")).strip().lower()
+    if col not in ("black", "white"):
+        raise CommandError("Ошибка: допустимы только 'black' или 'white'")
+    return {"color": col}
+
+
+async def _color(state: AppState, args: dict, fx: Effects) -> dict:
+    state.timer_text_color = args["color"]
+    set_setting("timer_color", args["color"], state.timer_id)
+    fx.style = True
+    return {"message": f"Цвет таймера установлен: {args['color']}", "color": args["color"]}
+
+
+def _check_totals(state: AppState, args: dict) -> dict:
+    # Итоги донатов за последние N часов (по умолчанию 24)
+    try:
+        hours = float(args.get("hours", 24))
+    except (TypeError, ValueError):
+        raise CommandError("Ошибка: укажи число часов, например totals 12")
+    # nan и inf не проходят сравнение
+    if not 0 < hours <= MAX_SECONDS / 3600:
+        raise CommandError("Ошибка: укажи число часов, например totals 12")
+    return {"hours": hours}
+
+
+async def _totals(state: AppState, args: dict, fx: Effects) -> dict:
+    hours = args["hours"]
+    since = int(time.time() - hours * 3600)
+    totals = await asyncio.to_thread(donation_totals, since, None, state.timer_id)
+    return {
+        "message": (
+            f"Итоги за {hours:g} ч: донатов {totals['count']}, "
+            f"сумма {format_minor(totals['amount_minor'])}₽, "
+            f"добавлено {format_time(int(totals['added_seconds']))}"
+        ),
+        "count": totals["count"],
+        "amount": format_minor(totals["amount_minor"]),
+        "added_seconds": int(totals["added_seconds"]),
+    }
+
+
+class Command(NamedTuple):
+    """Строка таблицы команд: проверка аргументов, выполнение и можно ли в пачке."""
+
+    check: object
+    apply: object
+    batch: bool = True
+
+
+COMMANDS = {
+    "set": Command(_check_set, _set),
+    "start": Command(_no_args, _start),
+    "stop": Command(_no_args, _stop),
+    "reset": Command(_no_args, _reset),
+    "token": Command(_check_token, _token),
+    "coef": Command(_check_coef, _coef),
+    "rate": Command(_check_rate, _rate),
+    "color": Command(_check_color, _color),
+    # Ждёт чтения БД в потоке — в пачке нарушила бы атомарность
+    "totals": Command(_check_totals, _totals, batch=False),
+}
+
+
+# ----------------- Разбор запросов -----------------
+
+def parse_text(cmd: str) -> tuple:
+    """Текстовая команда прежнего формата → (имя, аргументы)."""
+    name, sep, rest = cmd.partition(" ")
+    if name in ("start", "stop", "reset") and not sep:
+        return name, {}
+    if name == "set" and sep:
+        return name, {"time": rest}
+    if name == "token" and sep:
+        return name, {"token": rest}
+    if name == "coef" and sep:
+        return name, {"value": rest}
+    if name == "color" and sep:
+        return name, {"color": rest}
+    if name == "totals":
+        # "totals" без числа — за сутки
+        return name, {"hours": rest.strip()} if rest.strip() else {}
+    if name == "rate":
+        # "rate" — список, "rate USD 92.5" — задать, "rate USD off" — убрать
+        parts = rest.split()
+        if not parts:
+            return name, {}
+        if len(parts) != 2:
+            raise CommandError("Ошибка: нужно rate <валюта> <курс>, например rate USD 92.5")
+        return name, {"currency": parts[0], "rate": parts[1]}
+    raise CommandError(f"Неизвестная команда: {cmd}", "unknown_command")
+
+
+def _prepare(state: AppState, item, batch: bool = False) -> tuple:
+    """Команда JSON-запроса → (строка таблицы, проверенные аргументы)."""
+    if not isinstance(item, dict):
+        raise CommandError("Команда должна быть объектом", "bad_request")
+    name = item.get("cmd")
+    command = COMMANDS.get(name) if isinstance(name, str) else None
+    if command is None:
+        raise CommandError(f"Неизвестная команда: {name}", "unknown_command")
+    if batch and not command.batch:
+        raise CommandError(f"Команду {name} нельзя выполнять в пачке", "bad_request")
+    args = item.get("args") or {}
+    if not isinstance(args, dict):
+        raise CommandError("args должен быть объектом", "bad_request")
+    return command, command.check(state, args)
+
+
+async def _apply(state: AppState, steps: list) -> list:
+    """Выполнить проверенные команды подряд, затем разослать итог — по сообщению на канал.
+
+    Падение при выполнении (проверка что-то пропустила) — CommandError с кодом
+    "internal", чтобы панель получила ответ, а соединение осталось открытым.
+    """
+    fx = Effects()
+    try:
+        results = [await command.apply(state, args, fx) for command, args in steps]
+        await fx.flush(state)
+    except Exception as e:
+        traceback.print_exc()
+        raise CommandError(f"Ошибка выполнения команды: {e}", "internal")
+    return results
+
+
+def _error(request_id, e: CommandError, index: int | None = None) -> dict:
+    error = {"code": e.code, "message": str(e)}
+    if index is not None:
+        error["index"] = index
+    return {"type": "reply", "id": request_id, "ok": False, "error": error}
+
+
+async def run_json(state: AppState, text: str) -> dict:
+    """Выполнить JSON-запрос (команду или пачку) и вернуть ответ."""
+    try:
+        request = json.loads(text)
+    except ValueError:
+        return _error(None, CommandError("Некорректный JSON", "bad_request"))
+    if not isinstance(request, dict):
+        return _error(None, CommandError("Запрос должен быть объектом", "bad_request"))
+    request_id = request.get("id")
+
+    if "batch" not in request:
+        try:
+            step = _prepare(state, request)
+            (result,) = await _apply(state, [step])
+        except CommandError as e:
+            return _error(request_id, e)
+        return {"type": "reply", "id": request_id, "ok": True, "result": result}
+
+    items = request["batch"]
+    if not isinstance(items, list) or not items:
+        return _error(request_id, CommandError("batch должен быть непустым списком", "bad_request"))
+    steps = []
+    for index, item in enumerate(items):
+        try:
+            steps.append(_prepare(state, item, batch=True))
+        except CommandError as e:
+            # Ни одна команда пачки не выполнена
+            return _error(request_id, e, index)
+    try:
+        results = await _apply(state, steps)
+    except CommandError as e:
+        return _error(request_id, e)
+    return {"type": "reply", "id": request_id, "ok": True, "results": results}
+
+
+async def execute(state: AppState, cmd: str, reply) -> None:
+    """Выполнить команду панели над таймером; reply(text) — ответ отправившей панели.
+
+    На JSON-запрос ответ — JSON, на текстовую команду — строка, как раньше.
+    """
+    if cmd.lstrip().startswith("{"):
+        reply(json.dumps(await run_json(state, cmd), ensure_ascii=False))
+        return
+    try:
+        name, args = parse_text(cmd)
+        command = COMMANDS[name]
+        step = (command, command.check(state, args))
+        (result,) = await _apply(state, [step])
+    except CommandError as e:
+        reply(str(e))
+        return
+    reply(result["message"])
@@ -0,0 +1,133 @@
+"""Разбор сообщений Centrifugo от DonationAlerts в компактную запись о донате.
+
+Публикация доната имеет известную форму ``{"result": {"channel": ..., "data": {"data": {...}}}}``,
+поэтому сначала проверяется этот путь, и лишь для незнакомой формы — ограниченный
+по глубине поиск. Пинги, ответы на команды и публикации без суммы отсеиваются ещё
+до разбора JSON (worth_parsing).
+"""
+
+import json
+from dataclasses import dataclass
+
+from app.core.money import to_minor
+
+# Ключи суммы доната в порядке приоритета
+AMOUNT_KEYS = ("amount", "amount_main")
+
+# Сумма, пересчитанная DonationAlerts в основную валюту стримера
+USER_AMOUNT_KEY = "amount_in_user_currency"
+
+# Максимальная глубина запасного поиска по незнакомой структуре
+MAX_DEPTH = 6
+
+# Разбор сообщения — тот же, что у json.loads, но без обработки его аргументов на каждом кадре
+decode_message = json.JSONDecoder().decode
+
+
+@dataclass(slots=True)
+class Donation:
+    """Донат из публикации DonationAlerts.
+
+    amount — сумма в валюте доната, user_amount — в основной валюте стримера по курсу
+    DonationAlerts (если он её прислал); обе — как пришли в JSON. Копейки
+    (amount_minor, user_amount_minor) считаются при обращении из исходного значения,
+    а не из float, чтобы не ловить 0.1 + 0.2; разбор публикации за них не платит.
+    """
+
+    amount: float | int | str
+    currency: str | None = None
+    donation_id: str | None = None
+    username: str | None = None
+    user_amount: float | int | str | None = None
+
+    @property
+    def amount_minor(self) -> int:
+        return to_minor(self.amount)
+
+    @property
+    def user_amount_minor(self) -> int | None:
+        return to_minor(self.user_amount) if self.user_amount is not None else None
+
+
+def _checked(raw):
+    """Сумма из JSON как есть, если её примут float и to_minor; иначе ValueError уже при разборе."""
+    # Обычное число проверяется сравнением, остальное (строки, отрицательные) — преобразованием
+    if (type(raw) is float or type(raw) is int) and 0 <= raw < 1e12:
+        return raw
+    float(raw)
+    to_minor(raw)
+    return raw
+
+
+def _from_payload(payload: dict) -> Donation | None:
+    """Собрать Donation из словаря с данными доната."""
+    for key in AMOUNT_KEYS:
+        if key in payload:
+            raw = payload[key]
+            break
+    else:
+        return None
+    if raw is None:
+        return None
+
+    did = payload.get("id")
+    user_raw = payload.get(USER_AMOUNT_KEY)
+    return Donation(
+        _checked(raw),
+        payload.get("currency"),
+        str(did) if did is not None else None,
+        payload.get("username"),
+        _checked(user_raw) if user_raw is not None else None,
+    )
+
+
+def _find_payload(obj, depth: int = MAX_DEPTH) -> dict | None:
+    """Найти первый словарь с ключом суммы, не спускаясь глубже depth уровней."""
+    stack = [(obj, 0)]
+    while stack:
+        node, level = stack.pop()
+        if isinstance(node, dict):
+            if any(key in node for key in AMOUNT_KEYS):
+                return node
+            children = node.values()
+        elif isinstance(node, list):
+            children = node
+        else:
+            continue
+        if level < depth:
+            # reversed — чтобы обходить в том же порядке, что и рекурсивный поиск
+            stack.extend((child, level + 1) for child in reversed(list(children)))
+    return None
+
+
+def worth_parsing(message: str) -> bool:
+    """Быстрый отсев сырого сообщения WebSocket до разбора JSON.
+
+    Разбирать стоит публикации с суммой (ключи "amount..."), ответ на подписку
+    с позицией потока ("epoch") и ошибки ("error"). Пинги, служебные ответы и
+    публикации без доната пропускаются: позиция такой публикации не запоминается,
+    и после переподключения она придёт повторно — и снова будет пропущена.
+    """
+    return '"amount' in message or '"epoch"' in message or '"error"' in message
+
+
+def parse_publication(pub) -> Donation | None:
+    """Извлечь донат из публикации Centrifugo (объект с полями data и offset/seq)."""
+    if not isinstance(pub, dict):
+        return None
+    inner = pub.get("data")
+    if isinstance(inner, dict):
+        donation = _from_payload(inner)
+        if donation is not None:
+            return donation
+    payload = _find_payload(pub)
+    return _from_payload(payload) if payload is not None else None
+
+
+def publication_position(pub: dict) -> dict:
+    """Позиция публикации в потоке канала: offset (Centrifugo ≥ 2.5) или seq/gen."""
+    if "offset" in pub:
+        return {"offset": pub["offset"]}
+    if "seq" in pub:
+        return {"seq": pub["seq"], "gen": pub.get("gen", 0)}
+    return {}
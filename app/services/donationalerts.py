@@ -4,50 +4,114 @@
 - обновление access_token по refresh_token;
 - подключение к WebSocket и подписка на канал донатов;
 - извлечение суммы из событий;
-- добавление секунд к таймеру с учётом дробного коэффициента;
-- переподключение при обрывах.
+- добавление секунд к таймеру в целочисленной арифметике с пересчётом валют
+  (всплески донатов — пачками);
+- переподключение при обрывах с восстановлением пропущенных публикаций из истории канала.
 """
 
 import json
 import time
-import math
 import asyncio
 import websockets
-import httpx
-
-from app.core.state import state, broadcast_control, broadcast_timer
-from app.core.db import load_tokens, save_tokens
-from app.services.timer import format_time
-
-
-def extract_amount_anywhere(obj):
-    """Попробовать рекурсивно найти сумму доната в произвольном JSON-объекте."""
-    if isinstance(obj, dict):
-        for key in ("amount", "amount_main"):
-            if key in obj:
-                return obj[key]
-        for v in obj.values():
-            val = extract_amount_anywhere(v)
-            if val is not None:
-                return val
-    elif isinstance(obj, list):
-        for v in obj:
-            val = extract_amount_anywhere(v)
-            if val is not None:
-                return val
-    return None
-
-
-async def ensure_access_token(client_id: str, client_secret: str) -> str:
-    """Вернуть валидный access_token, при необходимости обновить его через refresh_token."""
-    tokens = load_tokens()
+
+from app.core import metrics
+from app.core.config import cfg
+from app.core.state import AppState, broadcast_control, broadcast_timer
+from app.core.db import load_tokens, save_tokens, get_setting, set_setting
+from app.core.money import BASE_CURRENCY, UNITS_PER_SEC, accrue, convert, format_minor
+from app.services.timer import format_time, time_frame, add_seconds, scheduler
+from app.services import http_client
+from app.services.donation_parser import (
+    Donation,
+    decode_message,
+    parse_publication,
+    publication_position,
+    worth_parsing,
+)
+from app.services import ledger
+
+
+def _get_positions(st: AppState) -> dict:
+    """Вернуть позиции каналов таймера, при первом обращении загрузив их из настроек.
+
+    Позиция — последняя известная точка в потоке канала (epoch + offset или seq/gen).
+    При переподписке по ней запрашивается история, пропущенная за время обрыва.
+    """
+    if st.da_positions is None:
+        try:
+            st.da_positions = json.loads(get_setting("da_positions", st.timer_id) or "{}")
+        except ValueError:
+            st.da_positions = {}
+    return st.da_positions
+
+
+def _remember_position(st: AppState, channel: str, fields: dict) -> None:
+    """Обновить позицию канала и сохранить её (сквозь кэш настроек, запись в фоне)."""
+    if not fields:
+        return
+    positions = _get_positions(st)
+    positions.setdefault(channel, {}).update(fields)
+    set_setting("da_positions", json.dumps(positions), st.timer_id)
+
+
+def _subscribe_params(st: AppState, channel: str, sub_token: str) -> dict:
+    """Параметры SUBSCRIBE; при известной позиции — с запросом восстановления истории."""
+    params = {"channel": channel, "token": sub_token}
+    pos = _get_positions(st).get(channel)
+    if pos:
+        params["recover"] = True
+        params.update(pos)
+    return params
+
+
+# За сколько секунд до сохранённого срока токен считается истёкшим
+TOKEN_REFRESH_MARGIN = 10
+
+# Фоновые задачи обновления токенов (ссылки держим, чтобы задачи не собрал GC)
+_refresh_tasks: set = set()
+
+
+def schedule_token_refresh(st: AppState) -> None:
+    """Запланировать обновление access_token таймера на момент, когда он станет истёкшим."""
+    if st.token_job is not None:
+        st.token_job.cancel()
+        st.token_job = None
+    tokens = load_tokens(st.timer_id)
+    exp = tokens["token_expires_at"]
+    if not exp or not tokens["refresh_token"]:
+        return
+    delay = max(exp - TOKEN_REFRESH_MARGIN + 1 - time.time(), 0.0)
+    st.token_job = scheduler.call_later(delay, _refresh_token_due, st)
+
+
+def _refresh_token_due(st: AppState) -> None:
+    """Задача планировщика: обновить токен в фоне, не задерживая тики таймеров."""
+    st.token_job = None
+    task = asyncio.create_task(_refresh_token(st))
+    _refresh_tasks.add(task)
+    task.add_done_callback(_refresh_tasks.discard)
+
+
+async def _refresh_token(st: AppState) -> None:
+    """Обновить токен через refresh_token и запланировать следующее обновление."""
+    try:
+        await ensure_access_token(st)
+    except Exception as e:
+        await broadcast_control(f"DA: не удалось обновить токен: {e}", st)
+        return
+    schedule_token_refresh(st)
+
+
+async def ensure_access_token(st: AppState) -> str:
+    """Вернуть валидный access_token таймера, при необходимости обновить его через refresh_token."""
+    tokens = load_tokens(st.timer_id)
     access = tokens.get("access_token")
     refresh = tokens.get("refresh_token")
     exp = int(tokens.get("token_expires_at") or 0)
     now = int(time.time())
 
     # Токен ещё не истёк
-    if access and now < exp - 10:
+    if access and now < exp - TOKEN_REFRESH_MARGIN:
         return access
 
     if not refresh:
@@ -55,60 +119,57 @@ async def ensure_access_token(client_id: str, client_secret: str) -> str:
 
     # Запрос на обновление токена
     data = {
-        "client_id": client_id,
-        "client_secret": client_secret,
+        "client_id": st.oauth_client_id,
+        "client_secret": st.oauth_client_secret,
         "grant_type": "refresh_token",
         "refresh_token": refresh,
     }
-    async with httpx.AsyncClient() as client:
-        r = await client.post("https://www.donationalerts.com/oauth/token", data=data)
-        if r.status_code != 200:
-            raise RuntimeError(f"Refresh failed: {r.status_code} {r.text}")
-
-        js = r.json()
-        access = js.get("access_token")
-        refresh_new = js.get("refresh_token", refresh)
-        expires_in = js.get("expires_in", 3600)
-
-        save_tokens(access, refresh_new, expires_in)
-        state.oauth_access_token = access
-        await broadcast_control("Access token обновлён через refresh_token.")
-        return access
+    r = await http_client.request("POST", f"{cfg.da_base_url}/oauth/token", data=data)
+    if r.status_code != 200:
+        raise RuntimeError(f"Refresh failed: {r.status_code} {r.text}")
+
+    js = r.json()
+    access = js.get("access_token")
+    refresh_new = js.get("refresh_token", refresh)
+    expires_in = js.get("expires_in", 3600)
+
+    save_tokens(st, access, refresh_new, expires_in)
+    st.oauth_access_token = access
+    await broadcast_control("Access token обновлён через refresh_token.", st)
+    return access
 
 
 async def get_user_and_socket_token(access_token: str):
     """Получить user_id и socket_connection_token через API /api/v1/user/oauth."""
-    url = "https://www.donationalerts.com/api/v1/user/oauth"
+    url = f"{cfg.da_base_url}/api/v1/user/oauth"
     headers = {"Authorization": f"Bearer {access_token}"}
-    async with httpx.AsyncClient() as client:
-        r = await client.get(url, headers=headers)
-        if r.status_code != 200:
-            raise RuntimeError(f"Ошибка user/oauth: {r.status_code} {r.text}")
-        js = r.json()
-        data = js.get("data") or {}
-        return data.get("id"), data.get("socket_connection_token")
+    r = await http_client.request("GET", url, headers=headers)
+    if r.status_code != 200:
+        raise RuntimeError(f"Ошибка user/oauth: {r.status_code} {r.text}")
+    js = r.json()
+    data = js.get("data") or {}
+    return data.get("id"), data.get("socket_connection_token")
 
 
 async def get_channel_sub_token(access_token: str, user_id: int, client_id: str):
     """Получить токен подписки на канал донатов через /api/v1/centrifuge/subscribe."""
-    url = "https://www.donationalerts.com/api/v1/centrifuge/subscribe"
+    url = f"{cfg.da_base_url}/api/v1/centrifuge/subscribe"
     headers = {"Authorization": f"Bearer {access_token}", "Content-Type": "application/json"}
     channel = f"$alerts:donation_{user_id}"
     payload = {"channels": [channel], "client": client_id}
 
-    async with httpx.AsyncClient() as client:
-        r = await client.post(url, headers=headers, json=payload)
-        if r.status_code != 200:
-            raise RuntimeError(f"Ошибка subscribe: {r.status_code} {r.text}")
-        js = r.json()
-        arr = js.get("channels") or []
-        if not arr:
-            raise RuntimeError(f"subscribe: пустой ответ {js}")
-        return arr[0].get("channel"), arr[0].get("token")
+    r = await http_client.request("POST", url, headers=headers, json=payload)
+    if r.status_code != 200:
+        raise RuntimeError(f"Ошибка subscribe: {r.status_code} {r.text}")
+    js = r.json()
+    arr = js.get("channels") or []
+    if not arr:
+        raise RuntimeError(f"subscribe: пустой ответ {js}")
+    return arr[0].get("channel"), arr[0].get("token")
 
 
-async def donation_manager(max_attempts: int = 10):
-    """Менеджер подключения к DonationAlerts (WS).
+async def donation_manager(st: AppState, max_attempts: int = 10):
+    """Менеджер подключения таймера к DonationAlerts (WS).
 
     - автообновление токена;
     - подписка на канал донатов;
@@ -118,29 +179,26 @@ async def donation_manager(max_attempts: int = 10):
     attempt = 0
     backoff = 2
 
-    # На всякий случай — гарантируем наличие fraction_carry
-    if not hasattr(state, "fraction_carry"):
-        state.fraction_carry = 0.0
-
     while True:
         attempt += 1
         if attempt > max_attempts:
-            await broadcast_control("DA: достигнут лимит попыток переподключения. Остановлено.")
+            await broadcast_control("DA: достигнут лимит попыток переподключения. Остановлено.", st)
             return
 
         try:
-            if not state.oauth_client_id or not state.oauth_client_secret:
-                await broadcast_control("DA: client_id/secret не заданы. Останов.")
+            if not st.oauth_client_id or not st.oauth_client_secret:
+                await broadcast_control("DA: client_id/secret не заданы. Останов.", st)
                 return
 
-            access_token = await ensure_access_token(state.oauth_client_id, state.oauth_client_secret)
+            access_token = await ensure_access_token(st)
+            schedule_token_refresh(st)
             user_id, socket_token = await get_user_and_socket_token(access_token)
             if not user_id or not socket_token:
-                await broadcast_control("DA: не удалось получить user_id или socket_token. Останов.")
+                await broadcast_control("DA: не удалось получить user_id или socket_token. Останов.", st)
                 return
 
-            ws_url = "wss://centrifugo.donationalerts.com/connection/websocket"
-            await broadcast_control("DA: подключаемся к WebSocket...")
+            ws_url = cfg.da_ws_url
+            await broadcast_control("DA: подключаемся к WebSocket...", st)
 
             async with websockets.connect(ws_url) as ws:
                 # CONNECT: получаем client_id
@@ -152,57 +210,203 @@ async def donation_manager(max_attempts: int = 10):
                     msg = json.loads(raw)
                     if msg.get("id") == 1 and "result" in msg and "client" in msg["result"]:
                         client_id = msg["result"]["client"]
-                        await broadcast_control(f"DA: client={client_id}")
+                        await broadcast_control(f"DA: client={client_id}", st)
                         break
 
-                # SUBSCRIBE: подписываемся на канал донатов
+                # SUBSCRIBE: подписываемся на канал донатов (с восстановлением истории)
                 channel, sub_token = await get_channel_sub_token(access_token, user_id, client_id)
                 await ws.send(
-                    json.dumps({"params": {"channel": channel, "token": sub_token}, "method": 1, "id": 2})
+                    json.dumps({"params": _subscribe_params(st, channel, sub_token), "method": 1, "id": 2})
                 )
-                await broadcast_control(f"DA: подписались на {channel}. Ждём донаты...")
+                await broadcast_control(f"DA: подписались на {channel}. Ждём донаты...", st)
 
                 attempt = 0
                 backoff = 2
 
                 # Слушаем публикации
                 async for message in ws:
-                    data = json.loads(message)
-                    payload = data.get("result") or {}
-
-                    amount = extract_amount_anywhere(payload)
-                    if amount is None:
+                    received = time.perf_counter()
+                    # Пинги и служебные ответы без данных не разбираем
+                    if not worth_parsing(message):
                         continue
-
                     try:
-                        amount = float(amount)
-                        coef = float(getattr(state, "rub_to_sec", 10.0))
-                        add_seconds_float = amount * coef
-
-                        add_int = math.floor(add_seconds_float)
-                        state.fraction_carry += add_seconds_float - add_int
-
-                        if state.fraction_carry >= 1.0:
-                            extra = math.floor(state.fraction_carry)
-                            add_int += extra
-                            state.fraction_carry -= extra
+                        msg = decode_message(message)
+                    except ValueError as e:
+                        await broadcast_control(f"Ошибка парсинга суммы: {e}", st)
+                        continue
 
-                        state.remaining_seconds += int(add_int)
+                    if msg.get("id") == 2 and msg.get("error"):
+                        # Сервер отверг подписку (например, устаревшую позицию) — подписываемся заново
+                        _get_positions(st).pop(channel, None)
+                        raise ConnectionError(f"subscribe: {msg['error']}")
 
-                        await broadcast_timer(format_time(state.remaining_seconds))
-                        await broadcast_control(
-                            f"Донат {amount:g} → +{add_seconds_float:.2f} сек "
-                            f"(добавлено {int(add_int)} сек), "
-                            f"итого {format_time(state.remaining_seconds)}"
+                    result = msg.get("result")
+                    if not isinstance(result, dict):
+                        continue
+                    if msg.get("id") == 2:
+                        await _handle_subscribe_reply(st, channel, result, received)
+                    elif "data" in result:
+                        await _handle_publication(
+                            st, result.get("channel") or channel, result["data"], received
                         )
-                    except Exception as e:
-                        await broadcast_control(f"Ошибка парсинга суммы: {e}")
 
         except RuntimeError as e:
-            await broadcast_control(f"DA: фатальная ошибка: {e}. Останов.")
+            await broadcast_control(f"DA: фатальная ошибка: {e}. Останов.", st)
             return
         except Exception as e:
-            await broadcast_control(f"DA: обрыв соединения: {e}. Переподключение через {backoff}s...")
+            metrics.DA_RECONNECTS.inc()
+            await broadcast_control(f"DA: обрыв соединения: {e}. Переподключение через {backoff}s...", st)
             await asyncio.sleep(backoff)
             backoff = min(backoff * 2, 60)
             continue
+
+
+async def _handle_subscribe_reply(st: AppState, channel: str, result: dict, received: float) -> None:
+    """Обработать ответ на SUBSCRIBE: применить восстановленные публикации и запомнить позицию."""
+    pubs = result.get("publications") or []
+    if _get_positions(st).get(channel):
+        if result.get("recovered"):
+            await broadcast_control(f"DA: восстановлено пропущенных публикаций: {len(pubs)}", st)
+        else:
+            await broadcast_control("DA: историю канала восстановить не удалось, возможны пропуски", st)
+
+    if "epoch" in result:
+        _remember_position(st, channel, {"epoch": result["epoch"]})
+    for pub in pubs:
+        await _handle_publication(st, channel, pub, received)
+
+    # Верхушка потока на момент подписки
+    _remember_position(st, channel, publication_position(result))
+
+
+async def _handle_publication(st: AppState, channel: str, pub, received: float) -> None:
+    """Единый путь для живых и восстановленных публикаций: позиция, дубли, начисление.
+
+    received — момент получения сообщения (time.perf_counter()) для метрики задержки.
+    """
+    if not isinstance(pub, dict):
+        return
+    _remember_position(st, channel, publication_position(pub))
+
+    try:
+        donation = parse_publication(pub)
+    except (ValueError, TypeError) as e:
+        await broadcast_control(f"Ошибка парсинга суммы: {e}", st)
+        return
+    if donation is None:
+        return
+    if not ledger.is_new(st.timer_id, donation):
+        metrics.DONATION_DUPLICATES.inc()
+        st.pending_duplicates += 1
+    else:
+        st.pending_donations.append((donation, received))
+
+    if st.donation_job is None:
+        # Окно склейки закрыто: применяем сразу, а пришедшее следом копим до конца окна
+        await _apply_pending(st)
+        _open_donation_window(st)
+
+
+def _open_donation_window(st: AppState) -> None:
+    """Открыть окно склейки: донаты до его конца будут применены одной пачкой."""
+    if cfg.donation_batch_window > 0:
+        st.donation_job = scheduler.call_later(cfg.donation_batch_window, _close_donation_window, st)
+
+
+async def _close_donation_window(st: AppState) -> None:
+    """Конец окна: применить накопленное; пока всплеск продолжается, окно не закрывается."""
+    st.donation_job = None
+    if st.pending_donations or st.pending_duplicates:
+        await _apply_pending(st)
+        _open_donation_window(st)
+
+
+def _base_minor(st: AppState, donation: Donation) -> int | None:
+    """Сумма доната в копейках рубля: по курсу таймера, иначе по пересчёту DonationAlerts.
+
+    None — курса для валюты нет и DonationAlerts пересчёт не прислал.
+    """
+    currency = (donation.currency or BASE_CURRENCY).upper()
+    if currency == BASE_CURRENCY:
+        return donation.amount_minor
+    rate = st.currency_rates.get(currency)
+    if rate is not None:
+        return convert(donation.amount_minor, rate)
+    return donation.user_amount_minor
+
+
+def _accrue_batch(st: AppState, batch: list) -> tuple:
+    """Посчитать начисление пачки, не трогая таймер.
+
+    Вернуть (новый остаток, сумма в копейках рубля, целые секунды,
+    строки журнала (донат, секунды, копейки), валюты без курса).
+    """
+    carry = st.carry_units
+    total_minor = 0
+    total_int = 0
+    rows = []
+    no_rate = set()
+    for donation, _ in batch:
+        minor = _base_minor(st, donation)
+        if minor is None:
+            # Как раньше — сумма засчитывается как рубли, но об этом пишем в лог
+            no_rate.add(donation.currency.upper())
+            minor = donation.amount_minor
+
+        add_int, carry = accrue(carry, minor, st.coef_ms)
+        rows.append((donation, add_int, minor))
+        total_minor += minor
+        total_int += add_int
+    return carry, total_minor, total_int, rows, no_rate
+
+
+async def _apply_pending(st: AppState) -> None:
+    """Применить накопленные донаты атомарно: одно изменение таймера, одна рассылка, одна сводка.
+
+    Начисление сначала считается целиком (_accrue_batch); таймер, остаток и журнал
+    меняются только после этого. Если посчитать не удалось, отметки дублей снимаются,
+    чтобы повторная доставка или восстановление истории применили донаты заново.
+    Каждый донат по-прежнему пишется в журнал отдельно.
+    """
+    batch, st.pending_donations = st.pending_donations, []
+    duplicates, st.pending_duplicates = st.pending_duplicates, 0
+    if duplicates:
+        await broadcast_control(f"DA: пропущено повторов донатов: {duplicates}", st)
+    if not batch:
+        return
+
+    coef_ms = st.coef_ms
+    try:
+        carry, total_minor, total_int, rows, no_rate = _accrue_batch(st, batch)
+    except (ArithmeticError, TypeError, ValueError, AttributeError) as e:
+        for donation, _ in batch:
+            ledger.forget(st.timer_id, donation)
+        await broadcast_control(f"Ошибка начисления донатов ({len(batch)}): {e}", st)
+        return
+
+    # Остаток меняется вместе со временем: add_seconds пишет его в то же событие журнала
+    st.carry_units = carry
+    add_seconds(st, total_int)
+    for donation, add_int, minor in rows:
+        ledger.record(st.timer_id, donation, add_int, minor, coef_ms)
+    await broadcast_timer(time_frame(st.remaining_seconds), st)
+
+    now = time.perf_counter()
+    for _, received in batch:
+        metrics.DONATION_LATENCY.observe(now - received)
+    metrics.DONATIONS.inc(len(batch))
+
+    if no_rate:
+        await broadcast_control(
+            f"DA: нет курса для {', '.join(sorted(no_rate))}, сумма засчитана как рубли "
+            f"(задать курс: rate {min(no_rate)} 90.5)",
+            st,
+        )
+    amount = format_minor(total_minor)
+    head = f"Донат {amount}₽" if len(batch) == 1 else f"Донаты x{len(batch)} на {amount}₽"
+    await broadcast_control(
+        f"{head} → +{total_minor * coef_ms / UNITS_PER_SEC:.2f} сек "
+        f"(добавлено {total_int} сек), "
+        f"итого {format_time(st.remaining_seconds)}",
+        st,
+    )
@@ -0,0 +1,100 @@
+"""Общий HTTP-клиент для запросов к REST API DonationAlerts.
+
+Один httpx.AsyncClient на всё время работы приложения: соединения переиспользуются
+(keep-alive), поэтому переподключение к DonationAlerts не платит за новый TCP+TLS
+на каждый запрос. Сетевые сбои повторяются с экспоненциальной задержкой и джиттером.
+
+httpx импортируется при создании клиента, а не при импорте модуля: он нужен только
+слушателю DonationAlerts и OAuth, и не должен задерживать старт оверлея.
+"""
+
+import os
+import asyncio
+import random
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    import httpx
+
+# Таймауты запросов: на установку соединения и на весь обмен, секунд
+TIMEOUT = 10.0
+CONNECT_TIMEOUT = 5.0
+# Пул соединений: всего, keep-alive и время жизни простаивающего соединения
+MAX_CONNECTIONS = 10
+MAX_KEEPALIVE = 5
+KEEPALIVE_EXPIRY = 120.0
+
+# Повторы при сетевых сбоях и ответах 429/5xx
+MAX_RETRIES = 3
+RETRY_BASE_DELAY = 0.5
+RETRY_MAX_DELAY = 5.0
+
+_client: "httpx.AsyncClient | None" = None
+
+
+def get_client() -> "httpx.AsyncClient":
+    """Вернуть общий клиент, создав его (и импортировав httpx) при первом обращении."""
+    global _client
+    if _client is None or _client.is_closed:
+        import httpx
+
+        # Сертификаты из certifi — в собранном exe системного хранилища может не быть
+        try:
+            import certifi
+
+            os.environ.setdefault("SSL_CERT_FILE", certifi.where())
+        except Exception:
+            pass
+
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=MAX_CONNECTIONS,
+                max_keepalive_connections=MAX_KEEPALIVE,
+                keepalive_expiry=KEEPALIVE_EXPIRY,
+            ),
+        )
+    return _client
+
+
+async def close_client() -> None:
+    """Закрыть общий клиент и его пул соединений (при остановке приложения)."""
+    global _client
+    if _client is not None:
+        await _client.aclose()
+        _client = None
+
+
+def _retry_delay(attempt: int) -> float:
+    """Задержка перед повтором: экспонента с полным джиттером."""
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2**attempt))
+
+
+async def request(method: str, url: str, **kwargs) -> "httpx.Response":
+    """Выполнить запрос через общий клиент с повторами.
+
+    GET повторяется при любой сетевой ошибке и ответах 429/5xx. Остальные методы
+    повторяются только если соединение не удалось установить: запрос гарантированно
+    не дошёл до сервера (важно для одноразовых refresh_token).
+    """
+    import httpx
+
+    idempotent = method.upper() == "GET"
+    attempt = 0
+    while True:
+        try:
+            r = await get_client().request(method, url, **kwargs)
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            if attempt >= MAX_RETRIES:
+                raise
+        except httpx.TransportError:
+            if not idempotent or attempt >= MAX_RETRIES:
+                raise
+        else:
+            if not (idempotent and (r.status_code == 429 or r.status_code >= 500)):
+                return r
+            if attempt >= MAX_RETRIES:
+                return r
+
+        await asyncio.sleep(_retry_delay(attempt))
+        attempt += 1
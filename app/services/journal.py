@@ -0,0 +1,95 @@
+"""Журнал событий таймеров: снимок состояния + хвост событий после него.
+
+Каждое изменение состояния таймера (установка, сброс, старт, стоп, добавление
+времени за донаты, смена коэффициента) дописывается в таблицу journal с
+порядковым номером. Записи уходят через фоновый писатель: события пачки
+фиксируются одной транзакцией, то есть одним fsync на пачку, а не на событие.
+
+Снимок — строки runtime_state вместе с номером последнего учтённого события
+(journal_seq); при записи снимка события до этого номера удаляются. При старте
+состояние восстанавливается как «снимок + по порядку все события после него»:
+события несут абсолютные значения (дедлайн по системным часам, остаток),
+поэтому повтор детерминирован.
+"""
+
+import json
+import time
+
+from app.core.db import load_journal, load_runtime_state
+from app.core.money import carry_from_legacy
+from app.core.state import AppState
+from app.core.writer import writer
+
+
+def append(st: AppState, kind: str, **data) -> None:
+    """Дописать событие таймера в журнал (в фоне, пачкой с остальными записями)."""
+    st.journal_seq += 1
+    writer.submit_journal(
+        (st.timer_id, st.journal_seq, time.time(), kind, json.dumps(data, separators=(",", ":")))
+    )
+
+
+def _from_snapshot(snapshot: dict) -> dict:
+    """Модель состояния из строк runtime_state."""
+    if "carry_units" in snapshot:
+        carry = int(snapshot["carry_units"])
+    else:
+        # Снимок старой версии: остаток сохранён дробью секунды
+        carry = carry_from_legacy(snapshot.get("fraction_carry") or "0")
+    is_running = snapshot.get("is_running", "0") == "1"
+    deadline_at = float(snapshot.get("deadline_at") or "0") or None
+    remaining = int(snapshot.get("remaining_seconds", "60"))
+    if is_running and deadline_at is None:
+        # Ещё более старый формат: дедлайна нет, только момент последнего сохранения
+        last_upd = int(snapshot.get("last_update_at", "0"))
+        if last_upd:
+            deadline_at = last_upd + remaining
+    return {
+        "seq": int(snapshot.get("journal_seq", "0")),
+        "remaining": remaining,
+        "is_running": is_running,
+        "deadline_at": deadline_at,
+        "carry": carry,
+        "coef_ms": None,
+    }
+
+
+def _apply(model: dict, kind: str, data: dict) -> None:
+    """Применить одно событие журнала к модели состояния."""
+    if kind == "start":
+        model["is_running"] = True
+        model["deadline_at"] = data["deadline_at"]
+    elif kind == "stop":
+        model["is_running"] = False
+        model["deadline_at"] = None
+        model["remaining"] = data["remaining"]
+    elif kind in ("set", "reset"):
+        model["remaining"] = data["remaining"]
+        if model["is_running"]:
+            model["deadline_at"] = data["deadline_at"]
+    elif kind == "add":
+        if model["is_running"] and model["deadline_at"] is not None:
+            model["deadline_at"] += data["seconds"]
+        else:
+            model["remaining"] += data["seconds"]
+        model["carry"] = data["carry"]
+    elif kind == "coef":
+        model["coef_ms"] = data["coef_ms"]
+
+
+def replay(timer_id: str) -> dict | None:
+    """Восстановить состояние таймера: снимок и события после него. None — таймер ничего не сохранял.
+
+    Результат: seq, remaining, is_running, deadline_at (системное время), carry, coef_ms
+    (None, если коэффициент после снимка не менялся) и replayed — число повторённых событий.
+    """
+    snapshot = load_runtime_state(timer_id)
+    model = _from_snapshot(snapshot)
+    events = load_journal(timer_id, model["seq"])
+    if not snapshot and not events:
+        return None
+    for seq, kind, data in events:
+        _apply(model, kind, json.loads(data))
+        model["seq"] = seq
+    model["replayed"] = len(events)
+    return model
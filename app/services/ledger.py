@@ -0,0 +1,90 @@
+"""Журнал донатов: подавление дублей и запись каждого доната для аудита.
+
+Проверка «этот донат уже был?» идёт по ограниченному LRU недавних id в памяти,
+без обращения к диску; сами записи уходят в таблицу donations через фоновый
+писатель пачками, а INSERT OR IGNORE страхует от дублей, выпавших из LRU.
+"""
+
+import time
+import uuid
+from collections import OrderedDict
+
+from app.core.db import recent_donation_ids
+from app.core.writer import writer
+from app.services.donation_parser import Donation
+
+# Сколько последних id держать в памяти для поиска дублей
+SEEN_CAPACITY = 4096
+
+
+class SeenIds:
+    """Ограниченное множество недавно обработанных ключей (timer_id, id) с вытеснением самых старых."""
+
+    def __init__(self, capacity: int = SEEN_CAPACITY) -> None:
+        self.capacity = capacity
+        self._ids: OrderedDict = OrderedDict()
+
+    def add(self, donation_id) -> bool:
+        """Запомнить ключ. Вернуть False, если он уже встречался (дубль)."""
+        if donation_id in self._ids:
+            self._ids.move_to_end(donation_id)
+            return False
+        self._ids[donation_id] = None
+        if len(self._ids) > self.capacity:
+            self._ids.popitem(last=False)
+        return True
+
+    def discard(self, donation_id) -> None:
+        """Забыть ключ: донат с ним снова будет считаться новым."""
+        self._ids.pop(donation_id, None)
+
+    def __contains__(self, donation_id) -> bool:
+        return donation_id in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+
+seen = SeenIds()
+
+
+def load_recent() -> None:
+    """Прогреть LRU id последних донатов из БД (при старте приложения)."""
+    for key in recent_donation_ids(SEEN_CAPACITY):
+        seen.add(key)
+
+
+def is_new(timer_id: str, donation: Donation) -> bool:
+    """Проверить донат таймера на дубль и запомнить его id. Донаты без id всегда новые."""
+    if donation.donation_id is None:
+        return True
+    return seen.add((timer_id, donation.donation_id))
+
+
+def forget(timer_id: str, donation: Donation) -> None:
+    """Снять отметку is_new: донат не применён и при повторной доставке должен пройти."""
+    if donation.donation_id is not None:
+        seen.discard((timer_id, donation.donation_id))
+
+
+def record(
+    timer_id: str, donation: Donation, added_seconds: int, amount_minor: int, coef_ms: int
+) -> None:
+    """Записать донат таймера в журнал (в фоне, пачками вместе с остальными записями).
+
+    amount_minor — начисленная сумма в копейках рубля, coef_ms — коэффициент начисления.
+    """
+    did = donation.donation_id or f"local-{uuid.uuid4().hex}"
+    writer.submit_donation(
+        (
+            timer_id,
+            did,
+            float(donation.amount),
+            donation.currency,
+            donation.username,
+            int(added_seconds),
+            int(time.time()),
+            amount_minor,
+            coef_ms,
+        )
+    )
@@ -0,0 +1,40 @@
+"""Проверка живости клиентов: одна задача планировщика на все соединения процесса.
+
+Упавший OBS или уснувший ноутбук оставляют полуоткрытое соединение: сервер узнаёт
+о нём, только когда переполнится буфер отправки. Поэтому раз в cfg.ping_interval
+секунд задача обходит клиентов, которые умеют отвечать на пинг (канал оверлея
+wsp-overlay.1 и панель с подпротоколом wsp-control.1), отключает тех, от кого ничего
+не приходило дольше cfg.ping_timeout, а остальным ставит в очередь кадр PING
+(app.core.protocol). Отдельной задачи на каждый сокет нет. Клиентов без подпротокола
+(строки времени, текстовые команды /control, /timer_cfg) не пингуем: ответить они
+не могут, зависших среди них отключает таймаут отправки.
+"""
+
+import time
+
+from app.core import metrics, protocol
+from app.core.clients import Frame
+from app.core.config import cfg
+from app.core.state import timers
+from app.services.timer import scheduler
+
+# Готовый кадр пинга: один объект для всех клиентов
+PING = Frame(protocol.PING_FRAME, protocol.PING_TOPIC)
+
+REAPED = metrics.counter("wsp_reaped_clients_total", "Клиенты, отключённые за молчание дольше PING_TIMEOUT.")
+
+
+def _reap() -> None:
+    """Отключить молчащих клиентов, остальным отправить пинг и запланировать следующий обход."""
+    cutoff = time.monotonic() - cfg.ping_timeout
+    for st in list(timers.values()):
+        for clients in (st.overlay_clients, st.control_json_clients):
+            if len(clients):
+                REAPED.inc(clients.reap(cutoff, PING))
+    scheduler.call_later(cfg.ping_interval, _reap)
+
+
+def start() -> None:
+    """Запланировать первый обход (если проверка живости включена)."""
+    if cfg.ping_interval > 0 and cfg.ping_timeout > 0:
+        scheduler.call_later(cfg.ping_interval, _reap)
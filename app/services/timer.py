@@ -1,11 +1,229 @@
-"""Логика таймера: форматирование времени и фоновый цикл уменьшения секунд."""
+"""Логика таймеров: форматирование времени и общий планировщик на иерархическом колесе.
+
+Пока таймер запущен, оставшееся время не хранится, а вычисляется от дедлайна
+по монотонным часам: remaining = deadline − now. Поэтому задержки внутри цикла
+(рассылка, запись в БД) не накапливаются в дрейф — пропущенные тики просто догоняются.
+
+Все отложенные действия процесса — тики таймеров, периодическое сохранение,
+обновление OAuth-токенов — это задачи одного планировщика (``scheduler``).
+Задачи лежат в иерархическом колесе с шагом 1 мс: постановка и отмена — O(1),
+а цикл спит ровно до ближайшей задачи; если задач нет, он спит до первой новой.
+"""
 
 import asyncio
+import functools
+import hashlib
+import json
+import math
 import time
-from datetime import timedelta
+import traceback
+
+from app.core import metrics, protocol
+from app.core.bus import bus, DELTA
+from app.core.clients import Frame
+from app.core.state import AppState, timers, broadcast_timer
+from app.core.db import runtime_rows, refresh_settings_if_changed
+from app.core.writer import writer
+from app.services import journal
+
+# Период сохранения изменённых состояний в БД, секунд
+SAVE_INTERVAL = 5.0
+
+# Уровни колеса: число бит индекса слота и сдвиг (в мс) каждого уровня.
+# Уровень 0 — 256 слотов по 1 мс, дальше по 64 слота: ~16 с, ~17 мин, ~18.6 ч.
+WHEEL_BITS = (8, 6, 6, 6)
+WHEEL_SHIFTS = (0, 8, 14, 20)
+# Всё, что дальше верхнего уровня, лежит в списке переполнения
+WHEEL_SPAN_BITS = WHEEL_SHIFTS[-1] + WHEEL_BITS[-1]
+
+# Раз во сколько секунд отсчёта слать клиентам бинарного протокола полное состояние,
+# чтобы расхождение их часов с серверными не накапливалось
+RESYNC_EVERY = 60
+
+
+def _ms(when: float) -> int:
+    """Момент по time.monotonic() → миллисекунда колеса (не раньше самого момента)."""
+    return math.ceil(when * 1000)
+
+
+class Job:
+    """Отложенный вызов callback(*args) в момент when (по time.monotonic())."""
+
+    __slots__ = ("when", "due", "callback", "args", "slot")
+
+    def __init__(self, when: float, callback, args: tuple) -> None:
+        self.when = when
+        self.due = _ms(when)
+        self.callback = callback
+        self.args = args
+        # Слот колеса (dict), в котором сейчас лежит задача; None — выполнена или отменена
+        self.slot: dict | None = None
+
+    def cancel(self) -> None:
+        """Отменить задачу, если она ещё не выполнена."""
+        if self.slot is not None:
+            del self.slot[self]
+            self.slot = None
+
+
+class Scheduler:
+    """Иерархическое колесо таймеров с одним циклом выполнения.
+
+    Задача попадает на самый нижний уровень, на котором её срок отличается от
+    текущего времени колеса только битами этого уровня. Когда уровень 0 проходит
+    полный круг, следующий слот уровня 1 «осыпается» вниз, и так далее по уровням.
+    Пустые участки колеса пропускаются целиком, без перебора миллисекунд.
+    """
+
+    def __init__(self) -> None:
+        self.levels = [[{} for _ in range(1 << bits)] for bits in WHEEL_BITS]
+        self.overflow: dict = {}
+        # Просроченные на момент постановки задачи: выполняются при ближайшем проходе
+        self.ready: dict = {}
+        # Текущее время колеса, мс: всё, что не позже, уже выполнено
+        self.now = _ms(time.monotonic())
+        self._wakeup = asyncio.Event()
+        # Миллисекунда, до которой спит цикл (None — спит без срока)
+        self._sleep_until: int | None = None
+
+    # ---- постановка задач ----
+
+    def call_at(self, when: float, callback, *args) -> Job:
+        """Запланировать callback(*args) на момент when (по time.monotonic())."""
+        job = Job(when, callback, args)
+        self._place(job)
+        if self._sleep_until is None or job.due < self._sleep_until:
+            self._wakeup.set()
+        return job
+
+    def call_later(self, delay: float, callback, *args) -> Job:
+        """Запланировать callback(*args) через delay секунд."""
+        return self.call_at(time.monotonic() + delay, callback, *args)
 
-from app.core.state import state, broadcast_timer
-from app.core.db import save_runtime_state
+    def _place(self, job: Job) -> None:
+        """Положить задачу в слот по её сроку относительно текущего времени колеса."""
+        due = job.due
+        if due <= self.now:
+            slot = self.ready
+        else:
+            for level, (bits, shift) in enumerate(zip(WHEEL_BITS, WHEEL_SHIFTS)):
+                if due >> (shift + bits) == self.now >> (shift + bits):
+                    slot = self.levels[level][(due >> shift) & ((1 << bits) - 1)]
+                    break
+            else:
+                slot = self.overflow
+        slot[job] = None
+        job.slot = slot
+
+    # ---- продвижение колеса ----
+
+    def _take(self, slot: dict, out: list) -> None:
+        for job in slot:
+            job.slot = None
+            out.append(job)
+        slot.clear()
+
+    def _cascade(self) -> None:
+        """На границе окна уровня 0 опустить задачи следующего окна с верхних уровней."""
+        now = self.now
+        moved: list = []
+        if now & ((1 << WHEEL_SPAN_BITS) - 1) == 0:
+            self._take(self.overflow, moved)
+        for level in range(len(WHEEL_BITS) - 1, 0, -1):
+            shift = WHEEL_SHIFTS[level]
+            if now & ((1 << shift) - 1) == 0:
+                mask = (1 << WHEEL_BITS[level]) - 1
+                self._take(self.levels[level][(now >> shift) & mask], moved)
+        for job in moved:
+            self._place(job)
+
+    def _empty_below(self) -> int:
+        """Число нижних уровней подряд без задач (0 — на уровне 0 что-то есть)."""
+        n = 0
+        for slots in self.levels:
+            if any(slots):
+                break
+            n += 1
+        return n
+
+    def advance(self, target: int) -> list:
+        """Продвинуть колесо до миллисекунды target и вернуть задачи, чей срок наступил."""
+        fired: list = []
+        self._take(self.ready, fired)
+        level0 = self.levels[0]
+        mask0 = (1 << WHEEL_BITS[0]) - 1
+        while self.now < target:
+            empty = self._empty_below()
+            if empty:
+                # Ниже уровня `empty` задач нет — прыгаем сразу к его ближайшей границе,
+                # где что-то может осыпаться (или до target)
+                shift = WHEEL_SHIFTS[empty] if empty < len(WHEEL_SHIFTS) else WHEEL_SPAN_BITS
+                boundary = ((self.now >> shift) + 1) << shift
+            else:
+                boundary = (self.now | mask0) + 1
+                stop = min(target, boundary - 1)
+                for ms in range(self.now + 1, stop + 1):
+                    slot = level0[ms & mask0]
+                    if slot:
+                        self._take(slot, fired)
+            if target < boundary:
+                self.now = target
+                break
+            self.now = boundary
+            self._cascade()
+            self._take(level0[boundary & mask0], fired)
+            # Осыпавшиеся задачи со сроком ровно на границе попадают в ready
+            self._take(self.ready, fired)
+        return fired
+
+    def next_due(self) -> int | None:
+        """Миллисекунда ближайшей задачи или None, если задач нет."""
+        if self.ready:
+            return self.now
+        now = self.now
+        for level, (bits, shift) in enumerate(zip(WHEEL_BITS, WHEEL_SHIFTS)):
+            slots = self.levels[level]
+            size = 1 << bits
+            cursor = (now >> shift) & (size - 1)
+            # На уровне 0 слот текущей мс уже выполнен; на верхних слот курсора всегда пуст
+            for i in range(cursor + 1, size):
+                if slots[i]:
+                    return min(job.due for job in slots[i])
+        if self.overflow:
+            return min(job.due for job in self.overflow)
+        return None
+
+    # ---- цикл ----
+
+    async def run(self) -> None:
+        """Выполнять задачи по мере наступления сроков; без задач — спать до первой новой."""
+        while True:
+            now = time.monotonic()
+            for job in self.advance(math.floor(now * 1000)):
+                try:
+                    result = job.callback(*job.args)
+                    if asyncio.iscoroutine(result):
+                        await result
+                except Exception:
+                    # Ошибка одной задачи не должна останавливать тики остальных таймеров
+                    traceback.print_exc()
+
+            due = self.next_due()
+            self._sleep_until = due
+            # Задачи, поставленные выше (в том числе самими задачами), уже учтены в due
+            self._wakeup.clear()
+            if due is None:
+                await self._wakeup.wait()
+            elif due > self.now:
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), due / 1000 - time.monotonic())
+                except asyncio.TimeoutError:
+                    pass
+            self._sleep_until = None
+
+
+# Единый планировщик процесса
+scheduler = Scheduler()
 
 
 def format_time(sec: int) -> str:
@@ -17,24 +235,240 @@ def format_time(sec: int) -> str:
     return f"{days:02}:{hours:02}:{minutes:02}:{seconds:02}"
 
 
-async def timer_loop():
-    """Фоновый цикл: каждую секунду уменьшает оставшееся время и сохраняет состояние."""
-    while True:
-        await asyncio.sleep(1)
+def parse_time(text: str) -> int:
+    """Обратное к format_time: строка DD:HH:MM:SS → секунды."""
+    days, hours, minutes, seconds = map(int, text.split(":"))
+    return ((days * 24 + hours) * 60 + minutes) * 60 + seconds
+
+
+@functools.lru_cache(maxsize=4096)
+def time_frame(sec: int) -> Frame:
+    """Готовый кадр оверлея со временем sec: один на значение для всех таймеров и клиентов."""
+    return Frame(format_time(sec))
+
+
+def _time_left(st: AppState) -> float:
+    """Точное оставшееся время в секундах (с дробной частью)."""
+    if st.is_running and st.deadline is not None:
+        return max(st.deadline - time.monotonic(), 0.0)
+    return float(st.remaining_seconds)
+
+
+def current_remaining(st: AppState) -> int:
+    """Оставшееся время в целых секундах — то, что показывает таймер."""
+    return math.ceil(_time_left(st))
+
+
+def deadline_wallclock(st: AppState) -> float | None:
+    """Дедлайн запущенного таймера в системном времени (для сохранения между запусками)."""
+    if not st.is_running or st.deadline is None:
+        return None
+    return time.time() + (st.deadline - time.monotonic())
+
+
+def delta_frame(st: AppState, kind: int = protocol.SNAPSHOT, delta_ms: int = 0) -> bytes:
+    """Кадр бинарного протокола с текущим состоянием таймера."""
+    return protocol.encode_frame(kind, st.is_running, round(_time_left(st) * 1000), delta_ms)
+
+
+def broadcast_delta(st: AppState, data: bytes) -> None:
+    """Разослать кадр времени оверлеям wsp-delta.1 и wsp-overlay.1 — один Frame на оба набора."""
+    frame = Frame(data, protocol.TIME_TOPIC)
+    if len(st.delta_clients):
+        st.delta_clients.broadcast(frame)
+    if len(st.overlay_clients):
+        st.overlay_clients.broadcast(frame)
+
+
+class Snapshot:
+    """Снимок таймера для /api/timer и SSE: тело JSON, его ETag и готовое событие потока."""
+
+    __slots__ = ("key", "body", "etag", "event")
+
+    def __init__(self, key: tuple, body: bytes) -> None:
+        self.key = key
+        self.body = body
+        self.etag = '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+        self.event = Frame.chunk(b"data: " + body + b"\n\n")
+
+
+def timer_snapshot(st: AppState) -> Snapshot:
+    """Снимок таймера: собирается заново, только если с прошлого раза что-то изменилось.
+
+    deadline — системное время окончания (null у остановленного таймера): клиент может
+    считать остаток сам, не опрашивая сервер каждую секунду.
+    """
+    remaining = current_remaining(st)
+    key = (st.is_running, st.deadline, remaining, st.timer_text_color)
+    snap = st.snapshot
+    if snap is None or snap.key != key:
+        deadline = deadline_wallclock(st)
+        body = {
+            "timer": st.timer_id,
+            "running": st.is_running,
+            "remaining": remaining,
+            "deadline": round(deadline, 3) if deadline is not None else None,
+            "color": st.timer_text_color,
+        }
+        snap = st.snapshot = Snapshot(key, json.dumps(body, separators=(",", ":")).encode())
+    return snap
+
+
+def publish_snapshot(st: AppState) -> None:
+    """Разослать снимок подписчикам SSE (если они есть): один буфер на всех."""
+    if len(st.sse_clients):
+        st.sse_clients.broadcast(timer_snapshot(st).event)
+
+
+def publish_event(st: AppState, kind: int, delta_ms: int = 0) -> None:
+    """Разослать событие клиентам бинарного протокола, SSE и ведомым воркерам (если они есть)."""
+    publish_snapshot(st)
+    if len(st.delta_clients) or len(st.overlay_clients) or bus.peers:
+        data = delta_frame(st, kind, delta_ms)
+        broadcast_delta(st, data)
+        bus.publish(DELTA, st.timer_id, data)
+
+
+def save_state(st: AppState) -> None:
+    """Отдать снимок состояния таймера фоновому писателю БД (события журнала до него удаляются)."""
+    st.dirty = False
+    writer.submit_runtime(
+        st.timer_id,
+        runtime_rows(
+            current_remaining(st), st.is_running, st.carry_units, deadline_wallclock(st), st.journal_seq
+        ),
+    )
+
+
+# ----------------- Периодические снимки -----------------
+
+# Каждое изменение сразу попадает в журнал событий, а снимки раз в SAVE_INTERVAL
+# лишь укорачивают его. Задача запланирована, только пока есть что сохранять или таймеры идут
+_persist_job: Job | None = None
+
+
+def _mark_dirty(st: AppState) -> None:
+    """Отметить, что состояние таймера нужно сохранить, и завести задачу сохранения."""
+    global _persist_job
+    st.dirty = True
+    if _persist_job is None:
+        _persist_job = scheduler.call_later(SAVE_INTERVAL, _persist)
+
+
+def save_dirty() -> None:
+    """Сохранить состояния всех таймеров, изменившихся с прошлого сохранения."""
+    for st in list(timers.values()):
+        if st.dirty:
+            save_state(st)
+
+
+def _persist() -> None:
+    """Плановое сохранение: изменённые таймеры на диск, свежие настройки — из БД."""
+    global _persist_job
+    save_dirty()
+    # Заодно подхватываем настройки, если файл БД правили извне
+    refresh_settings_if_changed()
+    if any(st.is_running for st in timers.values()):
+        _persist_job = scheduler.call_later(SAVE_INTERVAL, _persist)
+    else:
+        _persist_job = None
+
+
+# ----------------- Управление таймером -----------------
+
+def _reschedule(st: AppState) -> None:
+    """Отменить запланированный тик таймера и, если он идёт, проверить его сразу."""
+    if st.tick_job is not None:
+        st.tick_job.cancel()
+        st.tick_job = None
+    if st.is_running:
+        st.tick_job = scheduler.call_at(time.monotonic(), _tick, st, False)
+    _mark_dirty(st)
+
+
+def start_timer(st: AppState, left: float | None = None, publish: bool = True) -> None:
+    """Запустить отсчёт; left — точный остаток в секундах (по умолчанию текущий).
+
+    publish=False — не рассылать событие: его разошлёт вызывающий (пачка команд панели).
+    """
+    if left is None:
+        left = _time_left(st)
+    if left <= 0:
+        return
+    st.deadline = time.monotonic() + left
+    st.is_running = True
+    journal.append(st, "start", deadline_at=deadline_wallclock(st))
+    _reschedule(st)
+    if publish:
+        publish_event(st, protocol.START)
+
+
+def stop_timer(st: AppState, publish: bool = True) -> None:
+    """Остановить отсчёт, зафиксировав показываемое значение (publish — как у start_timer)."""
+    st.remaining_seconds = current_remaining(st)
+    st.is_running = False
+    st.deadline = None
+    journal.append(st, "stop", remaining=st.remaining_seconds)
+    _reschedule(st)
+    if publish:
+        publish_event(st, protocol.STOP)
+
+
+def set_remaining(st: AppState, sec: int, event: str = "set", publish: bool = True) -> None:
+    """Установить оставшееся время; запущенный таймер продолжает идти от нового значения.
+
+    event — имя события в журнале ("set" или "reset"); publish — как у start_timer.
+    """
+    st.remaining_seconds = sec
+    if st.is_running:
+        st.deadline = time.monotonic() + sec
+    journal.append(st, event, remaining=sec, deadline_at=deadline_wallclock(st))
+    _reschedule(st)
+    if publish:
+        publish_event(st, protocol.SNAPSHOT)
+
+
+def add_seconds(st: AppState, sec: int) -> None:
+    """Добавить время к таймеру, не сбивая фазу текущей секунды."""
+    if st.is_running and st.deadline is not None:
+        # Сдвиг на целые секунды не меняет моменты границ — расписание остаётся верным
+        st.deadline += sec
+        st.remaining_seconds = current_remaining(st)
+    else:
+        st.remaining_seconds += sec
+    # Остаток начислений меньше секунды меняется вместе со временем — пишем его в то же событие
+    journal.append(st, "add", seconds=sec, carry=st.carry_units)
+    _mark_dirty(st)
+    publish_event(st, protocol.ADD, sec * 1000)
+
+
+async def _tick(st: AppState, boundary: bool = True) -> None:
+    """Разослать время таймера, если сменилась секунда, и запланировать следующую границу."""
+    st.tick_job = None
+    if not st.is_running or st.deadline is None:
+        return
+    now = time.monotonic()
+    left = max(st.deadline - now, 0.0)
+    rem = math.ceil(left)
 
-        if state.is_running and state.remaining_seconds > 0:
-            state.remaining_seconds -= 1
-            await broadcast_timer(format_time(state.remaining_seconds))
+    if boundary:
+        metrics.TICK_LATENESS.observe(max(now - (st.deadline - rem), 0.0))
 
-        # сохраняем каждые 5 секунд
-        if int(time.time()) % 5 == 0:
-            save_runtime_state(state.remaining_seconds, state.is_running, state.fraction_carry)
+    # Если цикл опоздал на несколько секунд, сразу показываем актуальное значение
+    if rem != st.remaining_seconds:
+        st.remaining_seconds = rem
+        await broadcast_timer(time_frame(rem), st)
+        if rem % RESYNC_EVERY == 0 and rem:
+            publish_event(st, protocol.SNAPSHOT)
 
-        if state.remaining_seconds == 0 and state.is_running:
-            state.is_running = False
-            save_runtime_state(state.remaining_seconds, state.is_running, state.fraction_carry)
+    if rem == 0:
+        stop_timer(st)
+        save_state(st)
+    else:
+        # Следующая граница секунды: момент, когда ceil(left) уменьшится на 1
+        st.tick_job = scheduler.call_at(st.deadline - (rem - 1), _tick, st)
 
 
 def start_timer_task():
-    """Запустить фоновую задачу таймера (одну на всё приложение)."""
-    asyncio.create_task(timer_loop())
+    """Запустить цикл планировщика (один на все таймеры и фоновые задачи)."""
+    asyncio.create_task(scheduler.run())
@@ -14,14 +14,34 @@ document.addEventListener("DOMContentLoaded", () => {
   const btnStop = document.getElementById("btn-stop");
   const btnReset = document.getElementById("btn-reset");
   const btnSaveCoef = document.getElementById("btn-save-coef");
+  const rateInput = document.getElementById("rate");
+  const btnSaveRate = document.getElementById("btn-save-rate");
   const btnSaveToken = document.getElementById("btn-save-token");
   const btnColorBlack = document.getElementById("btn-color-black");
   const btnColorWhite = document.getElementById("btn-color-white");
   const btnLogout = document.getElementById("btn-logout");
+  const btnTotals = document.getElementById("btn-totals");
 
   const logEl = document.getElementById("log");
 
-  const ws = new WebSocket(`ws://${window.location.host}/control`);
+  // Подпротокол wsp-control.1: лог и ответы на команды приходят JSON-объектами
+  const ws = new WebSocket(
+    `ws://${window.location.host}/control${window.TIMER_SUFFIX || ""}`,
+    ["wsp-control.1"]
+  );
+
+  ws.binaryType = "arraybuffer";
+
+  // Номер следующего запроса: ответ сервера несёт тот же id
+  let nextId = 1;
+
+  // Отправить команду (или пачку: send([["set", {...}], ["start"]]))
+  function send(cmd, args = {}) {
+    const request = Array.isArray(cmd)
+      ? { id: nextId++, batch: cmd.map(([c, a]) => ({ cmd: c, args: a || {} })) }
+      : { id: nextId++, cmd, args };
+    ws.send(JSON.stringify(request));
+  }
 
   ws.onopen = () => {
     addLog("Соединение установлено", "info");
@@ -29,22 +49,33 @@ document.addEventListener("DOMContentLoaded", () => {
   };
 
   ws.onmessage = (e) => {
-    const msg = e.data;
-    if (statusEl) statusEl.textContent = msg;
-
+    if (e.data instanceof ArrayBuffer) {
+      // Пинг сервера (<версия> <тип PING=6>): отвечаем PONG, иначе панель сочтут отключившейся
+      if (new Uint8Array(e.data)[1] === 6) ws.send(new Uint8Array([1, 7]));
+      return;
+    }
+    const msg = JSON.parse(e.data);
+    let text = "";
     let type = "info";
-    if (msg.toLowerCase().includes("ошибка") || msg.toLowerCase().includes("неизвестная")) {
-      type = "error";
-    } else if (
-      msg.toLowerCase().includes("установлено") ||
-      msg.toLowerCase().includes("изменено") ||
-      msg.toLowerCase().includes("запущен") ||
-      msg.toLowerCase().includes("сохранён") ||
-      msg.toLowerCase().includes("очищен")
-    ) {
-      type = "success";
+    if (msg.type === "log") {
+      text = msg.msg;
+      if (msg.level === "error") type = "error";
+    } else if (msg.type === "reply") {
+      if (msg.ok) {
+        const results = msg.results || [msg.result];
+        text = results.map((r) => r.message).join("; ");
+        type = "success";
+      } else {
+        text = msg.error.message;
+        type = "error";
+      }
+    } else if (msg.type === "hello") {
+      text = "Connected to control panel";
+    } else {
+      return;
     }
-    addLog(msg, type);
+    if (statusEl) statusEl.textContent = text;
+    addLog(text, type);
   };
 
   ws.onclose = () => {
@@ -68,20 +99,20 @@ document.addEventListener("DOMContentLoaded", () => {
   btnSet.addEventListener("click", () => {
     const val = timeInput.value.trim();
     if (val && confirm(`Установить время ${val}?`)) {
-      ws.send(`set ${val}`);
+      send("set", { time: val });
     }
   });
 
   // Старт — сразу
-  btnStart.addEventListener("click", () => ws.send("start"));
+  btnStart.addEventListener("click", () => send("start"));
 
   // Stop — сразу
-  btnStop.addEventListener("click", () => ws.send("stop"));
+  btnStop.addEventListener("click", () => send("stop"));
 
   // Reset (с подтверждением)
   btnReset.addEventListener("click", () => {
     if (confirm("Сбросить таймер?")) {
-      ws.send("reset");
+      send("reset");
     }
   });
 
@@ -89,26 +120,40 @@ document.addEventListener("DOMContentLoaded", () => {
   btnSaveCoef.addEventListener("click", () => {
     const val = coefInput.value.trim();
     if (val) {
-      ws.send(`coef ${val}`);
+      send("coef", { value: val });
     }
   });
 
+  // Курс валюты: "USD 92.5" или "USD off"
+  if (btnSaveRate) {
+    btnSaveRate.addEventListener("click", () => {
+      const val = rateInput.value.trim();
+      const [currency, rate] = val.split(/\s+/);
+      send("rate", val ? { currency, rate } : {});
+    });
+  }
+
   // Изменение цвета
-  btnColorBlack.addEventListener("click", () => ws.send("color black"));
-  btnColorWhite.addEventListener("click", () => ws.send("color white"));
+  btnColorBlack.addEventListener("click", () => send("color", { color: "black" }));
+  btnColorWhite.addEventListener("click", () => send("color", { color: "white" }));
 
   // Сохранение токена
   btnSaveToken.addEventListener("click", () => {
     const token = tokenInput.value.trim();
     if (token) {
-      ws.send(`token ${token}`);
+      send("token", { token });
     }
   });
 
+  // Итоги донатов за последние сутки
+  if (btnTotals) {
+    btnTotals.addEventListener("click", () => send("totals"));
+  }
+
   // Выход из DonationAlerts
   btnLogout.addEventListener("click", () => {
     if (confirm("Выйти из DonationAlerts и удалить сохранённые токены?")) {
-      ws.send("logout");
+      send("logout");
     }
   });
 });
@@ -1,75 +1,120 @@
-// Подключение к WebSocket для таймера
-const timerWS = new WebSocket(`ws://${location.host}/ws`);
-// Подключение к WebSocket для конфигурации (цвет и т.п.)
-const colorWS = new WebSocket(`ws://${location.host}/timer_cfg`);
+// Суффикс адресов таймера: "" для таймера по умолчанию, иначе "/<timer_id>"
+const SUFFIX = window.TIMER_SUFFIX || "";
+// Бинарный протокол событий: сервер шлёт только старт/стоп/добавление, время считаем сами.
+// wsp-overlay.1 — тот же протокол плюс кадры стиля: время и цвет идут одним сокетом
+const OVERLAY_SUBPROTOCOL = "wsp-overlay.1";
+const DELTA_SUBPROTOCOL = "wsp-delta.1";
+const FRAME_ADD = 4;
+const FRAME_STYLE = 5;
+const FRAME_PING = 6;
+const PONG = new Uint8Array([1, 7]); // <version> <PONG>
 
 const timerEl = document.getElementById("timer");
-let lastTime = null; // запоминаем предыдущее значение секунд
 
-// Получаем обновления времени от сервера
-timerWS.onmessage = (event) => {
-  if (timerEl) {
-    const newTime = event.data;
+// Локальная модель таймера
+let running = false;
+let remainingMs = 0; // остаток, пока таймер стоит
+let deadline = 0; // performance.now() окончания, пока таймер идёт
+let lastSec = null; // показанное значение (для анимации пополнения)
+let renderTimeout = null;
 
-    // Сравниваем новое и старое значение (HH:MM:SS → в секунды)
-    const toSeconds = (str) => {
-      const [h, m, s] = str.split(":").map(Number);
-      return h * 3600 + m * 60 + s;
-    };
+// DD:HH:MM:SS
+function formatTime(sec) {
+  const pad = (n) => String(n).padStart(2, "0");
+  const days = Math.floor(sec / 86400);
+  const hours = Math.floor((sec % 86400) / 3600);
+  const minutes = Math.floor((sec % 3600) / 60);
+  return `${pad(days)}:${pad(hours)}:${pad(minutes)}:${pad(sec % 60)}`;
+}
 
-    if (lastTime !== null) {
-      const prevSec = toSeconds(lastTime);
-      const newSec = toSeconds(newTime);
+// DD:HH:MM:SS (или HH:MM:SS) → секунды
+function parseTime(str) {
+  return str.split(":").map(Number).reduce((acc, v, i, parts) => {
+    const weights = [86400, 3600, 60, 1].slice(4 - parts.length);
+    return acc + v * weights[i];
+  }, 0);
+}
 
-      if (newSec > prevSec) {
-        // Было пополнение → запускаем анимацию
-        timerEl.classList.remove("timer-pulse");
-        void timerEl.offsetWidth; // хак для перезапуска CSS-анимации
-        timerEl.classList.add("timer-pulse");
-      }
-    }
+function pulse() {
+  if (!timerEl) return;
+  timerEl.classList.remove("timer-pulse");
+  void timerEl.offsetWidth; // хак для перезапуска CSS-анимации
+  timerEl.classList.add("timer-pulse");
+}
 
-    timerEl.textContent = newTime;
-    lastTime = newTime;
-  }
-};
+function show(sec) {
+  if (!timerEl) return;
+  if (lastSec !== null && sec > lastSec) pulse();
+  if (sec !== lastSec) timerEl.textContent = formatTime(sec);
+  lastSec = sec;
+}
 
-// Получаем обновления цвета от сервера
-colorWS.onmessage = (event) => {
-  if (timerEl) {
-    const color = event.data;
-    timerEl.style.color = color;
+// Перерисовать и запланировать следующую перерисовку ровно на границе секунды
+function render() {
+  clearTimeout(renderTimeout);
+  const left = running ? Math.max(deadline - performance.now(), 0) : remainingMs;
+  show(Math.ceil(left / 1000));
+  if (running && left > 0) {
+    renderTimeout = setTimeout(render, left % 1000 || 1000);
   }
-};
+}
+
+// Настройки отображения; неизвестные ключи пропускаем
+function applyStyle(style) {
+  if (timerEl && style.color) timerEl.style.color = style.color;
+}
 
-// Обработка ошибок соединения (для отладки)
-timerWS.onerror = (err) => {
-  console.error("Ошибка WebSocket таймера:", err);
-};
-colorWS.onerror = (err) => {
-  console.error("Ошибка WebSocket конфигурации:", err);
-};
+function applyFrame(buf, ws) {
+  const view = new DataView(buf);
+  const kind = view.getUint8(1);
+  if (kind === FRAME_PING) {
+    // Сервер проверяет, что оверлей жив: без ответа соединение будет закрыто
+    ws.send(PONG);
+    return;
+  }
+  if (kind === FRAME_STYLE) {
+    applyStyle(JSON.parse(new TextDecoder().decode(new Uint8Array(buf, 2))));
+    return;
+  }
+  const ms = Number(view.getBigInt64(3, true));
+  running = view.getUint8(2) === 1;
+  if (running) deadline = performance.now() + ms;
+  else remainingMs = ms;
+  if (kind === FRAME_ADD && Number(view.getBigInt64(11, true)) > 0) {
+    lastSec = null; // добавление видно анимацией, даже если секунда та же
+    pulse();
+  }
+  render();
+}
 
-// Автовосстановление соединения (по желанию)
-function reconnect(wsFactory, assignTo, delay = 2000) {
-  setTimeout(() => {
-    const ws = wsFactory();
-    assignTo(ws);
-  }, delay);
+// Подключение с автоматическим переподключением
+function connect(path, protocols, onMessage, label, onOpen) {
+  const ws = new WebSocket(`ws://${location.host}${path}${SUFFIX}`, protocols);
+  ws.binaryType = "arraybuffer";
+  ws.onmessage = (event) => onMessage(event, ws);
+  if (onOpen) ws.onopen = () => onOpen(ws);
+  ws.onerror = (err) => console.error(`Ошибка WebSocket ${label}:`, err);
+  ws.onclose = () => {
+    console.warn(`Соединение ${label} закрыто, переподключаем...`);
+    setTimeout(() => connect(path, protocols, onMessage, label, onOpen), 2000);
+  };
+  return ws;
 }
 
-timerWS.onclose = () => {
-  console.warn("Соединение таймера закрыто, переподключаем...");
-  reconnect(
-    () => new WebSocket(`ws://${location.host}/ws`),
-    (ws) => (timerWS = ws)
-  );
-};
+// Отдельный сокет настроек — только если сервер не поддержал единый канал
+let cfgSocket = null;
+function ensureCfgSocket(ws) {
+  if (ws.protocol === OVERLAY_SUBPROTOCOL || cfgSocket) return;
+  cfgSocket = connect("/timer_cfg", [], (event) => applyStyle({ color: event.data }), "настроек");
+}
 
-colorWS.onclose = () => {
-  console.warn("Соединение настроек закрыто, переподключаем...");
-  reconnect(
-    () => new WebSocket(`ws://${location.host}/timer_cfg`),
-    (ws) => (colorWS = ws)
-  );
-};
+// Время и стиль: бинарные кадры, а если сервер протокол не поддержал — строки DD:HH:MM:SS
+connect("/ws", [OVERLAY_SUBPROTOCOL, DELTA_SUBPROTOCOL], (event, ws) => {
+  if (event.data instanceof ArrayBuffer) {
+    applyFrame(event.data, ws);
+  } else {
+    running = false;
+    remainingMs = parseTime(event.data) * 1000;
+    render();
+  }
+}, "таймера", ensureCfgSocket);
@@ -0,0 +1,88 @@
+"""Микробенчмарк рассылки тика: форматирование и send_text на клиента против готового Frame.
+
+Запуск из корня репозитория:
+    python -m bench.bench_broadcast [--clients N] [--ticks N]
+
+Клиенты — настоящие starlette.websockets.WebSocket поверх фиктивного ASGI-транспорта,
+который только считает отправленные сообщения, поэтому меряется чистая стоимость
+пути «событие → сообщения в транспорт» без сети.
+"""
+
+import argparse
+import asyncio
+import sys
+import time
+
+from starlette.websockets import WebSocket
+
+from app.services.timer import format_time, time_frame
+
+
+async def _receive():
+    return {"type": "websocket.connect"}
+
+
+def _clients(n: int) -> tuple:
+    sent = []
+
+    async def send(message):
+        sent.append(message)
+
+    sockets = []
+    for _ in range(n):
+        ws = WebSocket({"type": "websocket", "path": "/ws", "headers": []}, _receive, send)
+        sockets.append(ws)
+    return sockets, sent
+
+
+async def legacy(sockets: list, ticks: int) -> None:
+    """Прежний путь: строка форматируется на событие, каждый клиент получает send_text."""
+    for sec in range(ticks, 0, -1):
+        msg = format_time(sec)
+        for ws in sockets:
+            await ws.send_text(msg)
+
+
+async def framed(sockets: list, ticks: int) -> None:
+    """Новый путь: кадр из кэша, одно и то же ASGI-сообщение во все сокеты."""
+    for sec in range(ticks, 0, -1):
+        message = time_frame(sec).message
+        for ws in sockets:
+            await ws.send(message)
+
+
+async def _accepted(n: int) -> tuple:
+    sockets, sent = _clients(n)
+    for ws in sockets:
+        await ws.accept()
+    sent.clear()
+    return sockets, sent
+
+
+async def bench(fn, clients: int, ticks: int) -> float:
+    """Вернуть среднее время доставки одного тика одному клиенту в микросекундах."""
+    sockets, sent = await _accepted(clients)
+    start = time.perf_counter()
+    await fn(sockets, ticks)
+    elapsed = time.perf_counter() - start
+    assert len(sent) == clients * ticks
+    return elapsed / (clients * ticks) * 1e6
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=500)
+    parser.add_argument("--ticks", type=int, default=200)
+    args = parser.parse_args()
+
+    t_old = asyncio.run(bench(legacy, args.clients, args.ticks))
+    t_new = asyncio.run(bench(framed, args.clients, args.ticks))
+    print(f"клиентов x тиков: {args.clients} x {args.ticks}")
+    print(f"send_text:        {t_old:.3f} мкс/сообщение")
+    print(f"Frame:            {t_new:.3f} мкс/сообщение")
+    print(f"ускорение:        x{t_old / t_new:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,103 @@
+"""Микробенчмарк разбора сообщений Centrifugo: старый рекурсивный поиск против текущего пути.
+
+Запуск из корня репозитория:
+    python -m bench.bench_parser [--rounds N] [--repeat N]
+
+Корпус — bench/data/centrifugo_frames.jsonl: по одному сообщению WebSocket на строку
+(ответы на connect/subscribe, пинги, публикации донатов и одна публикация незнакомой формы).
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+from app.services.donation_parser import decode_message, parse_publication, worth_parsing
+
+CORPUS = Path(__file__).resolve().parent / "data" / "centrifugo_frames.jsonl"
+
+
+def extract_amount_anywhere(obj):
+    """Прежняя реализация: рекурсивный поиск суммы по всему дереву JSON."""
+    if isinstance(obj, dict):
+        for key in ("amount", "amount_main"):
+            if key in obj:
+                return obj[key]
+        for v in obj.values():
+            val = extract_amount_anywhere(v)
+            if val is not None:
+                return val
+    elif isinstance(obj, list):
+        for v in obj:
+            val = extract_amount_anywhere(v)
+            if val is not None:
+                return val
+    return None
+
+
+def legacy(raw: str):
+    """Путь сообщения в прежнем donation_manager."""
+    data = json.loads(raw)
+    return extract_amount_anywhere(data.get("result") or {})
+
+
+def current(raw: str):
+    """Путь сообщения в donation_manager: отсев worth_parsing, decode_message, parse_publication."""
+    if not worth_parsing(raw):
+        return None
+    msg = decode_message(raw)
+    result = msg.get("result")
+    if not isinstance(result, dict):
+        return None
+    if msg.get("id") == 2:
+        # Ответ на подписку: восстановленные публикации
+        for pub in result.get("publications") or []:
+            donation = parse_publication(pub)
+            if donation is not None:
+                return donation
+        return None
+    if "data" not in result:
+        return None
+    return parse_publication(result["data"])
+
+
+def bench(fn, frames: list, rounds: int) -> float:
+    """Вернуть среднее время обработки одного сообщения в микросекундах."""
+    start = time.perf_counter()
+    for _ in range(rounds):
+        for raw in frames:
+            fn(raw)
+    return (time.perf_counter() - start) / (rounds * len(frames)) * 1e6
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rounds", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5, help="прогонов каждой реализации, берётся лучший")
+    args = parser.parse_args()
+
+    frames = CORPUS.read_text(encoding="utf-8").splitlines()
+
+    # Обе реализации должны находить одни и те же суммы
+    for raw in frames:
+        old = legacy(raw)
+        new = current(raw)
+        if (old is None) != (new is None) or (new is not None and float(old) != float(new.amount)):
+            print(f"расхождение на кадре: {raw[:120]}", file=sys.stderr)
+            return 1
+
+    # Прогоны чередуются, чтобы фоновая нагрузка не досталась одной реализации
+    t_old = t_new = float("inf")
+    for _ in range(args.repeat):
+        t_old = min(t_old, bench(legacy, frames, args.rounds))
+        t_new = min(t_new, bench(current, frames, args.rounds))
+    print(f"кадров в корпусе:      {len(frames)}")
+    print(f"extract_amount_anywhere: {t_old:.2f} мкс/кадр")
+    print(f"parse_publication:       {t_new:.2f} мкс/кадр")
+    print(f"ускорение:               x{t_old / t_new:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,242 @@
+"""Стенд соединений: память на одно соединение, лимит эндпоинта и отключение молчащих.
+
+Запуск из корня репозитория:
+    python -m bench.conn_memory [--clients 2000] [--budget-kb 48]
+
+Приложение запускается в отдельном процессе с MAX_WS_CLIENTS = --clients и короткими
+PING_INTERVAL/PING_TIMEOUT. Дальше три проверки:
+
+1. Память: RSS процесса приложения до и после подключения --clients оверлеев
+   (канал wsp-overlay.1); прирост на соединение сравнивается с бюджетом --budget-kb.
+2. Лимит: следующее сверх лимита соединение закрывается с кодом 1013.
+3. Живость: половина клиентов перестаёт отвечать на пинг; через PING_TIMEOUT
+   они должны быть отключены, а отвечающие — остаться. Текстовая панель /control
+   (без подпротокола) молчит всё это время: пингов она получать не должна
+   и отключать её нельзя.
+
+Код выхода — 1, если хоть одна проверка не прошла.
+"""
+
+import argparse
+import asyncio
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import websockets
+
+from app.core.protocol import OVERLAY_SUBPROTOCOL, PING, PONG_FRAME
+from bench.loadtest import ROOT, _free_port, _proc_sample, _wait_http
+
+# Бюджет прироста RSS приложения на одно соединение оверлея, КБ
+BUDGET_KB = 48
+
+# Проверка живости в стенде: пинг раз в секунду, отключение после 3 секунд молчания
+PING_INTERVAL = 1
+PING_TIMEOUT = 3
+
+
+class Client:
+    """Оверлей: читает кадры и отвечает на пинг, пока не велят замолчать."""
+
+    def __init__(self) -> None:
+        self.ws = None
+        self.silent = False
+        self.ready = asyncio.Event()
+        self.closed = asyncio.Event()
+
+    async def run(self, url: str) -> None:
+        try:
+            # Пинги протокола WebSocket клиента отключены: живость проверяет приложение
+            async with websockets.connect(
+                url, subprotocols=[OVERLAY_SUBPROTOCOL], ping_interval=None, open_timeout=30
+            ) as ws:
+                self.ws = ws
+                async for msg in ws:
+                    self.ready.set()
+                    if isinstance(msg, bytes) and msg[1] == PING and not self.silent:
+                        await ws.send(PONG_FRAME)
+        except (OSError, websockets.WebSocketException):
+            pass
+        finally:
+            self.ready.set()
+            self.closed.set()
+
+
+class LegacyControl:
+    """Текстовая панель /control без подпротокола: ничего не шлёт, только читает."""
+
+    def __init__(self) -> None:
+        self.ws = None
+        self.pings = 0
+        self.close_code = None
+
+    async def run(self, url: str) -> None:
+        try:
+            async with websockets.connect(url, ping_interval=None) as ws:
+                self.ws = ws
+                async for msg in ws:
+                    if isinstance(msg, bytes):
+                        self.pings += 1
+        except (OSError, websockets.WebSocketException):
+            pass
+        finally:
+            if self.ws is not None:
+                self.close_code = self.ws.close_code
+
+
+def _metric(base: str, name: str, labels: str) -> float:
+    """Значение метрики приложения из /metrics."""
+    text = urllib.request.urlopen(f"http://{base}/metrics", timeout=5).read().decode()
+    for line in text.splitlines():
+        if line.startswith(f"{name}{{{labels}}} "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+async def _connect(url: str, count: int, batch: int = 200) -> list:
+    """Подключить count клиентов пачками и дождаться первого кадра у каждого."""
+    clients = []
+    for start in range(0, count, batch):
+        chunk = [Client() for _ in range(min(batch, count - start))]
+        for c in chunk:
+            asyncio.create_task(c.run(url))
+        await asyncio.gather(*(c.ready.wait() for c in chunk))
+        clients.extend(chunk)
+    return clients
+
+
+async def _rejected_code(url: str) -> int | None:
+    """Код закрытия соединения сверх лимита (None — соединение не закрыли)."""
+    async with websockets.connect(url, subprotocols=[OVERLAY_SUBPROTOCOL], ping_interval=None) as ws:
+        try:
+            while True:
+                await asyncio.wait_for(ws.recv(), 5)
+        except websockets.ConnectionClosed:
+            return ws.close_code
+        except asyncio.TimeoutError:
+            return None
+
+
+async def run(args) -> dict:
+    port = _free_port()
+    base = f"127.0.0.1:{port}"
+    url = f"ws://{base}/ws"
+    workdir = tempfile.mkdtemp(prefix="wsp-conn-")
+    env = dict(
+        os.environ,
+        PYTHONPATH=str(ROOT),
+        MAX_WS_CLIENTS=str(args.clients),
+        PING_INTERVAL=str(PING_INTERVAL),
+        PING_TIMEOUT=str(PING_TIMEOUT),
+    )
+    command = [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"]
+    # Как в run_app.py: без сжатия WebSocket
+    command += ["--ws-per-message-deflate", "false"]
+    proc = subprocess.Popen(
+        command,
+        cwd=workdir,
+        env=env,
+    )
+    clients = []
+    try:
+        await _wait_http(f"http://{base}/health", 30)
+        # Прогрев: первые соединения подтягивают код и буферы, которые не относятся к клиентам
+        warm = await _connect(url, 20)
+        for c in warm:
+            await c.ws.close()
+        await asyncio.sleep(1)
+        rss0 = _proc_sample(proc.pid)[1]
+
+        t0 = time.perf_counter()
+        clients = await _connect(url, args.clients)
+        connect_seconds = time.perf_counter() - t0
+        await asyncio.sleep(1)
+        rss1 = _proc_sample(proc.pid)[1]
+        connected = sum(not c.closed.is_set() for c in clients)
+
+        rejected_code = await _rejected_code(url)
+
+        legacy = LegacyControl()
+        legacy_task = asyncio.create_task(legacy.run(f"ws://{base}/control"))
+
+        # Половина клиентов замолкает: их должен отключить обход живости
+        for c in clients[::2]:
+            c.silent = True
+        await asyncio.sleep(PING_TIMEOUT + 2 * PING_INTERVAL + 1)
+        silent_left = sum(not c.closed.is_set() for c in clients[::2])
+        alive_left = sum(not c.closed.is_set() for c in clients[1::2])
+        server_count = _metric(base, "wsp_endpoint_connections", 'endpoint="ws"')
+        legacy_open = not legacy_task.done()
+        if legacy.ws is not None:
+            await legacy.ws.close()
+    finally:
+        for c in clients:
+            if c.ws is not None:
+                await c.ws.close()
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    return {
+        "clients": args.clients,
+        "connected": connected,
+        "connect_seconds": connect_seconds,
+        "rss_before_mb": rss0,
+        "rss_after_mb": rss1,
+        "kb_per_connection": (rss1 - rss0) * 1024 / args.clients,
+        "over_limit_close_code": rejected_code,
+        "silent_left": silent_left,
+        "alive_left": alive_left,
+        "alive_expected": len(clients[1::2]),
+        "server_connections": server_count,
+        "legacy_control_open": legacy_open,
+        "legacy_control_pings": legacy.pings,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--clients", type=int, default=2000, help="сколько оверлеев подключить")
+    parser.add_argument("--budget-kb", type=float, default=BUDGET_KB, help="бюджет памяти на соединение, КБ")
+    args = parser.parse_args()
+
+    # Тысячи сокетов в стенде и в приложении (лимит наследуется дочерним процессом)
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (max(soft, min(hard, 4 * args.clients + 256)), hard))
+
+    result = asyncio.run(run(args))
+    for key, value in result.items():
+        print(f"{key}: {value:.2f}" if isinstance(value, float) else f"{key}: {value}")
+
+    failures = []
+    if result["connected"] != args.clients:
+        failures.append(f"подключено {result['connected']} из {args.clients}")
+    if result["kb_per_connection"] > args.budget_kb:
+        failures.append(f"память: {result['kb_per_connection']:.1f} КБ на соединение > {args.budget_kb:.1f} КБ")
+    if result["over_limit_close_code"] != 1013:
+        failures.append(f"сверх лимита: код закрытия {result['over_limit_close_code']}, ожидался 1013")
+    if result["silent_left"]:
+        failures.append(f"молчащих не отключено: {result['silent_left']}")
+    if result["alive_left"] != result["alive_expected"]:
+        failures.append(f"отключены отвечающие: осталось {result['alive_left']} из {result['alive_expected']}")
+    if not result["legacy_control_open"] or result["legacy_control_pings"]:
+        failures.append(
+            f"текстовая панель /control: пингов {result['legacy_control_pings']}, "
+            f"открыта {result['legacy_control_open']}"
+        )
+    for line in failures:
+        print(f"регрессия: {line}", file=sys.stderr)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,90 @@
+"""Локальная заглушка DonationAlerts для нагрузочного стенда.
+
+Отвечает на те же REST-запросы, что делает app/services/donationalerts.py
+(/oauth/token, /api/v1/user/oauth, /api/v1/centrifuge/subscribe), и изображает
+Centrifugo на /connection/websocket: connect, subscribe и рассылку публикаций донатов.
+"""
+
+import asyncio
+import itertools
+import json
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route, WebSocketRoute
+from starlette.websockets import WebSocket, WebSocketDisconnect
+
+USER_ID = 1
+CHANNEL = f"$alerts:donation_{USER_ID}"
+
+
+class FakeDonationAlerts:
+    """REST + Centrifugo в одном Starlette-приложении; публикации шлются методом publish."""
+
+    def __init__(self) -> None:
+        self.sockets: set = set()
+        self.offset = 0
+        self.subscribed = asyncio.Event()
+        self._ids = itertools.count(1)
+        self.app = Starlette(
+            routes=[
+                Route("/oauth/token", self._token, methods=["POST"]),
+                Route("/api/v1/user/oauth", self._user),
+                Route("/api/v1/centrifuge/subscribe", self._subscribe, methods=["POST"]),
+                WebSocketRoute("/connection/websocket", self._centrifugo),
+            ]
+        )
+
+    async def _token(self, request):
+        return JSONResponse(
+            {"access_token": "bench-access", "refresh_token": "bench-refresh", "expires_in": 86400}
+        )
+
+    async def _user(self, request):
+        return JSONResponse({"data": {"id": USER_ID, "socket_connection_token": "bench-socket"}})
+
+    async def _subscribe(self, request):
+        return JSONResponse({"channels": [{"channel": CHANNEL, "token": "bench-sub"}]})
+
+    async def _centrifugo(self, ws: WebSocket):
+        await ws.accept()
+        try:
+            while True:
+                msg = json.loads(await ws.receive_text())
+                if msg.get("id") == 1:
+                    await ws.send_text(json.dumps({"id": 1, "result": {"client": "bench-client"}}))
+                elif msg.get("method") == 1:
+                    reply = {"epoch": "bench", "offset": self.offset, "recoverable": True}
+                    await ws.send_text(json.dumps({"id": msg["id"], "result": reply}))
+                    self.sockets.add(ws)
+                    self.subscribed.set()
+        except WebSocketDisconnect:
+            pass
+        finally:
+            self.sockets.discard(ws)
+
+    async def publish(self, amount: float, currency: str = "RUB") -> None:
+        """Разослать публикацию доната всем подписанным клиентам."""
+        self.offset += 1
+        donation_id = next(self._ids)
+        frame = json.dumps(
+            {
+                "result": {
+                    "channel": CHANNEL,
+                    "data": {
+                        "offset": self.offset,
+                        "data": {
+                            "id": donation_id,
+                            "name": "Donations",
+                            "username": f"bench{donation_id}",
+                            "message": "нагрузочный тест",
+                            "amount": amount,
+                            "currency": currency,
+                            "amount_in_user_currency": amount,
+                        },
+                    },
+                }
+            }
+        )
+        for ws in list(self.sockets):
+            await ws.send_text(frame)
@@ -0,0 +1,399 @@
+"""Нагрузочный стенд: приложение + заглушка DonationAlerts + множество клиентов.
+
+Запуск из корня репозитория:
+    python -m bench.loadtest --overlays 200 --controls 5 --donations 300 --rate 100
+
+Стенд поднимает заглушку DonationAlerts (bench/fake_da.py) и приложение из app/main.py
+в отдельном процессе, подключает N оверлеев к /ws и M панелей к /control и проводит две фазы:
+
+1. Тики: таймер запущен, по интервалам между сообщениями оверлеям считается джиттер тиков.
+2. Донаты: таймер остановлен, заглушка публикует донаты с заданной частотой (1 ₽ = 1 сек),
+   и для каждого оверлея меряется задержка от публикации до прихода нового значения.
+
+С --proto delta оверлеи подключаются по бинарному протоколу событий (wsp-delta.1):
+тиков по сети нет, поэтому вместо джиттера смотрите на frames_per_overlay.
+С --proto overlay — по единому каналу wsp-overlay.1 (время и стиль одним сокетом).
+
+С --workers N приложение запускается N воркерами uvicorn (WORKERS=N, см. app.core.bus):
+клиенты распределяются по воркерам, донаты и тики идут от ведущего через шину.
+
+Также снимаются CPU и память процесса приложения (с --workers — сумма по воркерам). Результат сравнивается с
+bench/baseline.json (если он есть); при регрессии сверх допуска код выхода — 1. База хранит
+параметры своего прогона (PARAMS): если они отличаются от текущих, сравнение пропускается.
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+from pathlib import Path
+
+import uvicorn
+import websockets
+
+from app.core.protocol import DELTA_SUBPROTOCOL, OVERLAY_SUBPROTOCOL, PING, PONG_FRAME, STYLE, decode_frame
+from bench.fake_da import FakeDonationAlerts
+
+ROOT = Path(__file__).resolve().parent.parent
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+
+# Метрики, для которых меньше — лучше; именно они сравниваются с базовой линией
+TRACKED = (
+    "donation_latency_p50_ms",
+    "donation_latency_p99_ms",
+    "tick_jitter_p99_ms",
+    "cpu_percent",
+    "rss_mb",
+)
+
+
+# Параметры прогона: с базой сравнивается только прогон с теми же значениями
+PARAMS = ("proto", "workers", "overlays", "controls", "donations", "rate", "tick_seconds")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _percentile(values: list, q: float) -> float:
+    """Перцентиль q (0..100) по методу ближайшего ранга."""
+    if not values:
+        return float("nan")
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered)) - 1))
+    return ordered[k]
+
+
+def _parse_time(text: str) -> int | None:
+    """DD:HH:MM:SS → секунды (None для прочих сообщений)."""
+    try:
+        d, h, m, s = (int(x) for x in text.split(":"))
+    except ValueError:
+        return None
+    return ((d * 24 + h) * 60 + m) * 60 + s
+
+
+def _children(pid: int) -> list:
+    """Дочерние процессы (воркеры uvicorn) по /proc; пустой список, если узнать нельзя."""
+    try:
+        return [int(c) for c in Path(f"/proc/{pid}/task/{pid}/children").read_text().split()]
+    except (OSError, ValueError):
+        return []
+
+
+def _tree_sample(pid: int) -> tuple[float, float] | None:
+    """Как _proc_sample, но сумма по процессу и его воркерам."""
+    samples = [s for s in map(_proc_sample, [pid] + _children(pid)) if s is not None]
+    if not samples:
+        return None
+    return sum(s[0] for s in samples), sum(s[1] for s in samples)
+
+
+def _proc_sample(pid: int) -> tuple[float, float] | None:
+    """Вернуть (CPU-время в секундах, RSS в МБ) процесса или None, если снять нельзя."""
+    try:
+        import psutil
+
+        p = psutil.Process(pid)
+        t = p.cpu_times()
+        return t.user + t.system, p.memory_info().rss / 2**20
+    except ImportError:
+        pass
+    try:
+        fields = Path(f"/proc/{pid}/stat").read_text().rsplit(")", 1)[1].split()
+        ticks = os.sysconf("SC_CLK_TCK")
+        cpu = (int(fields[11]) + int(fields[12])) / ticks
+        rss = int(fields[21]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+        return cpu, rss
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+class Overlay:
+    """Клиент оверлея /ws: запоминает время прихода и значение каждого сообщения."""
+
+    def __init__(self, url: str, subprotocol: str | None = None) -> None:
+        self.url = url
+        self.subprotocol = subprotocol
+        self.events: list = []
+        self.frames = 0
+        self.ws = None
+
+    async def run(self) -> None:
+        protocols = [self.subprotocol] if self.subprotocol else None
+        async with websockets.connect(self.url, max_queue=None, subprotocols=protocols) as ws:
+            self.ws = ws
+            async for msg in ws:
+                if isinstance(msg, bytes) and msg[1] == PING:
+                    await ws.send(PONG_FRAME)
+                    continue
+                self.frames += 1
+                if isinstance(msg, bytes) and msg[1] == STYLE:
+                    continue
+                if isinstance(msg, bytes):
+                    value = math.ceil(decode_frame(msg)[2] / 1000)
+                else:
+                    value = _parse_time(msg)
+                if value is not None:
+                    self.events.append((time.perf_counter(), value))
+
+    @property
+    def last_value(self) -> int | None:
+        return self.events[-1][1] if self.events else None
+
+
+async def _drain(url: str, inbox: list | None = None, ready: asyncio.Event | None = None) -> None:
+    """Клиент панели управления: читает всё, что присылает сервер."""
+    async with websockets.connect(url, max_queue=None) as ws:
+        if ready is not None:
+            ready.set()
+        async for msg in ws:
+            if isinstance(msg, bytes):
+                await ws.send(PONG_FRAME)  # ответ на пинг сервера
+            elif inbox is not None:
+                inbox.append(msg)
+
+
+async def _wait_http(url: str, timeout: float) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            await asyncio.to_thread(urllib.request.urlopen, url, timeout=1)
+            return
+        except Exception:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def run(args) -> dict:
+    fake = FakeDonationAlerts()
+    fake_port = _free_port()
+    fake_server = uvicorn.Server(
+        uvicorn.Config(fake.app, host="127.0.0.1", port=fake_port, log_level="warning")
+    )
+    fake_task = asyncio.create_task(fake_server.serve())
+
+    app_port = _free_port()
+    workdir = tempfile.mkdtemp(prefix="wsp-bench-")
+    env = dict(
+        os.environ,
+        PYTHONPATH=str(ROOT),
+        DA_BASE_URL=f"http://127.0.0.1:{fake_port}",
+        DA_WS_URL=f"ws://127.0.0.1:{fake_port}/connection/websocket",
+        DA_CLIENT_ID="bench",
+        DA_CLIENT_SECRET="bench",
+        RUB_TO_SEC="1",
+        WORKERS=str(args.workers),
+        BUS_PORT=str(_free_port()),
+    )
+    command = [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(app_port), "--log-level", "warning"]
+    # Как в run_app.py: без сжатия WebSocket
+    command += ["--ws-per-message-deflate", "false"]
+    if args.workers > 1:
+        command += ["--workers", str(args.workers)]
+    proc = subprocess.Popen(
+        command,
+        cwd=workdir,
+        env=env,
+    )
+    base = f"127.0.0.1:{app_port}"
+    tasks = []
+    try:
+        await _wait_http(f"http://{base}/health", 30)
+
+        # OAuth через заглушку: /callback сохраняет токены, команда token запускает листенер
+        await asyncio.to_thread(_get_no_redirect, f"http://{base}/callback?code=bench")
+
+        control_inbox: list = []
+        ready = asyncio.Event()
+        tasks.append(asyncio.create_task(_drain(f"ws://{base}/control", control_inbox, ready)))
+        for _ in range(args.controls - 1):
+            tasks.append(asyncio.create_task(_drain(f"ws://{base}/control")))
+        await ready.wait()
+
+        subprotocol = {"delta": DELTA_SUBPROTOCOL, "overlay": OVERLAY_SUBPROTOCOL}.get(args.proto)
+        overlays = [Overlay(f"ws://{base}/ws", subprotocol) for _ in range(args.overlays)]
+        tasks.extend(asyncio.create_task(o.run()) for o in overlays)
+
+        async with websockets.connect(f"ws://{base}/control") as ctl:
+            await ctl.send("token ")
+            await asyncio.wait_for(fake.subscribed.wait(), 15)
+
+            # ---- Фаза 1: тики ----
+            await ctl.send("set 10:00:00")
+            await asyncio.sleep(0.5)
+            cpu0 = _tree_sample(proc.pid)
+            t0 = time.perf_counter()
+            await ctl.send("start")
+            await asyncio.sleep(args.tick_seconds)
+            await ctl.send("stop")
+            t1 = time.perf_counter()
+            cpu1 = _tree_sample(proc.pid)
+            await asyncio.sleep(0.5)
+
+            jitter = []
+            for o in overlays:
+                ticks = [t for t, _ in o.events if t0 <= t <= t1]
+                jitter.extend(abs((b - a) - 1.0) * 1000 for a, b in zip(ticks, ticks[1:]))
+
+            # ---- Фаза 2: донаты ----
+            start_values = [o.last_value for o in overlays]
+            sent_at = []
+            interval = 1.0 / args.rate
+            cpu2 = _tree_sample(proc.pid)
+            t2 = time.perf_counter()
+            for i in range(args.donations):
+                sent_at.append(time.perf_counter())
+                await fake.publish(1)
+                # Выдерживаем темп по абсолютному расписанию, без накопления отставания
+                delay = t2 + (i + 1) * interval - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+
+            # Ждём, пока все оверлеи увидят последний донат
+            deadline = time.monotonic() + args.settle
+            while time.monotonic() < deadline:
+                if all(
+                    o.last_value is not None and v0 is not None and o.last_value - v0 >= args.donations
+                    for o, v0 in zip(overlays, start_values)
+                ):
+                    break
+                await asyncio.sleep(0.05)
+            t3 = time.perf_counter()
+            cpu3 = _tree_sample(proc.pid)
+
+        latencies = []
+        missing = 0
+        for o, v0 in zip(overlays, start_values):
+            if v0 is None:
+                missing += args.donations
+                continue
+            seen = 0
+            for t, value in o.events:
+                if t < t2:
+                    continue
+                # Значение v означает, что применены первые (v - v0) донатов
+                while seen < min(value - v0, args.donations):
+                    latencies.append((t - sent_at[seen]) * 1000)
+                    seen += 1
+            missing += args.donations - seen
+
+        result = {
+            "proto": args.proto,
+            "workers": args.workers,
+            "overlays": args.overlays,
+            "controls": args.controls,
+            "donations": args.donations,
+            "rate": args.rate,
+            "tick_seconds": args.tick_seconds,
+            "donation_latency_p50_ms": _percentile(latencies, 50),
+            "donation_latency_p95_ms": _percentile(latencies, 95),
+            "donation_latency_p99_ms": _percentile(latencies, 99),
+            "donations_missing": missing,
+            "tick_jitter_p50_ms": _percentile(jitter, 50),
+            "tick_jitter_p99_ms": _percentile(jitter, 99),
+            "frames_per_overlay": sum(o.frames for o in overlays) / max(len(overlays), 1),
+        }
+        if cpu0 and cpu1 and cpu2 and cpu3:
+            busy = (cpu1[0] - cpu0[0]) + (cpu3[0] - cpu2[0])
+            result["cpu_percent"] = busy / ((t1 - t0) + (t3 - t2)) * 100
+            result["rss_mb"] = cpu3[1]
+        return result
+    finally:
+        for t in tasks:
+            t.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+        fake_server.should_exit = True
+        await fake_task
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _get_no_redirect(url: str) -> None:
+    """GET без следования редиректу (/callback отвечает 307 на /config)."""
+
+    class NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *a, **kw):
+            return None
+
+    opener = urllib.request.build_opener(NoRedirect)
+    try:
+        opener.open(url, timeout=10)
+    except urllib.error.HTTPError as e:
+        if e.code not in (302, 303, 307):
+            raise
+
+
+def mismatched(result: dict, baseline: dict) -> list:
+    """Параметры прогона, которыми он отличается от базовой линии."""
+    return [f"{key} {baseline.get(key)} → {result[key]}" for key in PARAMS if baseline.get(key) != result[key]]
+
+
+def compare(result: dict, baseline: dict, tolerance: float) -> list:
+    """Вернуть список регрессий: метрики, превысившие базовую линию больше чем на tolerance."""
+    failures = []
+    for key in TRACKED:
+        if key not in baseline or key not in result:
+            continue
+        limit = baseline[key] * (1 + tolerance)
+        if result[key] > limit:
+            failures.append(f"{key}: {result[key]:.2f} > {limit:.2f} (база {baseline[key]:.2f})")
+    return failures
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--overlays", type=int, default=100, help="клиентов /ws")
+    parser.add_argument("--controls", type=int, default=3, help="клиентов /control")
+    parser.add_argument("--donations", type=int, default=200, help="донатов в фазе 2")
+    parser.add_argument("--rate", type=float, default=50.0, help="донатов в секунду")
+    parser.add_argument("--tick-seconds", type=float, default=5.0, help="длительность фазы 1")
+    parser.add_argument("--proto", choices=("text", "delta", "overlay"), default="text", help="протокол оверлеев")
+    parser.add_argument("--workers", type=int, default=1, help="воркеров uvicorn у приложения")
+    parser.add_argument("--settle", type=float, default=10.0, help="сколько ждать доставки")
+    parser.add_argument("--tolerance", type=float, default=0.5, help="допуск регрессии (доля)")
+    parser.add_argument("--save-baseline", action="store_true", help="записать результат как базу")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+
+    if args.save_baseline:
+        BASELINE.write_text(json.dumps(result, ensure_ascii=False, indent=2) + "\n", encoding="utf-8")
+        print(f"базовая линия сохранена: {BASELINE}")
+        return 0
+
+    if result["donations_missing"]:
+        print(f"потеряно доставок донатов: {result['donations_missing']}", file=sys.stderr)
+        return 1
+    if BASELINE.exists():
+        baseline = json.loads(BASELINE.read_text(encoding="utf-8"))
+        differ = mismatched(result, baseline)
+        if differ:
+            # Метрики прогона с другой нагрузкой с базой несравнимы
+            print(f"база снята с другими параметрами ({', '.join(differ)}): сравнение пропущено", file=sys.stderr)
+            return 0
+        failures = compare(result, baseline, args.tolerance)
+        for line in failures:
+            print(f"регрессия: {line}", file=sys.stderr)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+"""Стенд холодного старта: сколько проходит от запуска до первого кадра оверлея.
+
+Запуск из корня репозитория:
+    python -m bench.startup [--runs 5] [--budget 1.0] [--top 15]
+
+Каждый прогон запускает ``run_app.py`` в отдельном процессе и подключается к /ws,
+пока не придёт первое сообщение, — так OBS видит таймер после старта. Папка данных
+общая для прогонов, поэтому начиная со второго идёт и восстановление состояния.
+
+Дополнительно снимается профиль ``python -X importtime -c "import app.main"``:
+самые дорогие модули и проверка, что модули интеграции с DonationAlerts
+(app.main.INTEGRATION_MODULES и jinja2) не импортируются при старте.
+Код выхода — 1, если медиана превышает бюджет или ленивые модули загружены сразу.
+"""
+
+import argparse
+import asyncio
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import websockets
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Бюджет времени «запуск → первый кадр оверлея», секунд
+BUDGET = 1.0
+
+# Модули, которые не должны грузиться при импорте app.main
+LAZY_MODULES = ("httpx", "websockets", "jinja2", "app.services.donationalerts")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+async def _first_frame(url: str, timeout: float) -> None:
+    """Подключаться к оверлею, пока сервер не ответит первым сообщением."""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with websockets.connect(url, open_timeout=1) as ws:
+                await asyncio.wait_for(ws.recv(), 1)
+                return
+        except (OSError, asyncio.TimeoutError, websockets.InvalidHandshake):
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.01)
+
+
+def measure(workdir: str, timeout: float = 30.0) -> float:
+    """Один холодный старт: секунды от запуска процесса до первого кадра на /ws."""
+    port = _free_port()
+    env = dict(os.environ, PYTHONPATH=str(ROOT), PORT=str(port))
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, str(ROOT / "run_app.py")],
+        cwd=workdir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    try:
+        asyncio.run(_first_frame(f"ws://127.0.0.1:{port}/ws", timeout))
+        return time.perf_counter() - t0
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+def import_profile(workdir: str) -> list:
+    """Профиль импорта app.main: [(модуль, собственное время мкс, суммарное мкс)] в порядке загрузки."""
+    out = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app.main"],
+        cwd=workdir,
+        env=dict(os.environ, PYTHONPATH=str(ROOT)),
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stderr
+    rows = []
+    for line in out.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        rows.append((name.strip(), int(self_us), int(cumulative_us)))
+    return rows
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5, help="число холодных стартов")
+    parser.add_argument("--budget", type=float, default=BUDGET, help="бюджет медианы, секунд")
+    parser.add_argument("--top", type=int, default=15, help="сколько самых дорогих модулей показать")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="wsp-startup-")
+    try:
+        profile = import_profile(workdir)
+        times = [measure(workdir) for _ in range(args.runs)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    total = next((cum for name, _, cum in profile if name == "app.main"), 0)
+    print(f"import app.main: {total / 1000:.1f} мс")
+    print("самые дорогие модули (собственное время):")
+    for name, self_us, cum in sorted(profile, key=lambda r: r[1], reverse=True)[: args.top]:
+        print(f"  {self_us / 1000:8.1f} мс  (всего {cum / 1000:8.1f} мс)  {name}")
+
+    median = statistics.median(times)
+    print(f"запуск → первый кадр /ws: медиана {median:.3f} с, макс {max(times):.3f} с, бюджет {args.budget:.3f} с")
+
+    failed = False
+    eager = sorted({name for name, _, _ in profile} & set(LAZY_MODULES))
+    if eager:
+        print(f"загружены при старте, хотя должны лениво: {', '.join(eager)}", file=sys.stderr)
+        failed = True
+    if median > args.budget:
+        print(f"регрессия: медиана {median:.3f} с > бюджета {args.budget:.3f} с", file=sys.stderr)
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
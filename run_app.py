@@ -3,6 +3,7 @@
 import os
 import sys
 import asyncio
+import multiprocessing
 
 # На Windows задаём стабильный event loop
 if sys.platform.startswith("win"):
@@ -11,14 +12,9 @@ if sys.platform.startswith("win"):
     except Exception:
         pass
 
-# SSL для httpx внутри exe
-try:
-    import certifi
-
-    os.environ.setdefault("SSL_CERT_FILE", certifi.where())
-except Exception:
-    pass
+# Сертификаты для httpx внутри exe подставляет app.services.http_client при создании клиента
 
+from app.core.config import cfg
 from app.main import app as fastapi_app
 
 
@@ -27,14 +23,20 @@ def main():
     import uvicorn
 
     port = int(os.getenv("PORT", "8000"))
+    # Несколько воркеров uvicorn запускает только по строке импорта приложения
     uvicorn.run(
-        fastapi_app,
+        "app.main:app" if cfg.workers > 1 else fastapi_app,
         host="0.0.0.0",
         port=port,
+        workers=cfg.workers if cfg.workers > 1 else None,
+        # Кадры оверлея — единицы байт: сжатие не нужно, а его zlib-буферы — ~45 КБ на сокет
+        ws_per_message_deflate=False,
         log_level="info",
         reload=False,
     )
 
 
 if __name__ == "__main__":
+    # Воркеры — дочерние процессы; в собранном exe без этого они снова запускали бы main()
+    multiprocessing.freeze_support()
     main()
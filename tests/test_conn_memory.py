@@ -0,0 +1,22 @@
+"""Регрессия памяти и живости соединений: стенд bench.conn_memory на малом числе клиентов."""
+
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+# Хватает, чтобы прирост RSS на соединение не тонул в шуме, и стенд идёт ~10 секунд
+CLIENTS = 200
+
+
+def test_conn_memory_budget():
+    """Память на соединение в бюджете, лимит закрывает с 1013, молчащие отключаются."""
+    proc = subprocess.run(
+        [sys.executable, "-m", "bench.conn_memory", "--clients", str(CLIENTS)],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        timeout=120,
+    )
+    assert proc.returncode == 0, proc.stdout + proc.stderr